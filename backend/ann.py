@@ -0,0 +1,150 @@
+import math
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .retrieval import top_k_indices
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, iterations: int, seed: int) -> np.ndarray:
+    # k-means on the unit sphere: assignment by dot product, centroids
+    # renormalized after every update. Empty clusters are re-seeded from
+    # the points worst served by their current centroid.
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        sims = vectors @ centroids.T
+        assign = np.argmax(sims, axis=1)
+        best = sims[np.arange(len(vectors)), assign]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = vectors[np.argsort(best)[: empty.size]]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        np.divide(sums, norms, out=sums, where=norms > 0)
+        centroids = sums
+    return centroids.astype(np.float32)
+
+
+# Inverted-file index over L2-normalized vectors (IVF-flat): vectors are
+# bucketed by their nearest k-means centroid and a query only scans the
+# `nprobe` closest buckets. Each bucket is an immutable (ids, vectors) pair
+# that writers replace wholesale, so searches need no lock.
+class IVFFlatIndex:
+    def __init__(self, nlist: int = 0, nprobe: int = 8, iterations: int = 15, seed: int = 0) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_on = 0
+        self._lists: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._where: dict = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def dim(self) -> int:
+        return 0 if self.centroids is None else int(self.centroids.shape[1])
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def auto_nlist(self, count: int) -> int:
+        if self.nlist:
+            return self.nlist
+        return max(1, int(4 * math.sqrt(count)))
+
+    def train(self, vectors: np.ndarray, max_samples_per_list: int = 256) -> None:
+        nlist = min(self.auto_nlist(len(vectors)), len(vectors))
+        if nlist < 1:
+            raise ValueError("cannot train an IVF index without vectors")
+        sample = vectors
+        limit = nlist * max_samples_per_list
+        if len(vectors) > limit:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), size=limit, replace=False)]
+        self._set_centroids(_spherical_kmeans(sample, nlist, self.iterations, self.seed))
+        self.trained_on = len(vectors)
+
+    def _set_centroids(self, centroids: np.ndarray) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        dim = self.centroids.shape[1]
+        self._lists = [
+            (np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32))
+            for _ in range(len(self.centroids))
+        ]
+        self._where = {}
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        assign = self.assign(vectors)
+        for list_id in np.unique(assign):
+            mask = assign == list_id
+            old_ids, old_vecs = self._lists[list_id]
+            self._lists[list_id] = (
+                np.concatenate([old_ids, ids[mask]]),
+                np.concatenate([old_vecs, vectors[mask]]),
+            )
+            for chunk_id in ids[mask]:
+                self._where[int(chunk_id)] = int(list_id)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        by_list: dict = {}
+        for chunk_id in ids:
+            list_id = self._where.pop(int(chunk_id), None)
+            if list_id is not None:
+                by_list.setdefault(list_id, []).append(int(chunk_id))
+        for list_id, removed in by_list.items():
+            old_ids, old_vecs = self._lists[list_id]
+            keep = ~np.isin(old_ids, removed)
+            self._lists[list_id] = (old_ids[keep], old_vecs[keep])
+
+    def search(self, query: np.ndarray, top_k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = top_k_indices(self.centroids @ query, nprobe)
+        lists = [self._lists[int(p)] for p in probes]
+        ids = np.concatenate([ids for ids, _ in lists])
+        if not len(ids):
+            return ids, np.empty(0, dtype=np.float32)
+        scores = np.concatenate([vecs @ query for _, vecs in lists])
+        best = top_k_indices(scores, top_k)
+        return ids[best], scores[best]
+
+    def save(self, path: Path) -> None:
+        if self.centroids is None:
+            return
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, trained_on=np.int64(self.trained_on))
+        tmp.replace(path)
+
+    def load_centroids(self, path: Path, dim: int) -> bool:
+        # Only the trained centroids are persisted; list membership is
+        # recomputed from the stored chunk vectors with one matrix product.
+        try:
+            with np.load(path) as data:
+                centroids = data["centroids"]
+                trained_on = int(data["trained_on"])
+        except (OSError, KeyError, ValueError):
+            return False
+        if centroids.ndim != 2 or centroids.shape[1] != dim:
+            return False
+        self._set_centroids(centroids)
+        self.trained_on = trained_on
+        return True
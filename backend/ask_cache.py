@@ -0,0 +1,169 @@
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class _Counters:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self, entries: int, max_entries: int, ttl_seconds: float) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": max_entries,
+            "ttl_seconds": ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.split())
+
+
+# Exact-match cache of question embeddings, keyed by (embedding model,
+# whitespace-normalized question), with TTL and LRU eviction.
+class QueryEmbeddingCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = _Counters()
+
+    def get(self, model: str, question: str) -> Optional[List[float]]:
+        key = (model, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._counters.expirations += 1
+                entry = None
+            if entry is None:
+                self._counters.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters.hits += 1
+            return entry[1]
+
+    def put(self, model: str, question: str, embedding: List[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        key = (model, normalize_question(question))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return self._counters.stats(len(self._entries), self.max_entries, self.ttl_seconds)
+
+
+def chunk_signature(chunks: Sequence[Dict[str, Any]]) -> Tuple[Hashable, ...]:
+    # Identifies the retrieved context by note, chunk and chunk text, so an
+    # edit to any retrieved chunk invalidates answers built on it.
+    return tuple(
+        (
+            c["note_id"],
+            c.get("chunk_index"),
+            hashlib.sha256(c["text"].encode("utf-8")).hexdigest()[:16],
+        )
+        for c in chunks
+    )
+
+
+class _AnswerEntry:
+    __slots__ = ("signature", "embedding", "response", "expires_at")
+
+    def __init__(self, signature, embedding, response, expires_at) -> None:
+        self.signature = signature
+        self.embedding = embedding
+        self.response = response
+        self.expires_at = expires_at
+
+
+# Semantic cache of final answers. A stored answer is reused when a new
+# question's embedding is within `threshold` cosine similarity of the
+# question it answered and retrieval returned exactly the same chunks
+# (same notes, indices and text), i.e. the LLM would see the same context.
+class SemanticAnswerCache:
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600.0, threshold: float = 0.95) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, _AnswerEntry]" = OrderedDict()
+        self._by_signature: Dict[Tuple[Hashable, ...], List[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._counters = _Counters()
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._by_signature[entry.signature]
+        ids.remove(entry_id)
+        if not ids:
+            del self._by_signature[entry.signature]
+
+    def get(self, query_emb: Sequence[float], chunks: Sequence[Dict[str, Any]]) -> Optional[Any]:
+        signature = chunk_signature(chunks)
+        query = np.asarray(query_emb, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_signature.get(signature, ())):
+                entry = self._entries[entry_id]
+                if entry.expires_at < now:
+                    self._drop(entry_id)
+                    self._counters.expirations += 1
+                    continue
+                if norm == 0.0 or entry.embedding.shape != query.shape:
+                    continue
+                score = float(entry.embedding @ query) / norm
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self._counters.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._counters.hits += 1
+            return self._entries[best_id].response
+
+    def put(self, query_emb: Sequence[float], chunks: Sequence[Dict[str, Any]], response: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        query = np.asarray(query_emb, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0:
+            return
+        entry = _AnswerEntry(
+            chunk_signature(chunks), query / norm, response, time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._by_signature.setdefault(entry.signature, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._counters.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = self._counters.stats(len(self._entries), self.max_entries, self.ttl_seconds)
+        stats["threshold"] = self.threshold
+        return stats
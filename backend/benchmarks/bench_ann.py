@@ -0,0 +1,61 @@
+import argparse
+import time
+
+import numpy as np
+
+from ..ann import IVFFlatIndex
+from ..retrieval import top_k_indices
+
+
+def clustered_vectors(count: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    # Real embeddings are far from uniform on the sphere; a Gaussian mixture
+    # gives the coarse quantizer the kind of structure it relies on.
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall@k and latency of IVF-flat against the exact scan.")
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--nlist", type=int, default=0, help="0 picks 4*sqrt(N)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    data = clustered_vectors(args.vectors + args.queries, args.dim, args.clusters)
+    corpus, queries = data[: args.vectors], data[args.vectors :]
+
+    start = time.perf_counter()
+    index = IVFFlatIndex(nlist=args.nlist)
+    index.train(corpus)
+    index.add(np.arange(len(corpus)), corpus)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    truth = [set(top_k_indices(corpus @ q, args.top_k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f"vectors={len(corpus)} dim={args.dim} nlist={len(index.centroids)} top_k={args.top_k}")
+    print(f"build (train + add): {build_s:.2f} s")
+    print(f"{'method':>12} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'exact':>12} {1.0:9.3f} {exact_ms:9.3f}")
+    for nprobe in args.nprobe:
+        hits = 0
+        start = time.perf_counter()
+        found = [index.search(q, args.top_k, nprobe=nprobe)[0] for q in queries]
+        ivf_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        for ids, expected in zip(found, truth):
+            hits += len(expected.intersection(ids.tolist()))
+        recall = hits / (args.top_k * len(queries))
+        print(f"{'ivf/' + str(nprobe):>12} {recall:9.3f} {ivf_ms:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
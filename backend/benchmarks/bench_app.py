@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+from uuid import uuid4
+
+import numpy as np
+
+from .fake_openai import FakeOpenAI, install
+
+# End-to-end latency and throughput of the list, save, ask and bulk paths
+# through the real FastAPI app, with OpenAI replaced by the deterministic
+# FakeOpenAI. By default every corpus is generated into a fresh database and
+# driven in-process through TestClient; with --url the requests go to a
+# running server instead, e.g. one started as
+#
+#   NOTES_DB_PATH=/tmp/bench/corpus-100000.db uvicorn backend.benchmarks.fake_app:app
+#
+# on a database written earlier with --seed-only --db-dir /tmp/bench.
+
+PATHS = ("list", "ask", "save", "bulk")
+_WORDS = [f"w{i}" for i in range(2000)]
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choices(_WORDS, k=words))
+
+
+def synthetic_records(
+    chunks: int, chunks_per_note: int, dim: int, seed: int = 0, batch_notes: int = 1000
+) -> Iterator[List[Dict[str, Any]]]:
+    # Batches of note records in the shape insert_note_records takes, with
+    # random unit vectors (generating them is much cheaper than hashing).
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    notes = max(1, chunks // chunks_per_note)
+    for start in range(0, notes, batch_notes):
+        count = min(batch_notes, notes - start)
+        vectors = np_rng.standard_normal((count * (chunks_per_note + 1), dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        records = []
+        for n in range(count):
+            base = n * (chunks_per_note + 1)
+            texts = [_text(rng, 120) for _ in range(chunks_per_note)]
+            records.append(
+                {
+                    "id": str(uuid4()),
+                    "title": f"Note {start + n}",
+                    "content": "\n\n".join(texts),
+                    "tags": ["synthetic"],
+                    "embedding": vectors[base],
+                    "chunks": [
+                        {"index": i, "text": text, "embedding": vectors[base + 1 + i]}
+                        for i, text in enumerate(texts)
+                    ],
+                }
+            )
+        yield records
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    values = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def _run(
+    name: str,
+    send: Callable[[int], Any],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> Dict[str, Any]:
+    for i in range(warmup):
+        send(-1 - i)
+
+    def timed(i: int):
+        start = time.perf_counter()
+        try:
+            response = send(i)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+    wall = time.perf_counter() - start
+    latencies = [seconds for seconds, _ in results]
+    return {
+        "path": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in results if not ok),
+        "wall_s": round(wall, 3),
+        "req_per_s": round(requests / wall, 2),
+        **_percentiles(latencies),
+    }
+
+
+def _enrichment_errors(client) -> float:
+    # Tagging/embedding failures counted by the serving process so far.
+    text = client.get("/metrics").text
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if line.startswith("notes_enrichment_errors_total")
+    )
+
+
+def _wait_for_enrichment(client, note_ids: Iterable[str], timeout: float) -> int:
+    # Waits for the jobs of the saved notes to settle; returns how many
+    # failed or were still pending at the deadline.
+    deadline = time.monotonic() + timeout
+    unsettled = 0
+    for note_id in note_ids:
+        while True:
+            job = client.get(f"/api/notes/{note_id}/enrichment").json()
+            if job.get("status") not in ("pending", "running"):
+                unsettled += job.get("status") == "failed"
+                break
+            if time.monotonic() > deadline:
+                unsettled += 1
+                break
+            time.sleep(0.05)
+    return unsettled
+
+
+def _bench_paths(client, args: argparse.Namespace, corpus_chunks: Optional[int]) -> List[Dict[str, Any]]:
+    ids = [n["id"] for n in client.get("/api/notes", params={"limit": 1000, "fields": "id"}).json()]
+    rng = random.Random(1)
+    saved: Set[str] = set()
+
+    def save(i: int) -> Any:
+        note_id = rng.choice(ids)
+        saved.add(note_id)
+        return client.put(
+            f"/api/notes/{note_id}",
+            json={"title": f"Edited {i}", "content": _text(rng, 400)},
+        )
+
+    senders: Dict[str, Callable[[int], Any]] = {
+        "list": lambda i: client.get("/api/notes", params={"limit": args.page_size}),
+        "ask": lambda i: client.post(
+            "/api/ask",
+            json={"question": f"question {i} about {_text(rng, 6)}", "top_k": args.top_k},
+        ),
+        "save": save,
+        "bulk": lambda i: client.post(
+            "/api/notes/bulk",
+            content="".join(
+                json.dumps({"title": f"Bulk {i}-{n}", "content": _text(rng, 300)}) + "\n"
+                for n in range(args.bulk_notes)
+            ).encode(),
+            headers={"Content-Type": "application/x-ndjson"},
+        ),
+    }
+    results = []
+    for path in args.paths:
+        if path == "save" and not ids:
+            continue
+        requests = args.bulk_requests if path == "bulk" else args.requests
+        errors_before = _enrichment_errors(client)
+        saved.clear()
+        result = _run(path, senders[path], requests, args.concurrency, args.warmup)
+        result["corpus_chunks"] = corpus_chunks
+        # Background jobs finish after the timed requests: failures counted
+        # by /metrics, plus saved notes whose job failed or did not finish.
+        failed = _wait_for_enrichment(client, sorted(saved), args.enrichment_timeout)
+        result["enrichment_errors"] = int(_enrichment_errors(client) - errors_before) + failed
+        if path == "bulk":
+            result["notes_per_s"] = round(result["req_per_s"] * args.bulk_notes, 2)
+        results.append(result)
+        print(
+            f"{corpus_chunks or '-':>9} {path:>5} {result['req_per_s']:9.1f} "
+            f"{result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+            f"{result['errors']:6d} {result['enrichment_errors']:6d}",
+            flush=True,
+        )
+    return results
+
+
+def _use_database(db_path: Path) -> None:
+    # Points the app at another corpus, with an empty in-memory index that
+    # the next request (or the lifespan) loads from it.
+    from .. import main
+
+    main.DB_PATH = db_path
+    main._init_db()
+    main._chunk_index = main._create_chunk_index()
+    main._index_sync = main._create_index_sync(main._chunk_index)
+
+
+def _seed(db_path: Path, chunks: int, args: argparse.Namespace) -> float:
+    from .. import main
+
+    _use_database(db_path)
+    start = time.perf_counter()
+    for records in synthetic_records(chunks, args.chunks_per_note, args.dim):
+        main.insert_note_records(records)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Latency percentiles and throughput of the API with an offline OpenAI stand-in."
+    )
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="corpus sizes in chunks (up to 1000000)")
+    parser.add_argument("--chunks-per-note", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=256,
+                        help="vector size; 1M chunks x 1536 dims needs ~6 GB in memory and on disk")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--bulk-requests", type=int, default=10)
+    parser.add_argument("--bulk-notes", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="injected delay per fake OpenAI call")
+    parser.add_argument("--enrichment-mode", choices=("sync", "background"), default="sync",
+                        help="sync times tagging + embedding inside the save request")
+    parser.add_argument("--enrichment-timeout", type=float, default=120.0,
+                        help="seconds to wait for the saved notes' enrichment jobs")
+    parser.add_argument("--url", help="benchmark a running server instead of in-process")
+    parser.add_argument("--db-dir", help="keep generated databases here (default: a temp dir)")
+    parser.add_argument("--seed-only", action="store_true", help="only write the corpus databases")
+    parser.add_argument("--output", default="bench_app.json")
+    args = parser.parse_args()
+
+    meta = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+    results: List[Dict[str, Any]] = []
+    header = f"{'chunks':>9} {'path':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6} {'enrich':>6}"
+
+    if args.url:
+        import httpx
+
+        print(header)
+        with httpx.Client(base_url=args.url, timeout=120.0) as client:
+            results.extend(_bench_paths(client, args, None))
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        db_dir = Path(args.db_dir or tmp.name)
+        db_dir.mkdir(parents=True, exist_ok=True)
+        # Must be set before the app is imported: main opens NOTES_DB_PATH
+        # and embed reads the cache settings on first use.
+        os.environ["NOTES_DB_PATH"] = str(db_dir / "bootstrap.db")
+        os.environ.setdefault("EMBEDDING_CACHE_PATH", str(db_dir / "embedding_cache.db"))
+        os.environ["ENRICHMENT_MODE"] = args.enrichment_mode
+        install(FakeOpenAI(dim=args.dim, latency_ms=args.latency_ms))
+
+        from fastapi.testclient import TestClient
+
+        from .. import main as app_main
+
+        print(header)
+        for chunks in args.chunks:
+            db_path = db_dir / f"corpus-{chunks}.db"
+            seed_s = None
+            if not db_path.exists():
+                seed_s = _seed(db_path, chunks, args)
+            if args.seed_only:
+                print(f"{chunks:>9} seeded {db_path} in {seed_s or 0:.1f} s")
+                continue
+            _use_database(db_path)
+            start = time.perf_counter()
+            with TestClient(app_main.app) as client:
+                load_s = time.perf_counter() - start
+                corpus = _bench_paths(client, args, chunks)
+            for result in corpus:
+                result["seed_s"] = round(seed_s, 3) if seed_s is not None else None
+                result["startup_s"] = round(load_s, 3)
+            results.extend(corpus)
+        tmp.cleanup()
+
+    Path(args.output).write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+    print(f"wrote {args.output}")
+    failed = sum(result["enrichment_errors"] for result in results)
+    if failed:
+        sys.exit(f"{failed} enrichment errors: tagging or embeddings failed, timings are not comparable")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import gc
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .. import vector_file
+from ..quantize import QuantizedIndex
+from ..retrieval import ChunkIndex, ChunkMatrix
+from .bench_ann import clustered_vectors
+
+# Memory, latency and recall@k of the int8 / binary backends as the app
+# serves them (RETRIEVAL_BACKEND=int8|binary): a ChunkIndex over the
+# memory-mapped vector snapshot, whose QuantizedIndex shortlist is rescored
+# from the mapped rows. "held bytes/chunk" is what the index keeps in
+# process memory per vector (codes and id, or the float32 row); "anon" is
+# the measured growth of RssAnon, which also counts the Python-side id
+# mappings. The mapped snapshot pages are shared and can be evicted.
+
+
+def _rss_anon() -> Optional[int]:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _blocks(corpus: np.ndarray, per_note: int) -> List[Tuple[str, ChunkMatrix]]:
+    # Newest first, as vector_file.publish expects.
+    blocks = []
+    for start in range(0, len(corpus), per_note):
+        end = min(start + per_note, len(corpus))
+        count = end - start
+        blocks.append((
+            f"note-{start // per_note}",
+            ChunkMatrix(
+                [f"note-{start // per_note}"] * count,
+                ["Note"] * count,
+                list(range(count)),
+                [""] * count,
+                corpus[start:end],
+                np.ones(count, dtype=bool),
+            ),
+        ))
+    return list(reversed(blocks))
+
+
+def _load(index: ChunkIndex, snapshot: vector_file.VectorFile, in_memory: bool) -> Tuple[float, Optional[int]]:
+    # Same steps as IndexSync._load_shared for a snapshot covering every note.
+    ranges = snapshot.ranges()
+    note_ids = [note_id for note_id, start, end in ranges for _ in range(end - start)]
+    matrix = np.array(snapshot.matrix) if in_memory else snapshot.matrix
+    base = ChunkMatrix(
+        note_ids,
+        ["Note"] * len(note_ids),
+        snapshot.chunk_indices.tolist(),
+        [""] * len(note_ids),
+        matrix,
+        snapshot.valid,
+    )
+    gc.collect()
+    before = _rss_anon()
+    start = time.perf_counter()
+    index.load_shared(base, ranges, [], snapshot.generation)
+    build_s = time.perf_counter() - start
+    gc.collect()
+    after = _rss_anon()
+    owned = matrix.nbytes if in_memory else 0
+    return build_s, (after - before + owned) if before is not None and after is not None else None
+
+
+def _keys(results) -> set:
+    return {(r["note_id"], r["chunk_index"]) for r in results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Memory per chunk, latency and recall@k of the quantized backends, rescored "
+        "from the memory-mapped vector snapshot, against the exact float32 scan."
+    )
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--chunks-per-note", type=int, default=10)
+    parser.add_argument("--pca-dim", type=int, nargs="*", default=[256])
+    parser.add_argument("--rescore-factor", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    data = clustered_vectors(args.vectors + args.queries, args.dim, args.clusters)
+    corpus, queries = data[: args.vectors], data[args.vectors :]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_file.publish(Path(tmp), 1, _blocks(corpus, args.chunks_per_note))
+        del data, corpus
+        snapshot = vector_file.open_latest(Path(tmp))
+        total = len(snapshot.matrix)
+
+        print(f"vectors={total} dim={args.dim} top_k={args.top_k} queries={len(queries)}")
+        print(
+            f"{'method':>24} {'held bytes/chunk':>16} {'anon bytes/chunk':>16} "
+            f"{'recall@k':>9} {'ms/query':>9} {'build s':>8}"
+        )
+
+        def report(label: str, held: int, index: ChunkIndex, build_s: float, anon: Optional[int], truth=None):
+            hits = 0
+            start = time.perf_counter()
+            found = [_keys(index.search(q, args.top_k)) for q in queries]
+            ms = (time.perf_counter() - start) * 1000 / len(queries)
+            if truth is not None:
+                hits = sum(len(expected & keys) for expected, keys in zip(truth, found))
+            recall = hits / (args.top_k * len(queries)) if truth is not None else 1.0
+            per_chunk = f"{anon / total:16.0f}" if anon is not None else f"{'-':>16}"
+            print(f"{label:>24} {held:16d} {per_chunk} {recall:9.3f} {ms:9.3f} {build_s:8.2f}", flush=True)
+            return found
+
+        exact = ChunkIndex()
+        truth = report("exact float32", args.dim * 4, exact, *_load(exact, snapshot, in_memory=True))
+        del exact
+        mapped = ChunkIndex()
+        report("exact float32 mmap", 0, mapped, *_load(mapped, snapshot, in_memory=False), truth)
+        del mapped
+
+        for pca_dim in [0] + list(args.pca_dim):
+            for kind in ("int8", "binary"):
+                index = ChunkIndex(ann_factory=lambda: QuantizedIndex(kind=kind, pca_dim=pca_dim))
+                build_s, anon = _load(index, snapshot, in_memory=False)
+                ann = index.ann
+                name = kind if not pca_dim else f"pca{pca_dim}+{kind}"
+                for factor in args.rescore_factor:
+                    ann.rescore_factor = factor
+                    report(f"{name}/r{factor}", ann.code_bytes + 8, index, build_s, anon, truth)
+                del index, ann
+        del snapshot
+
+
+if __name__ == "__main__":
+    main()
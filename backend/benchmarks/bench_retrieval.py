@@ -0,0 +1,106 @@
+import argparse
+import math
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from ..retrieval import ChunkMatrix
+
+
+def _cosine_similarity(a: List[float], b: List[float]) -> float:
+    if not a or not b or len(a) != len(b):
+        return -1.0
+    dot = 0.0
+    norm_a = 0.0
+    norm_b = 0.0
+    for i in range(len(a)):
+        dot += a[i] * b[i]
+        norm_a += a[i] * a[i]
+        norm_b += b[i] * b[i]
+    if norm_a == 0.0 or norm_b == 0.0:
+        return -1.0
+    return dot / (math.sqrt(norm_a) * math.sqrt(norm_b))
+
+
+# The scoring loop rag.retrieve_top_chunks used before ChunkMatrix.
+def _loop_top_chunks(query_emb: List[float], notes: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    scored: List[Dict[str, Any]] = []
+    for note in notes:
+        for chunk in note.get("chunks", []):
+            score = _cosine_similarity(query_emb, chunk.get("embedding", []))
+            scored.append(
+                {
+                    "note_id": note["id"],
+                    "note_title": note.get("title", ""),
+                    "text": chunk["text"],
+                    "score": score,
+                }
+            )
+    scored.sort(key=lambda x: x["score"], reverse=True)
+    return scored[:top_k]
+
+
+def synthetic_notes(num_notes: int, chunks_per_note: int, dim: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    notes = []
+    for n in range(num_notes):
+        vectors = rng.standard_normal((chunks_per_note, dim)).astype(np.float32)
+        notes.append(
+            {
+                "id": f"note-{n}",
+                "title": f"Note {n}",
+                "chunks": [
+                    {"index": i, "text": f"note {n} chunk {i}", "embedding": vectors[i].tolist()}
+                    for i in range(chunks_per_note)
+                ],
+            }
+        )
+    return notes
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the Python cosine loop with ChunkMatrix scoring.")
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--chunks-per-note", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    notes = synthetic_notes(args.notes, args.chunks_per_note, args.dim)
+    rng = np.random.default_rng(1)
+    queries = [rng.standard_normal(args.dim).astype(np.float32).tolist() for _ in range(args.queries)]
+
+    build_s = _time(lambda: ChunkMatrix.from_notes(notes), 1)
+    matrix = ChunkMatrix.from_notes(notes)
+
+    mismatches = 0
+    for query in queries:
+        expected = [(c["note_id"], c["text"]) for c in _loop_top_chunks(query, notes, args.top_k)]
+        actual = [(c["note_id"], c["text"]) for c in matrix.search(query, args.top_k)]
+        mismatches += expected != actual
+
+    loop_s = _time(lambda: [_loop_top_chunks(q, notes, args.top_k) for q in queries], args.repeat) / len(queries)
+    matrix_s = _time(lambda: [matrix.search(q, args.top_k) for q in queries], args.repeat) / len(queries)
+
+    print(f"chunks={len(matrix)} dim={args.dim} top_k={args.top_k}")
+    print(f"matrix build:     {build_s * 1000:9.2f} ms (once per corpus)")
+    print(f"python loop:      {loop_s * 1000:9.2f} ms/query")
+    print(f"ChunkMatrix:      {matrix_s * 1000:9.2f} ms/query")
+    print(f"speedup:          {loop_s / matrix_s:9.1f}x")
+    print(f"order mismatches: {mismatches}/{len(queries)}")
+
+
+if __name__ == "__main__":
+    main()
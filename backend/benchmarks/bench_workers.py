@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from .bench_app import _percentiles, _text
+
+# Throughput of /api/ask as the number of uvicorn worker processes grows.
+# Serves one seeded corpus (bench_app --seed-only) with
+#
+#   uvicorn backend.benchmarks.fake_app:app --workers N
+#
+# for each N, drives it from several client processes so the load generator
+# is not the bottleneck, and reports req/s, latency percentiles and the
+# workers' summed proportional set size (PSS), in which pages shared through
+# SHARED_VECTORS=1 are counted once. Scaling stops at the number of CPUs.
+
+
+def _worker_pids(master: int, workers: int) -> List[int]:
+    # One worker runs in uvicorn's own process; more are spawned children
+    # of its supervisor (next to multiprocessing's resource tracker).
+    if workers == 1:
+        return [master]
+    pids = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+            cmdline = (entry / "cmdline").read_bytes()
+        except OSError:
+            continue
+        if int(stat.rsplit(")", 1)[1].split()[1]) == master and b"spawn_main" in cmdline:
+            pids.append(int(entry.name))
+    return pids
+
+
+def _memory_mb(pids: List[int]) -> Dict[str, float]:
+    totals = {"rss_mb": 0.0, "pss_mb": 0.0}
+    for pid in pids:
+        try:
+            lines = Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            name, _, value = line.partition(":")
+            key = {"Rss": "rss_mb", "Pss": "pss_mb"}.get(name)
+            if key:
+                totals[key] += int(value.split()[0]) / 1024
+    return {k: round(v, 1) for k, v in totals.items()}
+
+
+def _client(url: str, requests: int, concurrency: int, top_k: int, seed: int) -> List[Tuple[float, bool]]:
+    import httpx
+
+    rng = random.Random(seed)
+    questions = [f"question {seed}-{i} about {_text(rng, 6)}" for i in range(requests)]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(base_url=url, timeout=120.0, limits=limits) as client:
+
+        def ask(question: str) -> Tuple[float, bool]:
+            start = time.perf_counter()
+            try:
+                ok = client.post("/api/ask", json={"question": question, "top_k": top_k}).status_code < 400
+            except Exception:
+                ok = False
+            return time.perf_counter() - start, ok
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(ask, questions))
+
+
+def _wait_ready(url: str, timeout: float) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start within {timeout:.0f} s")
+
+
+def _serve(workers: int, db_path: Path, args: argparse.Namespace) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "NOTES_DB_PATH": str(db_path),
+        "EMBEDDING_CACHE_PATH": str(db_path.with_name("embedding_cache.db")),
+        "FAKE_EMBEDDING_DIM": str(args.dim),
+        "FAKE_OPENAI_LATENCY_MS": str(args.latency_ms),
+        "SHARED_VECTORS": "1" if args.shared_vectors else "0",
+        "SHARED_VECTORS_DIR": str(db_path.with_name(f"{db_path.stem}.vectors")),
+        "ENRICHMENT_REPAIR_INTERVAL": "0",
+    }
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "backend.benchmarks.fake_app:app",
+            "--port", str(args.port), "--workers", str(workers),
+            "--backlog", "4096", "--log-level", "warning", "--no-access-log",
+        ],
+        env=env,
+        cwd=Path(__file__).resolve().parents[2],
+    )
+
+
+def _run(workers: int, db_path: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    url = f"http://127.0.0.1:{args.port}"
+    server = _serve(workers, db_path, args)
+    try:
+        _wait_ready(url, args.startup_timeout)
+        # Every worker loads its index in the lifespan; the warmup spreads
+        # over them through the shared listening socket.
+        _client(url, args.warmup * workers, min(args.concurrency, 8), args.top_k, seed=-1)
+        per_client = max(1, args.requests // args.clients)
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.clients) as pool:
+            runs = list(pool.map(
+                _client,
+                [url] * args.clients,
+                [per_client] * args.clients,
+                [args.concurrency] * args.clients,
+                [args.top_k] * args.clients,
+                range(args.clients),
+            ))
+        wall = time.perf_counter() - start
+        memory = _memory_mb(_worker_pids(server.pid, workers))
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+    results = [r for run in runs for r in run]
+    return {
+        "workers": workers,
+        "requests": len(results),
+        "concurrency": args.concurrency * args.clients,
+        "errors": sum(1 for _, ok in results if not ok),
+        "wall_s": round(wall, 3),
+        "req_per_s": round(len(results) / wall, 2),
+        **_percentiles([seconds for seconds, _ in results]),
+        **memory,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="/api/ask throughput by uvicorn worker count.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--chunks-per-note", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="in-flight requests per client")
+    parser.add_argument("--warmup", type=int, default=20, help="requests per worker before timing")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="injected delay per fake OpenAI call")
+    parser.add_argument("--shared-vectors", action="store_true", help="run the workers with SHARED_VECTORS=1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--db-dir", help="keep the seeded database here (default: a temp dir)")
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db_dir = Path(args.db_dir or tmp.name)
+    db_path = db_dir / f"corpus-{args.chunks}.db"
+    if not db_path.exists():
+        subprocess.run(
+            [
+                sys.executable, "-m", "backend.benchmarks.bench_app", "--seed-only",
+                "--db-dir", str(db_dir), "--chunks", str(args.chunks),
+                "--chunks-per-note", str(args.chunks_per_note), "--dim", str(args.dim),
+                "--output", os.devnull,
+            ],
+            check=True,
+            cwd=Path(__file__).resolve().parents[2],
+        )
+
+    meta = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6} {'PSS MB':>8}")
+    results = []
+    for workers in args.workers:
+        result = _run(workers, db_path, args)
+        results.append(result)
+        print(
+            f"{workers:>7} {result['req_per_s']:9.1f} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+            f"{result['p99_ms']:9.2f} {result['errors']:6d} {result['pss_mb']:8.1f}",
+            flush=True,
+        )
+    tmp.cleanup()
+    Path(args.output).write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+
+from .fake_openai import FakeOpenAI, install
+
+# The real API with the offline OpenAI stand-in, for load tests against a
+# running server:
+#
+#   FAKE_OPENAI_LATENCY_MS=50 uvicorn backend.benchmarks.fake_app:app
+#
+# FAKE_EMBEDDING_DIM sets the vector size (default 1536).
+install(
+    FakeOpenAI(
+        dim=int(os.getenv("FAKE_EMBEDDING_DIM", "1536")),
+        latency_ms=float(os.getenv("FAKE_OPENAI_LATENCY_MS", "0")),
+        stream_delay_ms=float(os.getenv("FAKE_OPENAI_STREAM_DELAY_MS", "0")),
+    )
+)
+
+from ..main import app  # noqa: E402
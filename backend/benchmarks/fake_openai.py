@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import json
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import numpy as np
+
+# Deterministic stand-in for the parts of the OpenAI client the app uses:
+# embeddings.create returns hash-seeded unit vectors (the same text always
+# gets the same vector) and responses.create returns canned structured
+# output for the tagging and answer schemas, optionally streamed. Every call
+# sleeps `latency_ms` to stand in for the network round trip; the async
+# variant awaits asyncio.sleep instead, like a real non-blocking request.
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class _Embeddings:
+    def __init__(self, client: "FakeOpenAI") -> None:
+        self._client = client
+
+    def create(self, model: str, input: Any, dimensions: Optional[int] = None, **_: Any) -> Any:
+        texts = [input] if isinstance(input, str) else list(input)
+        self._client.pause()
+        dim = dimensions or self._client.dim
+        tokens = sum(_tokens(t) for t in texts)
+        return SimpleNamespace(
+            data=[SimpleNamespace(embedding=fake_embedding(t, dim), index=i) for i, t in enumerate(texts)],
+            usage=SimpleNamespace(prompt_tokens=tokens, total_tokens=tokens),
+            model=model,
+        )
+
+
+class _Responses:
+    def __init__(self, client: "FakeOpenAI") -> None:
+        self._client = client
+
+    def _output(self, text: Dict[str, Any]) -> str:
+        name = text.get("format", {}).get("name")
+        if name == "note_tagging":
+            return json.dumps(
+                {
+                    "tags": [
+                        {"name": "benchmark", "confidence": 0.9},
+                        {"name": "synthetic", "confidence": 0.6},
+                        {"name": "offline", "confidence": 0.4},
+                    ]
+                }
+            )
+        return json.dumps(
+            {
+                "answer": "This is a canned answer from the offline benchmark client.",
+                "citations": [],
+            }
+        )
+
+    def create(self, model: str, input: str, text: Dict[str, Any], stream: bool = False, **_: Any) -> Any:
+        self._client.pause()
+        output = self._output(text)
+        usage = SimpleNamespace(input_tokens=_tokens(input), output_tokens=_tokens(output))
+        if not stream:
+            return SimpleNamespace(output_text=output, usage=usage)
+        return self._stream(output, usage)
+
+    def _stream(self, output: str, usage: Any) -> Iterator[Any]:
+        for start in range(0, len(output), 16):
+            if self._client.stream_delay_ms:
+                time.sleep(self._client.stream_delay_ms / 1000)
+            yield SimpleNamespace(type="response.output_text.delta", delta=output[start:start + 16])
+        yield SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+
+class FakeOpenAI:
+    def __init__(self, dim: int = 1536, latency_ms: float = 0.0, stream_delay_ms: float = 0.0) -> None:
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.stream_delay_ms = stream_delay_ms
+        self.embeddings = _Embeddings(self)
+        self.responses = _Responses(self)
+
+    def pause(self) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def close(self) -> None:
+        pass
+
+
+class _AsyncEmbeddings(_Embeddings):
+    async def create(self, model: str, input: Any, dimensions: Optional[int] = None, **kwargs: Any) -> Any:
+        await self._client.apause()
+        return super().create(model, input, dimensions=dimensions, **kwargs)
+
+
+class _AsyncResponses(_Responses):
+    async def create(self, model: str, input: str, text: Dict[str, Any], stream: bool = False, **_: Any) -> Any:
+        await self._client.apause()
+        output = self._output(text)
+        usage = SimpleNamespace(input_tokens=_tokens(input), output_tokens=_tokens(output))
+        if not stream:
+            return SimpleNamespace(output_text=output, usage=usage)
+        return self._astream(output, usage)
+
+    async def _astream(self, output: str, usage: Any) -> AsyncIterator[Any]:
+        for start in range(0, len(output), 16):
+            if self._client.stream_delay_ms:
+                await asyncio.sleep(self._client.stream_delay_ms / 1000)
+            yield SimpleNamespace(type="response.output_text.delta", delta=output[start:start + 16])
+        yield SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    def __init__(self, dim: int = 1536, latency_ms: float = 0.0, stream_delay_ms: float = 0.0) -> None:
+        super().__init__(dim, latency_ms, stream_delay_ms)
+        self.embeddings = _AsyncEmbeddings(self)
+        self.responses = _AsyncResponses(self)
+
+    def pause(self) -> None:
+        # The latency is already awaited in apause().
+        pass
+
+    async def apause(self) -> None:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    async def close(self) -> None:
+        pass
+
+
+def install(client: FakeOpenAI) -> None:
+    # Replaces the _get_client and _get_async_client hooks, so nothing
+    # reaches the network. The async stand-in shares the client's settings.
+    from .. import embed, llm_tagging, rag
+
+    async_client = FakeAsyncOpenAI(client.dim, client.latency_ms, client.stream_delay_ms)
+    for module in (embed, llm_tagging, rag):
+        module._get_client = lambda: client
+        module._get_async_client = lambda: async_client
@@ -0,0 +1,199 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from pydantic import ValidationError
+
+from . import metrics
+from .embed import chunk_text, embed_chunks, note_input
+from .llm_tagging import tag_note_with_llm
+from .schemas import NoteCreate
+
+MAX_REPORTED_ERRORS = 20
+
+
+def _tag(note: NoteCreate) -> Tuple[List[str], Optional[str]]:
+    # Tags, or no tags and the error.
+    try:
+        return [t.name for t in tag_note_with_llm(title=note.title, body=note.content).tags], None
+    except Exception as exc:
+        metrics.ENRICHMENT_ERRORS.inc("tagging", type(exc).__name__)
+        return [], f"tagging: {type(exc).__name__}: {exc}"
+
+
+def _embed(kind: str, texts: List[str]) -> Tuple[List[List[float]], Optional[str]]:
+    # Embeddings, or empty ones and the error.
+    try:
+        return embed_chunks(texts), None
+    except Exception as exc:
+        metrics.ENRICHMENT_ERRORS.inc(kind, type(exc).__name__)
+        return [[] for _ in texts], f"{kind}: {type(exc).__name__}: {exc}"
+
+
+# Imports notes from NDJSON lines ({"title": ..., "content": ...} per line)
+# in batches of `batch_size`. Each batch sends the chunk texts of all its
+# notes through one embed_chunks call, which packs them into token-budgeted
+# embeddings requests, and the whole-note texts (cut to the per-input
+# limit) through another, so a rejected note text does not cost the batch
+# its chunk vectors. Tagging runs on `tag_concurrency` threads.
+# `write_records` persists one batch of note records in a single
+# transaction. Notes whose tagging or embeddings failed
+# are still imported, with their errors in "enrichment_errors", and counted
+# in `pending_enrichment`; write_records queues them for enrichment.
+class BulkImporter:
+    def __init__(
+        self,
+        write_records: Callable[[List[Dict]], None],
+        batch_size: int = 256,
+        tag_concurrency: int = 8,
+    ) -> None:
+        self._write_records = write_records
+        self.batch_size = batch_size
+        self.tag_concurrency = tag_concurrency
+        self._pending: List[NoteCreate] = []
+        self._line_no = 0
+        self._started = time.perf_counter()
+        self.imported = 0
+        self.chunks = 0
+        self.failed = 0
+        self.pending_enrichment = 0
+        self.errors: List[Dict] = []
+
+    def _error(self, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": self._line_no, "error": message})
+
+    def feed(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self._line_no += 1
+            if not line.strip():
+                continue
+            try:
+                self._pending.append(NoteCreate.model_validate_json(line))
+            except ValidationError as exc:
+                self._error(exc.errors()[0]["msg"] if exc.errors() else str(exc))
+                continue
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        notes, self._pending = self._pending, []
+        note_chunks = [chunk_text(f"{n.title}\n\n{n.content}") for n in notes]
+        texts = [text for chunks in note_chunks for text in chunks]
+
+        with ThreadPoolExecutor(max_workers=self.tag_concurrency) as pool:
+            note_embedding_call = pool.submit(
+                _embed, "note_embedding", [note_input(n.title, n.content) for n in notes]
+            )
+            tagged = pool.map(_tag, notes)
+            embeddings, embed_error = _embed("embedding", texts)
+            note_embeddings, note_embed_error = note_embedding_call.result()
+            tagged = list(tagged)
+
+        records = []
+        offset = 0
+        for note, (note_tags, tag_error), chunks, note_embedding in zip(
+            notes, tagged, note_chunks, note_embeddings
+        ):
+            errors = [e for e in (tag_error, note_embed_error, embed_error) if e]
+            self.pending_enrichment += bool(errors)
+            records.append(
+                {
+                    "id": str(uuid4()),
+                    "title": note.title,
+                    "content": note.content,
+                    "tags": note_tags,
+                    "embedding": note_embedding,
+                    "chunks": [
+                        {"index": i, "text": text, "embedding": embeddings[offset + i]}
+                        for i, text in enumerate(chunks)
+                    ],
+                    "enrichment_errors": errors,
+                }
+            )
+            offset += len(chunks)
+        self._write_records(records)
+        self.imported += len(records)
+        self.chunks += offset
+
+    def finish(self) -> Dict:
+        self.flush()
+        return self.stats()
+
+    def stats(self) -> Dict:
+        seconds = max(time.perf_counter() - self._started, 1e-9)
+        return {
+            "imported": self.imported,
+            "chunks": self.chunks,
+            "failed": self.failed,
+            "pending_enrichment": self.pending_enrichment,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "notes_per_s": round(self.imported / seconds, 2),
+            "chunks_per_s": round(self.chunks / seconds, 2),
+        }
+
+
+def _post_ndjson(url: str, lines: Iterable[bytes]) -> Dict:
+    import http.client
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parts.netloc)
+    conn.request(
+        "POST",
+        parts.path.rstrip("/") + "/api/notes/bulk",
+        body=lines,
+        headers={"Content-Type": "application/x-ndjson"},
+        encode_chunked=True,
+    )
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status != 200:
+        raise SystemExit(f"bulk import failed with status {resp.status}: {body.decode(errors='replace')}")
+    return json.loads(body)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Import notes from an NDJSON file ({\"title\": ..., \"content\": ...} per line)."
+    )
+    parser.add_argument("path", help="NDJSON file, or - for stdin")
+    parser.add_argument(
+        "--url",
+        help="Stream to a running API (e.g. http://127.0.0.1:8000) instead of writing notes.db "
+        "directly. Either way a running API picks the notes up on its next index sync.",
+    )
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--tag-concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+    with stream:
+        if args.url:
+            stats = _post_ndjson(args.url, stream)
+        else:
+            from .main import insert_note_records
+
+            importer = BulkImporter(
+                insert_note_records,
+                batch_size=args.batch_size,
+                tag_concurrency=args.tag_concurrency,
+            )
+            # As the bulk endpoint does: a bad byte becomes U+FFFD instead of
+            # aborting the import.
+            importer.feed(line.decode("utf-8", errors="replace") for line in stream)
+            stats = importer.finish()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
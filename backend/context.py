@@ -0,0 +1,149 @@
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .embed import estimate_tokens
+
+# Longest chunk overlap looked for when joining neighbouring chunks.
+MAX_OVERLAP_WORDS = 80
+# A passage that does not fit is cut to the remaining budget only if at
+# least this many tokens are left; otherwise it is dropped.
+MIN_PARTIAL_TOKENS = 64
+
+
+def _header(chunk: Dict[str, Any]) -> str:
+    return f"[note_id={chunk['note_id']} note_title={chunk.get('note_title', '')}]"
+
+
+def _index_order(chunk: Dict[str, Any]) -> Tuple[bool, int]:
+    index = chunk.get("chunk_index")
+    return index is None, index or 0
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    # Neighbouring chunks of a note repeat the words around their boundary;
+    # keep those once.
+    a, b = first.split(), second.split()
+    for size in range(min(len(a), len(b), MAX_OVERLAP_WORDS), 0, -1):
+        if a[-size:] == b[:size]:
+            return " ".join(a + b[size:])
+    return " ".join(a + b)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    words = text.split()
+    kept: List[str] = []
+    used = 0
+    for word in words:
+        used += estimate_tokens(word + " ")
+        if used > max_tokens:
+            break
+        kept.append(word)
+    return " ".join(kept) + " ..."
+
+
+def pack_context(
+    chunks: Sequence[Dict[str, Any]], token_budget: int = 0
+) -> Tuple[str, Dict[str, int]]:
+    # Builds the prompt context from ranked chunks (best first):
+    #  1. drops repeated chunks and chunks whose text is already included,
+    #  2. merges runs of consecutive chunk_index values of one note into a
+    #     single passage, keeping the overlapping words once,
+    #  3. adds passages in rank order while they fit `token_budget` (0 means
+    #     unlimited), cutting the first one that does not fit when enough
+    #     budget is left.
+    # Returns the context and token accounting against the plain
+    # concatenation of every chunk.
+    unique: List[Tuple[int, Dict[str, Any]]] = []
+    seen_keys = set()
+    seen_texts = set()
+    for rank, chunk in enumerate(chunks):
+        key = (chunk["note_id"], chunk.get("chunk_index"))
+        text = " ".join(chunk["text"].split())
+        if key in seen_keys or text in seen_texts:
+            continue
+        seen_keys.add(key)
+        seen_texts.add(text)
+        unique.append((rank, chunk))
+
+    by_note: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+    for rank, chunk in unique:
+        by_note.setdefault(chunk["note_id"], []).append((rank, chunk))
+    passages: List[Tuple[int, Dict[str, Any], str]] = []
+    merged = 0
+    for members in by_note.values():
+        members.sort(key=lambda m: _index_order(m[1]))
+        run_rank, run_chunk, run_text, last_index = None, None, "", None
+        for rank, chunk in members:
+            index = chunk.get("chunk_index")
+            adjacent = index is not None and last_index is not None and index == last_index + 1
+            if run_chunk is not None and adjacent:
+                run_text = _join_overlapping(run_text, chunk["text"])
+                run_rank = min(run_rank, rank)
+                merged += 1
+            else:
+                if run_chunk is not None:
+                    passages.append((run_rank, run_chunk, run_text))
+                run_rank, run_chunk, run_text = rank, chunk, chunk["text"]
+            last_index = index
+        if run_chunk is not None:
+            passages.append((run_rank, run_chunk, run_text))
+    passages.sort(key=lambda p: p[0])
+
+    parts: List[str] = []
+    used = 0
+    truncated = 0
+    dropped = 0
+    for _, chunk, text in passages:
+        header = _header(chunk)
+        cost = estimate_tokens(f"{header}\n{text}\n\n")
+        if token_budget and used + cost > token_budget:
+            remaining = token_budget - used - estimate_tokens(f"{header}\n\n\n")
+            if remaining < MIN_PARTIAL_TOKENS:
+                dropped += 1
+                continue
+            text = _truncate(text, remaining)
+            cost = estimate_tokens(f"{header}\n{text}\n\n")
+            truncated += 1
+        parts.append(f"{header}\n{text}")
+        used += cost
+
+    context = "\n\n".join(parts)
+    naive = "\n\n".join(f"{_header(c)}\n{c['text']}" for c in chunks)
+    tokens_before = estimate_tokens(naive) if chunks else 0
+    tokens_after = estimate_tokens(context) if parts else 0
+    return context, {
+        "chunks": len(chunks),
+        "passages": len(parts),
+        "duplicates_removed": len(chunks) - len(unique),
+        "chunks_merged": merged,
+        "passages_truncated": truncated,
+        "passages_dropped": dropped,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(0, tokens_before - tokens_after),
+    }
+
+
+# Running totals of pack_context results, for /api/stats/context.
+class ContextStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._totals: Dict[str, int] = {}
+        self._requests = 0
+
+    def record(self, usage: Dict[str, int]) -> None:
+        with self._lock:
+            self._requests += 1
+            for key, value in usage.items():
+                self._totals[key] = self._totals.get(key, 0) + value
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            totals = dict(self._totals)
+            requests = self._requests
+        before = totals.get("tokens_before", 0)
+        return {
+            "requests": requests,
+            **totals,
+            "saved_ratio": totals.get("tokens_saved", 0) / before if before else 0.0,
+        }
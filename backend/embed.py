@@ -1,63 +1,309 @@
+import asyncio
+import hashlib
 import os
+import re
+import threading
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-_env_loaded = False
+from . import metrics
+from .embedding_cache import EmbeddingCache
+from .resources import get_async_openai_client, get_openai_client, openai_slots, run_blocking
+from .scheduler import Coalescer, scheduler
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
 
 
 def _get_client() -> OpenAI:
-    global _env_loaded
-    if not _env_loaded:
-        env_path = Path(__file__).resolve().parent / ".env"
-        load_dotenv(env_path)
-        _env_loaded = True
-    return OpenAI()
+    return get_openai_client()
+
+
+def _get_async_client() -> AsyncOpenAI:
+    return get_async_openai_client()
 
 
 def _get_model() -> str:
     return os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 
 
+def _get_dimensions() -> Optional[int]:
+    # OPENAI_EMBEDDING_DIMENSIONS asks text-embedding-3 models for shortened
+    # vectors (e.g. 256 or 512 instead of 1536); unset keeps the default.
+    dimensions = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS", "0"))
+    return dimensions if dimensions > 0 else None
+
+
+def embedding_model() -> str:
+    # Identifies the vector space: cache keys include the dimensions, so
+    # vectors of different sizes are never mixed up.
+    dimensions = _get_dimensions()
+    return f"{_get_model()}@{dimensions}" if dimensions else _get_model()
+
+
+def _get_cache() -> Optional[EmbeddingCache]:
+    # EMBEDDING_CACHE_MAX_ENTRIES=0 disables the cache.
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_entries = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+                if max_entries <= 0:
+                    return None
+                path = os.getenv(
+                    "EMBEDDING_CACHE_PATH",
+                    str(Path(__file__).resolve().parent / "embedding_cache.db"),
+                )
+                _cache = EmbeddingCache(Path(path), max_entries=max_entries)
+    return _cache
+
+
+def embedding_cache_stats() -> Dict[str, float]:
+    cache = _get_cache()
+    return cache.stats() if cache is not None else {}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; only used for batching.
+    return len(text) // 4 + 1
+
+
+def _token_batches(texts: List[str]) -> Iterator[List[str]]:
+    # Splits inputs into embeddings requests under the provider's per-request
+    # input count and token limits.
+    max_items = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "2048"))
+    max_tokens = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+    batch: List[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _request_options() -> Dict:
+    dimensions = _get_dimensions()
+    return {"dimensions": dimensions} if dimensions else {}
+
+
+def _lookup(texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+    # Cached vectors (None where missing) and the distinct missing texts.
+    cache = _get_cache()
+    cached = cache.get_many(embedding_model(), texts) if cache is not None else [None] * len(texts)
+    missing = list(dict.fromkeys(t for t, e in zip(texts, cached) if e is None))
+    metrics.EMBEDDING_INPUTS.inc("cache", amount=len(texts) - sum(e is None for e in cached))
+    metrics.EMBEDDING_INPUTS.inc("provider", amount=len(missing))
+    return cached, missing
+
+
+def _store(batch: List[str], resp) -> List[List[float]]:
+    metrics.record_usage("embeddings", _get_model(), getattr(resp, "usage", None))
+    embeddings = [item.embedding for item in resp.data]
+    cache = _get_cache()
+    if cache is not None:
+        cache.put_many(embedding_model(), batch, embeddings)
+    return embeddings
+
+
+def _request_embeddings(batch: List[str]) -> List[List[float]]:
+    def create():
+        return _get_client().embeddings.create(
+            model=_get_model(),
+            input=batch,
+            encoding_format="float",
+            **_request_options(),
+        )
+
+    with metrics.stage("embedding_request"):
+        resp = scheduler("embeddings").call(create, tokens=sum(estimate_tokens(t) for t in batch))
+    return _store(batch, resp)
+
+
+async def _arequest_embeddings(batch: List[str]) -> List[List[float]]:
+    def create():
+        return _get_async_client().embeddings.create(
+            model=_get_model(),
+            input=batch,
+            encoding_format="float",
+            **_request_options(),
+        )
+
+    async with openai_slots():
+        with metrics.stage("embedding_request"):
+            resp = await scheduler("embeddings").acall(
+                create, tokens=sum(estimate_tokens(t) for t in batch)
+            )
+    return await run_blocking(_store, batch, resp)
+
+
+def _send_embeddings(texts: List[str]) -> List[List[float]]:
+    # Deduplicated and packed into as few requests as the batch limits allow.
+    fresh: Dict[str, List[float]] = {}
+    for batch in _token_batches(list(dict.fromkeys(texts))):
+        fresh.update(zip(batch, _request_embeddings(batch)))
+    return [fresh[t] for t in texts]
+
+
+async def _asend_embeddings(texts: List[str]) -> List[List[float]]:
+    # As _send_embeddings, with the requests sent concurrently.
+    batches = list(_token_batches(list(dict.fromkeys(texts))))
+    fresh: Dict[str, List[float]] = {}
+    for batch, embeddings in zip(
+        batches, await asyncio.gather(*(_arequest_embeddings(b) for b in batches))
+    ):
+        fresh.update(zip(batch, embeddings))
+    return [fresh[t] for t in texts]
+
+
+# Cache misses of concurrent callers (enrichment workers, saves, questions)
+# that arrive within EMBEDDING_COALESCE_MS go out as one batch; 0 disables.
+_coalescer = Coalescer(
+    _send_embeddings,
+    _asend_embeddings,
+    window=float(os.getenv("EMBEDDING_COALESCE_MS", "5")) / 1000,
+    max_items=int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "2048")),
+)
+
+
+def _embed_many(texts: List[str]) -> List[List[float]]:
+    # Only texts missing from the cache go to the provider.
+    cached, missing = _lookup(texts)
+    fresh = dict(zip(missing, _coalescer.submit(missing))) if missing else {}
+    return [e if e is not None else fresh[t] for t, e in zip(texts, cached)]
+
+
+async def _aembed_many(texts: List[str]) -> List[List[float]]:
+    # Same as _embed_many, with the cache read and written on the blocking
+    # executor.
+    cached, missing = await run_blocking(_lookup, texts)
+    fresh = dict(zip(missing, await _coalescer.asubmit(missing))) if missing else {}
+    return [e if e is not None else fresh[t] for t, e in zip(texts, cached)]
+
+
 def embed_text(text: str) -> List[float]:
-    resp = _get_client().embeddings.create(
-        model=_get_model(),
-        input=text,
-        encoding_format="float",
-    )
-    return resp.data[0].embedding
+    return _embed_many([text])[0]
 
 
-def embed_note(title: str, content: str) -> List[float]:
+def note_input(title: str, content: str) -> str:
+    # The whole-note text, cut to the provider's per-input token limit
+    # (EMBEDDING_MAX_INPUT_TOKENS) so long notes still get a note embedding.
+    # Cut at ~3 characters per token, below estimate_tokens' 4, since dense
+    # text (code, URLs, non-English) packs more tokens per character.
     text = f"{title}\n\n{content}"
-    return embed_text(text)
+    max_chars = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191")) * 3
+    return text if len(text) <= max_chars else text[:max_chars]
 
 
-def chunk_text(text: str, max_words: int = 200, overlap: int = 40) -> List[str]:
-    words = text.split()
-    if not words:
-        return []
-    chunks: List[str] = []
+def embed_note(title: str, content: str) -> List[float]:
+    return embed_text(note_input(title, content))
+
+
+async def aembed_text(text: str) -> List[float]:
+    return (await _aembed_many([text]))[0]
+
+
+async def aembed_note(title: str, content: str) -> List[float]:
+    return await aembed_text(note_input(title, content))
+
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _sentences(text: str, max_words: int) -> Iterator[Tuple[List[str], bool]]:
+    # (words, ends_paragraph) per sentence. Sentences longer than max_words
+    # are cut into pieces by _split_words.
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        pieces: List[List[str]] = []
+        for sentence in _SENTENCE_END.split(paragraph):
+            words = sentence.split()
+            if len(words) > max_words:
+                pieces.extend(_split_words(words, max_words))
+            else:
+                pieces.append(words)
+        for i, words in enumerate(pieces):
+            yield words, i == len(pieces) - 1
+
+
+def _split_words(words: List[str], max_words: int) -> Iterator[List[str]]:
+    # Pieces of at most max_words that end at a word anchor (picked by the
+    # hash of the word and the one before it) once they have max_words // 4
+    # words, so the cuts inside a long sentence also follow its content.
+    min_words = max(1, max_words // 4)
     start = 0
-    while start < len(words):
-        end = min(len(words), start + max_words)
-        chunk = " ".join(words[start:end]).strip()
-        if chunk:
-            chunks.append(chunk)
-        if end == len(words):
-            break
-        start = max(0, end - overlap)
+    for i in range(1, len(words)):
+        size = i + 1 - start
+        if size >= max_words or (
+            size >= min_words and _is_anchor(words[i - 1 : i + 1], min_words)
+        ):
+            yield words[start : i + 1]
+            start = i + 1
+    if start < len(words):
+        yield words[start:]
+
+
+def _is_anchor(words: List[str], anchor_every: int) -> bool:
+    digest = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % anchor_every == 0
+
+
+def chunk_text(
+    text: str,
+    max_words: int = 200,
+    overlap: int = 40,
+    min_words: int = 80,
+    anchor_every: int = 4,
+) -> List[str]:
+    # Content-defined chunks: boundaries fall after a paragraph, or after a
+    # sentence whose hash picks it as an anchor, once a chunk has min_words;
+    # max_words forces a cut otherwise. Boundaries depend only on nearby
+    # text, so an edit changes the chunks around it and the rest keep their
+    # exact text (and stored embeddings). Each chunk after the first starts
+    # with the previous chunk's last sentence; sentences longer than overlap
+    # words are cut into pieces at word anchors, so the overlap holds for
+    # long or unpunctuated text too.
+    chunks: List[str] = []
+    current: List[str] = []
+    carried = 0
+
+    def cut(last_sentence: List[str]) -> None:
+        nonlocal current, carried
+        chunks.append(" ".join(current))
+        carried = len(last_sentence) if len(last_sentence) <= overlap else 0
+        current = list(last_sentence) if carried else []
+
+    last_sentence: List[str] = []
+    piece_words = min(max_words, overlap) if overlap > 0 else max_words
+    for words, ends_paragraph in _sentences(text, piece_words):
+        if not words:
+            continue
+        if len(current) + len(words) > max_words and len(current) > carried:
+            cut(last_sentence)
+        if len(current) + len(words) > max_words:
+            current, carried = [], 0
+        current.extend(words)
+        last_sentence = words
+        if len(current) >= min_words and (ends_paragraph or _is_anchor(words, anchor_every)):
+            cut(last_sentence)
+    if len(current) > carried:
+        chunks.append(" ".join(current))
     return chunks
 
 
 def embed_chunks(chunks: List[str]) -> List[List[float]]:
     if not chunks:
         return []
-    resp = _get_client().embeddings.create(
-        model=_get_model(),
-        input=chunks,
-        encoding_format="float",
-    )
-    return [item.embedding for item in resp.data]
+    return _embed_many(chunks)
+
+
+async def aembed_chunks(chunks: List[str]) -> List[List[float]]:
+    if not chunks:
+        return []
+    return await _aembed_many(chunks)
@@ -0,0 +1,115 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Persistent (model, sha256(text)) -> float32 embedding cache with LRU
+# eviction once it holds more than `max_entries` rows. It lives in its own
+# SQLite file: it only saves provider calls and can be deleted at any time.
+class EmbeddingCache:
+    def __init__(self, path: Path, max_entries: int = 100_000) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        # Worker processes share the file: WAL lets their lookups run while
+        # one of them writes.
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embedding_cache_last_used ON embedding_cache (last_used)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # Chunked to stay under SQLite's bound-parameter limit.
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for h, blob in self._conn.execute(
+                    f"SELECT text_hash, embedding FROM embedding_cache "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch),
+                ):
+                    found[h] = np.frombuffer(blob, dtype="<f4").tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            hits = sum(1 for h in hashes if h in found)
+            self.hits += hits
+            self.misses += len(hashes) - hits
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        rows = [
+            (model, text_hash(t), np.asarray(e, dtype="<f4").tobytes(), now)
+            for t, e in zip(texts, embeddings)
+            if len(e)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embedding_cache (model, text_hash, embedding, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._size += self._conn.total_changes - before
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    """
+                    DELETE FROM embedding_cache WHERE (model, text_hash) IN (
+                        SELECT model, text_hash FROM embedding_cache ORDER BY last_used LIMIT ?
+                    )
+                    """,
+                    (overflow,),
+                )
+                self._size -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,312 @@
+import sqlite3
+import threading
+import time
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+# Durable queue of notes waiting for tagging and embeddings. There is at
+# most one row per note: saving a note again overwrites its revision and
+# puts it back to "pending", so only the latest version is ever processed
+# and repeated saves collapse into one job. A worker that finishes an older
+# revision leaves the row pending for the newer one.
+#
+# Status values: pending -> running -> done, or failed after max_attempts.
+# A run that fails partway keeps what succeeded; tagged_revision records
+# that the tags of that revision are stored, so its retries only embed.
+# chunks_reused / chunks_embedded come from the last successful run; a save
+# that enriched the note itself records its own as a done job (record_done).
+#
+# A claim is a lease: run_after of a running job is when it expires. Jobs
+# whose lease ran out (their process died) are claimed again, so several
+# processes can share the queue without resetting each other's jobs.
+#
+# Every `repair_interval` seconds the notes still missing a note or chunk
+# embedding, or whose last job failed, are queued again (enqueue_missing),
+# so notes saved while the provider was refusing calls are backfilled. Each
+# revision is re-queued at most `max_repairs` times; a new save resets it.
+JOBS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS enrichment_jobs (
+        note_id TEXT PRIMARY KEY REFERENCES notes(id) ON DELETE CASCADE,
+        revision INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        run_after REAL NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL,
+        chunks_reused INTEGER,
+        chunks_embedded INTEGER,
+        tagged_revision INTEGER,
+        repairs INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+_RESULT_COLUMNS = ("chunks_reused", "chunks_embedded")
+# Columns added after the table was first created.
+_ADDED_COLUMNS = (*_RESULT_COLUMNS, "tagged_revision")
+
+_ENQUEUE_MISSING_SQL = """
+    INSERT INTO enrichment_jobs (note_id, revision, status, attempts, error, run_after, updated_at, repairs)
+    SELECT n.id, n.revision, 'pending', 0, NULL, 0, ?, 1
+    FROM notes n
+    LEFT JOIN enrichment_jobs j ON j.note_id = n.id
+    WHERE (j.status IS NULL OR (j.status IN ('done', 'failed') AND j.repairs < ?))
+      AND (
+          j.status = 'failed'
+          OR n.embedding IS NULL OR length(n.embedding) = 0
+          OR EXISTS (
+              SELECT 1 FROM chunks c
+              WHERE c.note_id = n.id AND (c.embedding IS NULL OR length(c.embedding) = 0)
+          )
+      )
+    ON CONFLICT(note_id) DO UPDATE SET
+        revision = excluded.revision,
+        status = 'pending',
+        attempts = 0,
+        error = NULL,
+        run_after = 0,
+        updated_at = excluded.updated_at,
+        repairs = repairs + 1
+"""
+
+
+class EnrichmentQueue:
+    def __init__(
+        self,
+        get_conn: Callable[[], ContextManager[sqlite3.Connection]],
+        process: Callable[[str, int], Optional[Dict[str, int]]],
+        workers: int = 2,
+        poll_interval: float = 0.5,
+        max_attempts: int = 3,
+        repair_interval: float = 600.0,
+        lease: float = 300.0,
+        max_repairs: int = 3,
+    ) -> None:
+        self._get_conn = get_conn
+        self._process = process
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.repair_interval = repair_interval
+        self.lease = lease
+        self.max_repairs = max_repairs
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @staticmethod
+    def init_schema(conn: sqlite3.Connection) -> None:
+        conn.execute(JOBS_TABLE_SQL)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(enrichment_jobs)")}
+        for column in _ADDED_COLUMNS:
+            if column not in columns:
+                conn.execute(f"ALTER TABLE enrichment_jobs ADD COLUMN {column} INTEGER")
+        if "repairs" not in columns:
+            conn.execute("ALTER TABLE enrichment_jobs ADD COLUMN repairs INTEGER NOT NULL DEFAULT 0")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS enrichment_jobs_pending "
+            "ON enrichment_jobs (status, run_after)"
+        )
+
+    @staticmethod
+    def enqueue(conn: sqlite3.Connection, note_id: str, revision: int) -> None:
+        # Runs inside the caller's transaction, next to the note write.
+        conn.execute(
+            """
+            INSERT INTO enrichment_jobs (note_id, revision, status, attempts, error, run_after, updated_at)
+            VALUES (?, ?, 'pending', 0, NULL, 0, ?)
+            ON CONFLICT(note_id) DO UPDATE SET
+                revision = excluded.revision,
+                status = 'pending',
+                attempts = 0,
+                error = NULL,
+                run_after = 0,
+                updated_at = excluded.updated_at,
+                repairs = 0
+            """,
+            (note_id, revision, time.time()),
+        )
+
+    @staticmethod
+    def is_tagged(conn: sqlite3.Connection, note_id: str, revision: int) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM enrichment_jobs WHERE note_id = ? AND tagged_revision = ?",
+            (note_id, revision),
+        ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def mark_tagged(conn: sqlite3.Connection, note_id: str, revision: int) -> None:
+        # Runs inside the transaction that stored the tags.
+        conn.execute(
+            "UPDATE enrichment_jobs SET tagged_revision = ? WHERE note_id = ? AND revision = ?",
+            (revision, note_id, revision),
+        )
+
+    @staticmethod
+    def record_done(conn: sqlite3.Connection, note_id: str, revision: int, result: Dict[str, int]) -> None:
+        # Runs inside the caller's transaction; supersedes any older job.
+        conn.execute(
+            """
+            INSERT INTO enrichment_jobs (
+                note_id, revision, status, attempts, error, run_after, updated_at,
+                chunks_reused, chunks_embedded
+            )
+            VALUES (?, ?, 'done', 0, NULL, 0, ?, ?, ?)
+            ON CONFLICT(note_id) DO UPDATE SET
+                revision = excluded.revision,
+                status = 'done',
+                attempts = 0,
+                error = NULL,
+                run_after = 0,
+                updated_at = excluded.updated_at,
+                chunks_reused = excluded.chunks_reused,
+                chunks_embedded = excluded.chunks_embedded,
+                repairs = 0
+            """,
+            (note_id, revision, time.time(), *(result.get(column) for column in _RESULT_COLUMNS)),
+        )
+
+    @staticmethod
+    def enqueue_missing(conn: sqlite3.Connection, max_repairs: int = 3) -> int:
+        # Pending and running jobs are left alone: they are already on it.
+        return conn.execute(_ENQUEUE_MISSING_SQL, (time.time(), max_repairs)).rowcount
+
+    def repair(self) -> int:
+        with self._get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = self.enqueue_missing(conn, self.max_repairs)
+            conn.commit()
+        if queued:
+            self.notify()
+        return queued
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"enrichment-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.repair_interval > 0:
+            thread = threading.Thread(target=self._run_repair, name="enrichment-repair", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def status(self, note_id: str) -> Optional[Dict]:
+        with self._get_conn() as conn:
+            row = conn.execute(
+                "SELECT note_id, revision, status, attempts, error, updated_at, "
+                "chunks_reused, chunks_embedded FROM enrichment_jobs WHERE note_id = ?",
+                (note_id,),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._get_conn() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM enrichment_jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _claim(self) -> Optional[Tuple[str, int]]:
+        now = time.time()
+        with self._get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Expired leases that already used every attempt give up here,
+            # since no _finish() will run for them.
+            conn.execute(
+                "UPDATE enrichment_jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                "WHERE status = 'running' AND run_after <= ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                """
+                SELECT note_id, revision FROM enrichment_jobs
+                WHERE status IN ('pending', 'running') AND run_after <= ?
+                ORDER BY updated_at
+                LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE enrichment_jobs SET status = 'running', attempts = attempts + 1, "
+                    "run_after = ?, updated_at = ? WHERE note_id = ?",
+                    (now + self.lease, now, row["note_id"]),
+                )
+            conn.commit()
+        return (row["note_id"], row["revision"]) if row is not None else None
+
+    def _finish(
+        self,
+        note_id: str,
+        revision: int,
+        error: Optional[str],
+        result: Optional[Dict[str, int]] = None,
+    ) -> None:
+        # Matching on revision leaves a job that was re-queued mid-run pending.
+        now = time.time()
+        result = result or {}
+        with self._get_conn() as conn:
+            if error is None:
+                conn.execute(
+                    "UPDATE enrichment_jobs SET status = 'done', error = NULL, updated_at = ?, "
+                    "chunks_reused = ?, chunks_embedded = ? "
+                    "WHERE note_id = ? AND revision = ?",
+                    (
+                        now,
+                        *(result.get(column) for column in _RESULT_COLUMNS),
+                        note_id,
+                        revision,
+                    ),
+                )
+            else:
+                conn.execute(
+                    """
+                    UPDATE enrichment_jobs
+                    SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                        error = ?,
+                        run_after = ? + (1 << attempts),
+                        updated_at = ?
+                    WHERE note_id = ? AND revision = ?
+                    """,
+                    (self.max_attempts, error, now, now, note_id, revision),
+                )
+            conn.commit()
+
+    def _run_repair(self) -> None:
+        while True:
+            try:
+                self.repair()
+            except sqlite3.Error:
+                pass
+            if self._stop.wait(self.repair_interval):
+                return
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            note_id, revision = job
+            try:
+                result = self._process(note_id, revision)
+            except Exception as exc:
+                self._finish(note_id, revision, f"{type(exc).__name__}: {exc}")
+            else:
+                self._finish(note_id, revision, None, result)
@@ -0,0 +1,296 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Collection, ContextManager, Dict, List, Optional, Sequence, Set, Tuple
+
+from . import metrics, vector_file
+from .retrieval import ChunkIndex, ChunkMatrix
+
+# Keeps a process's ChunkIndex in step with a database that other worker
+# processes (uvicorn --workers N) and scripts write to. Every insert, update
+# and delete of a note bumps the `notes` generation and logs the note id in
+# `note_changes` (triggers in main._GENERATIONS_SQL). sync() compares the
+# generation the index reflects with the current one, a primary-key read,
+# and reloads only the notes changed since; when the log no longer reaches
+# back that far it reloads everything. A writer in this process that
+# patches the index itself moves the index's generation past its own write
+# (written/advance), so the next sync has nothing to reload.
+#
+# Notes written since the index's base matrix was built keep private
+# blocks. Once those, or the base rows they replaced, exceed
+# `rebuild_fraction` of the base, sync() rebuilds the base in the
+# background (ChunkIndex.compact), and likewise retrains an ANN backend
+# whose corpus outgrew it (ChunkIndex.retrain_ann).
+#
+# With `shared_dir`, the base is instead the newest vector_file snapshot,
+# memory-mapped and shared by every process, and the rebuild writes a new
+# snapshot that every process switches to on its next sync.
+
+# Seconds between base rebuilds started by one process.
+REBUILD_BACKOFF = 5.0
+
+Loader = Callable[[sqlite3.Connection, Optional[Sequence[str]]], List[Dict]]
+
+
+def _generation(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM generations WHERE name = 'notes'").fetchone()
+    return row[0] if row is not None else 0
+
+
+def _changed_notes(conn: sqlite3.Connection, since: int, until: int) -> Optional[Set[str]]:
+    # Ids of the notes changed in (since, until]; None when the log has
+    # been trimmed past `since`.
+    if until <= since:
+        return set()
+    oldest = conn.execute("SELECT MIN(generation) FROM note_changes").fetchone()[0]
+    if oldest is None or oldest > since + 1:
+        return None
+    rows = conn.execute(
+        "SELECT DISTINCT note_id FROM note_changes WHERE generation > ? AND generation <= ?",
+        (since, until),
+    )
+    return {row[0] for row in rows}
+
+
+class IndexSync:
+    def __init__(
+        self,
+        get_conn: Callable[[], ContextManager[sqlite3.Connection]],
+        index: ChunkIndex,
+        lock: threading.Lock,
+        load_notes: Loader,
+        interval: float = 0.0,
+        shared_dir: Optional[Path] = None,
+        rebuild_fraction: float = 0.1,
+    ) -> None:
+        self._get_conn = get_conn
+        self.index = index
+        # The writers' lock: patches from this process and refreshes from
+        # the database are applied in commit order.
+        self._lock = lock
+        self._load_notes = load_notes
+        self.interval = interval
+        self.shared_dir = shared_dir
+        self.rebuild_fraction = rebuild_fraction
+        self._checked = 0.0
+        self._stamp: Optional[int] = None
+        self._rebuilding = threading.Event()
+        self._next_rebuild = 0.0
+
+    def load(self) -> None:
+        with self._lock:
+            if self.index.loaded:
+                return
+            if self.shared_dir is None:
+                self._load_private()
+                return
+            if self._load_shared():
+                return
+            # One process writes the first snapshot; the others wait here
+            # and then map it instead of building private copies too.
+            with vector_file.publish_lock(self.shared_dir, blocking=True):
+                if not self._load_shared():
+                    self._load_private()
+                    self._publish(self.index.blocks(), self.index.source_generation)
+                    self._adopt()
+
+    def sync(self) -> None:
+        now = time.monotonic()
+        if self.interval > 0 and now - self._checked < self.interval:
+            return
+        self._checked = now
+        index = self.index
+        with self._get_conn() as conn:
+            current = _generation(conn)
+        stamp = vector_file.stamp(self.shared_dir) if self.shared_dir is not None else None
+        if current != index.source_generation or stamp != self._stamp:
+            with self._lock, metrics.stage("index_sync"):
+                self._refresh()
+                if self.shared_dir is not None and stamp != self._stamp:
+                    self._stamp = stamp
+                    if vector_file.latest_generation(self.shared_dir) != index.base_generation:
+                        self._adopt()
+        self._maybe_rebuild()
+
+    def written(self, conn: sqlite3.Connection, note_ids: Collection[str]) -> Optional[int]:
+        # Called by a writer holding the writers' lock, after its writes and
+        # before its commit: the generation the index reflects once it has
+        # patched `note_ids`, or None when other processes changed notes
+        # too, which the next sync reloads along with these.
+        index = self.index
+        if not index.loaded:
+            return None
+        current = _generation(conn)
+        changed = _changed_notes(conn, index.source_generation, current)
+        if changed is None or not changed <= set(note_ids):
+            return None
+        return current
+
+    def advance(self, generation: Optional[int]) -> None:
+        # After the writer patched the index, still under the writers' lock.
+        if generation is not None and generation > self.index.source_generation:
+            self.index.source_generation = generation
+
+    def _load_private(self) -> None:
+        with self._get_conn() as conn:
+            conn.execute("BEGIN")
+            generation = _generation(conn)
+            with metrics.stage("db_load"):
+                notes = self._load_notes(conn, None)
+            conn.commit()
+        with metrics.stage("index_build"):
+            self.index.load(notes)
+        self.index.source_generation = generation
+
+    def _load_shared(self) -> bool:
+        # Maps the newest snapshot and reads titles and texts, not vectors,
+        # for the notes it still covers; the rest are loaded in full.
+        snapshot = vector_file.open_latest(self.shared_dir)
+        if snapshot is None:
+            return False
+        with self._get_conn() as conn:
+            conn.execute("BEGIN")
+            generation = _generation(conn)
+            changed = _changed_notes(conn, snapshot.generation, generation)
+            if snapshot.generation > generation or changed is None:
+                return False
+            with metrics.stage("db_load"):
+                texts: Dict[str, Tuple[str, Dict[int, str]]] = {}
+                for note_id, title, chunk_index, text in conn.execute(
+                    "SELECT n.id, n.title, c.chunk_index, c.text "
+                    "FROM notes n JOIN chunks c ON c.note_id = n.id"
+                ):
+                    texts.setdefault(note_id, (title, {}))[1][chunk_index] = text
+                ids = [row[0] for row in conn.execute("SELECT id FROM notes")]
+
+                note_ids: List[str] = []
+                note_titles: List[str] = []
+                row_texts: List[str] = []
+                ranges: List[Tuple[str, int, int]] = []
+                for note_id, start, end in snapshot.ranges():
+                    title, chunks = texts.get(note_id, ("", {}))
+                    indices = snapshot.chunk_indices[start:end].tolist()
+                    if note_id in changed or sorted(chunks) != indices:
+                        title, chunks = "", {}
+                    else:
+                        ranges.append((note_id, start, end))
+                    note_ids.extend([note_id] * (end - start))
+                    note_titles.extend([title] * (end - start))
+                    row_texts.extend(chunks.get(i, "") for i in indices)
+                shared = {note_id for note_id, _, _ in ranges}
+                notes = self._load_notes(conn, [i for i in ids if i not in shared])
+            conn.commit()
+        base = ChunkMatrix(
+            note_ids,
+            note_titles,
+            snapshot.chunk_indices.tolist(),
+            row_texts,
+            snapshot.matrix,
+            snapshot.valid,
+        )
+        with metrics.stage("index_build"):
+            self.index.load_shared(base, ranges, notes, snapshot.generation)
+        self.index.source_generation = generation
+        self._stamp = vector_file.stamp(self.shared_dir)
+        return True
+
+    def _refresh(self) -> None:
+        index = self.index
+        with self._get_conn() as conn:
+            conn.execute("BEGIN")
+            current = _generation(conn)
+            if current == index.source_generation:
+                return
+            changed = _changed_notes(conn, index.source_generation, current)
+            notes = self._load_notes(conn, None if changed is None else sorted(changed))
+            conn.commit()
+        if changed is None:
+            metrics.INDEX_REFRESHES.inc("full")
+            index.load(notes)
+        else:
+            metrics.INDEX_REFRESHES.inc("notes", amount=len(changed))
+            # Oldest first, so notes new to this process keep their order.
+            index.upsert_notes(list(reversed(notes)))
+            for note_id in changed - {note["id"] for note in notes}:
+                index.remove_note(note_id)
+        index.source_generation = current
+
+    def _adopt(self) -> None:
+        # Switches to the newest snapshot, keeping the blocks of the notes
+        # changed since it was written. Runs after _refresh(), so the index
+        # is at least as new as the snapshot.
+        snapshot = vector_file.open_latest(self.shared_dir)
+        if snapshot is None or snapshot.generation > self.index.source_generation:
+            return
+        with self._get_conn() as conn:
+            changed = _changed_notes(conn, snapshot.generation, _generation(conn))
+        if changed is None:
+            return
+        self.index.rebase(
+            snapshot.matrix, snapshot.valid, snapshot.ranges(), snapshot.generation, keep=changed
+        )
+        metrics.INDEX_REFRESHES.inc("snapshot")
+
+    def _maybe_rebuild(self) -> None:
+        index = self.index
+        if index.ann_retrain_due and not self._rebuilding.is_set():
+            self._rebuilding.set()
+            threading.Thread(target=self._retrain_in_background, name="ann-retrain", daemon=True).start()
+            return
+        limit = self.rebuild_fraction * index.base_rows
+        # After a full reload the base is a private copy, not a snapshot.
+        stale = index.private_rows > limit or index.dead_rows > limit or (
+            self.shared_dir is not None and index.base_generation is None
+        )
+        if not stale or self._rebuilding.is_set() or time.monotonic() < self._next_rebuild:
+            return
+        self._rebuilding.set()
+        self._next_rebuild = time.monotonic() + REBUILD_BACKOFF
+        if self.shared_dir is None:
+            target, args = self._compact_in_background, ()
+        else:
+            with self._lock:
+                args = (index.blocks(), index.source_generation)
+            target = self._publish_in_background
+        threading.Thread(target=target, args=args, name="index-rebuild", daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            with metrics.stage("index_compact"):
+                self.index.compact()
+            metrics.INDEX_REFRESHES.inc("compact")
+        finally:
+            self._rebuilding.clear()
+
+    def _retrain_in_background(self) -> None:
+        try:
+            with metrics.stage("ann_retrain"):
+                retrained = self.index.retrain_ann()
+            if retrained:
+                metrics.INDEX_REFRESHES.inc("ann_retrain")
+        finally:
+            self._rebuilding.clear()
+
+    def _publish_in_background(self, blocks: List[Tuple[str, ChunkMatrix]], generation: int) -> None:
+        # Another process already writing a snapshot wins; this process
+        # adopts it on a later sync.
+        try:
+            with vector_file.publish_lock(self.shared_dir) as acquired:
+                if acquired:
+                    self._publish(blocks, generation)
+        finally:
+            # The next sync looks for a snapshot to adopt even when none
+            # was written here.
+            self._stamp = None
+            self._rebuilding.clear()
+
+    def _publish(self, blocks: List[Tuple[str, ChunkMatrix]], generation: int) -> None:
+        # Labelling the blocks with the generation the index had synced to
+        # is safe: notes patched locally since then are newer in the log and
+        # kept private by _adopt().
+        latest = vector_file.latest_generation(self.shared_dir)
+        if latest is not None and latest >= generation:
+            return
+        with metrics.stage("vector_snapshot"):
+            vector_file.publish(self.shared_dir, generation, blocks)
@@ -0,0 +1,82 @@
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# FTS5 index over chunks.text. It is an external-content table (the text
+# lives only in `chunks`) kept in sync by triggers, so every write path
+# (note updates, bulk import, cascading deletes) updates it without extra
+# code. It is keyed on chunks.id, an INTEGER PRIMARY KEY, which VACUUM
+# keeps unchanged.
+FTS_SCHEMA_SQL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+        text, content='chunks', content_rowid='id', tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+        INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+        INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE ON chunks BEGIN
+        INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+MAX_QUERY_TERMS = 32
+
+
+def init_schema(conn: sqlite3.Connection) -> None:
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+    ).fetchone()
+    for statement in FTS_SCHEMA_SQL:
+        conn.execute(statement)
+    if not exists:
+        conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+
+
+def fts_query(question: str) -> str:
+    # Free text -> an FTS5 OR query of quoted terms, so punctuation and
+    # FTS operators in the question can never be a syntax error.
+    terms = list(dict.fromkeys(t.lower() for t in _TOKEN.findall(question)))[:MAX_QUERY_TERMS]
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+def search_bm25(conn: sqlite3.Connection, question: str, limit: int) -> List[Tuple[str, int]]:
+    # (note_id, chunk_index) of the best BM25 matches, best first.
+    query = fts_query(question)
+    if not query:
+        return []
+    rows = conn.execute(
+        """
+        SELECT c.note_id, c.chunk_index
+        FROM chunks_fts
+        JOIN chunks c ON c.id = chunks_fts.rowid
+        WHERE chunks_fts MATCH ?
+        ORDER BY bm25(chunks_fts)
+        LIMIT ?
+        """,
+        (query, limit),
+    ).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+def reciprocal_rank_fusion(
+    rankings: Iterable[Sequence[Tuple[str, int]]], k: int = 60
+) -> Dict[Tuple[str, int], float]:
+    # RRF: each list contributes 1 / (k + rank) for every key it ranks.
+    fused: Dict[Tuple[str, int], float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return fused
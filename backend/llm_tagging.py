@@ -1,20 +1,18 @@
 # app/llm_tagging.py
 import os
 import re
-from pathlib import Path
-from openai import OpenAI
-from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+from . import metrics
+from .embed import estimate_tokens
+from .resources import get_async_openai_client, get_openai_client, openai_slots
+from .scheduler import OUTPUT_TOKEN_ALLOWANCE, scheduler
 from .schemas import TaggingResult
 
-_env_loaded = False
-
 def _get_client() -> OpenAI:
-    global _env_loaded
-    if not _env_loaded:
-        env_path = Path(__file__).resolve().parent / ".env"
-        load_dotenv(env_path)
-        _env_loaded = True
-    return OpenAI()
+    return get_openai_client()
+
+def _get_async_client() -> AsyncOpenAI:
+    return get_async_openai_client()
 
 def _normalize_tag(name: str) -> str:
     name = name.strip().lower()
@@ -23,7 +21,7 @@ def _normalize_tag(name: str) -> str:
     name = re.sub(r"_+", "_", name)
     return name[:40].strip("_")
 
-def tag_note_with_llm(title: str, body: str) -> TaggingResult:
+def _tagging_request(title: str, body: str) -> dict:
     schema = TaggingResult.model_json_schema()
 
     prompt = f"""
@@ -44,11 +42,10 @@ BODY:
 {body}
 """.strip()
 
-    model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    resp = _get_client().responses.create(
-        model=model_name,
-        input=prompt,
-        text={
+    return {
+        "model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        "input": prompt,
+        "text": {
             "format": {
                 "type": "json_schema",
                 "name": "note_tagging",
@@ -56,7 +53,13 @@ BODY:
                 "strict": True,
             }
         },
-    )
+    }
+
+def _request_tokens(request: dict) -> int:
+    return estimate_tokens(request["input"]) + OUTPUT_TOKEN_ALLOWANCE
+
+def _clean_result(resp, model_name: str) -> TaggingResult:
+    metrics.record_usage("tagging", model_name, getattr(resp, "usage", None))
 
     result = TaggingResult.model_validate_json(resp.output_text)
 
@@ -71,3 +74,20 @@ BODY:
         cleaned_tags.append({"name": norm, "confidence": float(t.confidence)})
 
     return TaggingResult(tags=cleaned_tags if cleaned_tags else result.tags)
+
+def tag_note_with_llm(title: str, body: str) -> TaggingResult:
+    request = _tagging_request(title, body)
+    with metrics.stage("llm_tagging"):
+        resp = scheduler("responses").call(
+            lambda: _get_client().responses.create(**request), tokens=_request_tokens(request)
+        )
+    return _clean_result(resp, request["model"])
+
+async def atag_note_with_llm(title: str, body: str) -> TaggingResult:
+    request = _tagging_request(title, body)
+    async with openai_slots():
+        with metrics.stage("llm_tagging"):
+            resp = await scheduler("responses").acall(
+                lambda: _get_async_client().responses.create(**request), tokens=_request_tokens(request)
+            )
+    return _clean_result(resp, request["model"])
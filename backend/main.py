@@ -1,18 +1,148 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import hashlib
 import json
+import multiprocessing
+import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import ContextManager
+from urllib.parse import urlencode
 from uuid import uuid4
 
-from .llm_tagging import tag_note_with_llm
-from .embed import embed_note, chunk_text, embed_chunks
-from .rag import answer_question, retrieve_top_chunks
-from .schemas import NoteCreate, NoteUpdate, NoteResponse, AskRequest, AskResponse
+import numpy as np
 
-app = FastAPI(title="Note Tagging API")
+from . import lexical, metrics
+from .ann import IVFFlatIndex
+from .quantize import QuantizedIndex
+from .bulk_import import BulkImporter
+from .llm_tagging import atag_note_with_llm, tag_note_with_llm
+from .enrichment import EnrichmentQueue
+from .index_sync import IndexSync
+from .embed import (
+    aembed_chunks,
+    aembed_note,
+    chunk_text,
+    embed_chunks,
+    embed_note,
+    embedding_cache_stats,
+)
+from .ask_cache import SemanticAnswerCache
+from .rag import (
+    aanswer_question,
+    aembed_query,
+    astream_answer,
+    build_context,
+    context_stats,
+    query_embedding_cache_stats,
+    rank_chunks,
+    rank_chunks_hybrid,
+    rank_chunks_prefiltered,
+)
+from .resources import aclose_resources, db_pool, open_resources, run_blocking
+from .retrieval import ChunkIndex
+from .schemas import (
+    NoteCreate,
+    NoteUpdate,
+    NoteProjection,
+    NoteResponse,
+    AskRequest,
+    AskResponse,
+    EnrichmentStatus,
+    BulkImportResult,
+)
+
+DB_PATH = Path(os.getenv("NOTES_DB_PATH", Path(__file__).resolve().parent / "notes.db"))
+
+
+def _create_chunk_index() -> ChunkIndex:
+    # RETRIEVAL_BACKEND=ivf searches an IVF-flat index once the corpus has
+    # IVF_MIN_VECTORS embedded chunks; IVF_NPROBE trades latency for recall.
+    # RETRIEVAL_BACKEND=int8|binary scans compressed codes (optionally
+    # PCA-reduced to QUANT_PCA_DIM) and rescores QUANT_RESCORE_FACTOR x top_k
+    # candidates with the full vectors.
+    backend = os.getenv("RETRIEVAL_BACKEND", "exact")
+    if backend in ("int8", "binary"):
+        return ChunkIndex(
+            ann_factory=lambda: QuantizedIndex(
+                kind=backend,
+                rescore_factor=int(os.getenv("QUANT_RESCORE_FACTOR", "4")),
+                pca_dim=int(os.getenv("QUANT_PCA_DIM", "0")),
+            ),
+            ann_path=DB_PATH.with_name(f"notes.{backend}.npz"),
+            ann_min_vectors=int(os.getenv("QUANT_MIN_VECTORS", "0")),
+        )
+    if backend != "ivf":
+        return ChunkIndex()
+    return ChunkIndex(
+        ann_factory=lambda: IVFFlatIndex(
+            nlist=int(os.getenv("IVF_NLIST", "0")),
+            nprobe=int(os.getenv("IVF_NPROBE", "8")),
+        ),
+        ann_path=DB_PATH.with_name("notes.ivf.npz"),
+        ann_min_vectors=int(os.getenv("IVF_MIN_VECTORS", "20000")),
+    )
+
+
+def _several_workers() -> bool:
+    # uvicorn --workers N spawns each worker through multiprocessing and
+    # also reads N from WEB_CONCURRENCY.
+    return multiprocessing.parent_process() is not None or int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+
+
+def _create_index_sync(index: ChunkIndex) -> IndexSync:
+    # INDEX_SYNC_INTERVAL (seconds) bounds how often a worker checks for
+    # notes changed by other processes. It defaults to 0 (every search) when
+    # several workers serve the app, and to 5 for a single process, whose
+    # own writes patch the index directly and which only needs to notice
+    # scripts such as bulk_import writing to the database. SHARED_VECTORS=1
+    # maps the chunk vectors from a snapshot in SHARED_VECTORS_DIR (default
+    # notes.vectors next to the database) shared by every worker. It is the
+    # default for the int8/binary backends, which then hold only their codes
+    # and rescore from the mapped rows. The base matrix (or snapshot) is
+    # rebuilt once INDEX_REBUILD_FRACTION of its rows changed.
+    quantized = os.getenv("RETRIEVAL_BACKEND", "exact") in ("int8", "binary")
+    shared_dir = None
+    if os.getenv("SHARED_VECTORS", "1" if quantized else "0") == "1":
+        shared_dir = Path(os.getenv("SHARED_VECTORS_DIR", str(DB_PATH.with_name("notes.vectors"))))
+    return IndexSync(
+        _get_conn,
+        index,
+        _write_lock,
+        _load_note_records,
+        interval=float(os.getenv("INDEX_SYNC_INTERVAL", "0" if _several_workers() else "5")),
+        shared_dir=shared_dir,
+        rebuild_fraction=float(os.getenv("INDEX_REBUILD_FRACTION", "0.1")),
+    )
 
-DB_PATH = Path(__file__).resolve().parent / "notes.db"
+
+# In-memory copy of every chunk embedding, so /api/ask never reads SQLite.
+# Writers hold _write_lock across the DB commit and the index patch so the
+# index applies updates in the same order as the database; _index_sync
+# applies the writes of other processes under the same lock.
+_chunk_index = _create_chunk_index()
+_write_lock = threading.Lock()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_resources(DB_PATH)
+    _get_chunk_index()
+    _enrichment_queue.start()
+    yield
+    _enrichment_queue.stop()
+    _chunk_index.save()
+    await aclose_resources()
+
+
+app = FastAPI(title="Note Tagging API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,31 +157,232 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # Request counters and latency by route template, Server-Timing with
+    # the stages of this request when SERVER_TIMING=1, and a sampling
+    # profile written to PROFILE_DIR for requests sent with `X-Profile: 1`
+    # when PROFILE_REQUESTS=1. Streaming responses are measured up to their
+    # headers.
+    profiler = None
+    if metrics.profiling_enabled() and request.headers.get("x-profile") == "1":
+        profiler = metrics.SamplingProfiler(float(os.getenv("PROFILE_INTERVAL", "0.005")))
+        profiler.start()
+    trace = metrics.RequestTrace(profiler)
+    token = metrics.start_trace(trace)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.end_trace(token)
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.HTTP_REQUESTS.inc(request.method, path, str(status))
+        metrics.HTTP_LATENCY.observe(elapsed, request.method, path)
+        if profiler is not None:
+            profiler.stop()
+    if metrics.server_timing_enabled():
+        trace.add("total", elapsed)
+        response.headers["Server-Timing"] = trace.server_timing()
+    if profiler is not None:
+        name = f"{int(time.time() * 1000)}-{request.method.lower()}{path.replace('/', '_')}"
+        directory = Path(os.getenv("PROFILE_DIR", str(DB_PATH.with_name("profiles"))))
+        response.headers["X-Profile-File"] = profiler.write(directory, name).name
+    return response
+
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/health")
-def health() -> dict:
+async def health() -> dict:
     return {"status": "ok"}
 
-def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+
+def _get_conn() -> ContextManager[sqlite3.Connection]:
+    # Pooled connection in WAL mode; use as `with _get_conn() as conn:`.
+    return db_pool(DB_PATH).connection()
+
+
+# PRAGMA user_version of the current layout. Version 0 kept the note and
+# chunk embeddings as JSON text inside `notes`; version 1 stores packed
+# float32 BLOBs and one `chunks` row per chunk; version 2 adds
+# notes.revision and the enrichment job queue; version 3 the chunks_fts
+# full-text index; version 4 the `generations` counters; version 5 the
+# per-job chunk reuse counts; version 6 the note_changes log; version 7
+# the per-job tagged revision; version 8 the per-job repair count; version
+# 9 the explicit chunks.id key of chunks_fts.
+SCHEMA_VERSION = 9
+
+# Notes changed per generation, kept for the last NOTE_CHANGES_KEPT
+# generations.
+NOTE_CHANGES_KEPT = 100_000
+
+_GENERATION_TRIGGER_SQL = """
+    CREATE TRIGGER IF NOT EXISTS notes_generation_{event} AFTER {event} ON notes BEGIN
+        UPDATE generations SET value = value + 1 WHERE name = 'notes';
+        INSERT INTO note_changes (generation, note_id)
+        SELECT value, {row}.id FROM generations WHERE name = 'notes';
+        DELETE FROM note_changes
+        WHERE generation <= (SELECT value FROM generations WHERE name = 'notes') - {kept};
+    END
+"""
+
+# Monotonic per-table change counters. The `notes` counter is bumped by
+# triggers on every insert, update and delete, which also log the note id
+# in note_changes. It backs the ETags of the notes endpoints and tells each
+# worker process which notes to reload into its chunk index (index_sync).
+_GENERATIONS_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS generations (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS note_changes (
+        generation INTEGER PRIMARY KEY,
+        note_id TEXT NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO generations (name, value) VALUES ('notes', 0)",
+    *(
+        _GENERATION_TRIGGER_SQL.format(event=event, row=row, kept=NOTE_CHANGES_KEPT)
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+    ),
+)
+
+_NOTES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tags TEXT NOT NULL DEFAULT '[]',
+        embedding BLOB NOT NULL DEFAULT x'',
+        revision INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+# `id` is an explicit INTEGER PRIMARY KEY so VACUUM cannot renumber it:
+# the chunks_fts index is keyed on it.
+_CHUNKS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        note_id TEXT NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+        chunk_index INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        embedding BLOB NOT NULL DEFAULT x'',
+        UNIQUE (note_id, chunk_index)
+    )
+"""
 
 
 def _init_db() -> None:
     with _get_conn() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        has_notes = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes'"
+        ).fetchone()
+        if has_notes and version < 1:
+            _migrate_json_embeddings(conn)
+            conn.execute("VACUUM")
+        conn.execute(_NOTES_TABLE_SQL.format(name="notes"))
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(notes)")}
+        if "revision" not in columns:
+            conn.execute("ALTER TABLE notes ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        chunk_columns = {row["name"] for row in conn.execute("PRAGMA table_info(chunks)")}
+        if chunk_columns and "id" not in chunk_columns:
+            _migrate_chunk_ids(conn)
+        conn.execute(_CHUNKS_TABLE_SQL.format(name="chunks"))
+        lexical.init_schema(conn)
+        EnrichmentQueue.init_schema(conn)
+        if version < 6:
+            # Recreated with the note_changes insert.
+            for event in ("insert", "update", "delete"):
+                conn.execute(f"DROP TRIGGER IF EXISTS notes_generation_{event}")
+        for statement in _GENERATIONS_SQL:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+
+def _migrate_json_embeddings(conn: sqlite3.Connection) -> None:
+    # Rebuilds `notes` without the JSON columns, keeping rowids (the list
+    # order), and moves every chunk into its own row. Runs in one
+    # transaction, so an interrupted migration leaves version 0 intact.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DROP TABLE IF EXISTS notes_v1")
+        conn.execute(_NOTES_TABLE_SQL.format(name="notes_v1"))
+        chunk_rows = []
+        for row in conn.execute(
+            "SELECT rowid, id, title, content, tags, embedding, chunks FROM notes"
+        ).fetchall():
+            conn.execute(
+                """
+                INSERT INTO notes_v1 (rowid, id, title, content, tags, embedding)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    row["rowid"],
+                    row["id"],
+                    row["title"],
+                    row["content"],
+                    row["tags"],
+                    _pack_embedding(_parse_json_array(row["embedding"])),
+                ),
+            )
+            for position, chunk in enumerate(_parse_json_array(row["chunks"])):
+                if not isinstance(chunk, dict) or not isinstance(chunk.get("text"), str):
+                    continue
+                chunk_rows.append(
+                    (
+                        row["id"],
+                        int(chunk.get("index", position)),
+                        chunk["text"],
+                        _pack_embedding(chunk.get("embedding") or []),
+                    )
+                )
+        conn.execute("DROP TABLE notes")
+        conn.execute("ALTER TABLE notes_v1 RENAME TO notes")
+        conn.execute(_CHUNKS_TABLE_SQL.format(name="chunks"))
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (note_id, chunk_index, text, embedding) VALUES (?, ?, ?, ?)",
+            chunk_rows,
+        )
+        conn.execute("PRAGMA user_version = 1")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _migrate_chunk_ids(conn: sqlite3.Connection) -> None:
+    # Rebuilds `chunks` with an explicit `id` key, numbered in the old rowid
+    # order. chunks_fts and its triggers are dropped with it and rebuilt by
+    # lexical.init_schema.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DROP TABLE IF EXISTS chunks_v9")
+        conn.execute(_CHUNKS_TABLE_SQL.format(name="chunks_v9"))
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS notes (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                tags TEXT NOT NULL DEFAULT '[]',
-                embedding TEXT NOT NULL DEFAULT '[]',
-                chunks TEXT NOT NULL DEFAULT '[]'
-            )
+            INSERT INTO chunks_v9 (note_id, chunk_index, text, embedding)
+            SELECT note_id, chunk_index, text, embedding FROM chunks ORDER BY rowid
             """
         )
+        conn.execute("DROP TABLE IF EXISTS chunks_fts")
+        conn.execute("DROP TABLE chunks")
+        conn.execute("ALTER TABLE chunks_v9 RENAME TO chunks")
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def _parse_json_array(raw: str) -> list:
@@ -62,21 +393,99 @@ def _parse_json_array(raw: str) -> list:
     return parsed if isinstance(parsed, list) else []
 
 
-def _row_to_note_response(row: sqlite3.Row) -> NoteResponse:
-    return NoteResponse(
-        id=row["id"],
-        title=row["title"],
-        content=row["content"],
-        tags=_parse_json_array(row["tags"]),
-        embedding=_parse_json_array(row["embedding"]),
-    )
+def _pack_embedding(values) -> bytes:
+    try:
+        return np.asarray(values, dtype="<f4").reshape(-1).tobytes()
+    except (TypeError, ValueError):
+        return b""
 
 
-def _load_all_note_records() -> list[dict]:
-    with _get_conn() as conn:
+def _unpack_embedding(raw: bytes | None) -> np.ndarray:
+    # Zero-copy, read-only view over the BLOB.
+    return np.frombuffer(raw or b"", dtype="<f4")
+
+
+NOTE_FIELDS = ("id", "title", "content", "tags", "embedding")
+DEFAULT_NOTE_FIELDS = ("id", "title", "content", "tags")
+
+
+def _parse_fields(fields: str | None) -> tuple[str, ...]:
+    if not fields:
+        return DEFAULT_NOTE_FIELDS
+    requested = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in NOTE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested or DEFAULT_NOTE_FIELDS
+
+
+def _row_to_note_dict(row: sqlite3.Row, fields: tuple[str, ...]) -> dict:
+    note = {}
+    for field in fields:
+        if field == "tags":
+            note["tags"] = _parse_json_array(row["tags"])
+        elif field == "embedding":
+            note["embedding"] = _unpack_embedding(row["embedding"]).tolist()
+        else:
+            note[field] = row[field]
+    return note
+
+
+def _notes_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM generations WHERE name = 'notes'").fetchone()
+    return row["value"] if row is not None else 0
+
+
+def _etag(version: int, *parts) -> str:
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:12]
+    return f'W/"{version}-{digest}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return etag in {tag.strip() for tag in header.split(",")} or header.strip() == "*"
+
+
+def _load_note_records(conn: sqlite3.Connection, note_ids: list[str] | None = None) -> list[dict]:
+    # Every note, or the existing ones among `note_ids`, newest first.
+    if note_ids is None:
         rows = conn.execute(
-            "SELECT id, title, content, tags, embedding, chunks FROM notes ORDER BY rowid DESC"
+            "SELECT rowid, id, title, content, tags, embedding FROM notes ORDER BY rowid DESC"
+        ).fetchall()
+        chunk_rows = conn.execute(
+            "SELECT note_id, chunk_index, text, embedding FROM chunks ORDER BY note_id, chunk_index"
         ).fetchall()
+    else:
+        rows, chunk_rows = [], []
+        # Chunked to stay under SQLite's bound-parameter limit.
+        for start in range(0, len(note_ids), 500):
+            batch = note_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(
+                conn.execute(
+                    f"SELECT rowid, id, title, content, tags, embedding FROM notes "
+                    f"WHERE id IN ({placeholders})",
+                    batch,
+                )
+            )
+            chunk_rows.extend(
+                conn.execute(
+                    f"SELECT note_id, chunk_index, text, embedding FROM chunks "
+                    f"WHERE note_id IN ({placeholders}) ORDER BY note_id, chunk_index",
+                    batch,
+                )
+            )
+        rows.sort(key=lambda row: row["rowid"], reverse=True)
+
+    chunks_by_note: dict[str, list[dict]] = {}
+    for row in chunk_rows:
+        chunks_by_note.setdefault(row["note_id"], []).append(
+            {
+                "index": row["chunk_index"],
+                "text": row["text"],
+                "embedding": _unpack_embedding(row["embedding"]),
+            }
+        )
 
     notes: list[dict] = []
     for row in rows:
@@ -86,45 +495,178 @@ def _load_all_note_records() -> list[dict]:
                 "title": row["title"],
                 "content": row["content"],
                 "tags": _parse_json_array(row["tags"]),
-                "embedding": _parse_json_array(row["embedding"]),
-                "chunks": _parse_json_array(row["chunks"]),
+                "embedding": _unpack_embedding(row["embedding"]),
+                "chunks": chunks_by_note.get(row["id"], []),
             }
         )
     return notes
 
 
-@app.get("/api/notes", response_model=list[NoteResponse])
-def list_notes() -> list[NoteResponse]:
+def _write_note_record(conn: sqlite3.Connection, record: dict, revision: int | None = None) -> int:
+    # With `revision`, the write only lands if the note has not been saved
+    # again since that revision was read; otherwise it starts a new revision.
+    values = (
+        record["title"],
+        record["content"],
+        json.dumps(record["tags"]),
+        _pack_embedding(record["embedding"]),
+        record["id"],
+    )
+    if revision is None:
+        cursor = conn.execute(
+            """
+            UPDATE notes
+            SET title = ?, content = ?, tags = ?, embedding = ?, revision = revision + 1
+            WHERE id = ?
+            """,
+            values,
+        )
+    else:
+        cursor = conn.execute(
+            """
+            UPDATE notes
+            SET title = ?, content = ?, tags = ?, embedding = ?
+            WHERE id = ? AND revision = ?
+            """,
+            (*values, revision),
+        )
+    if cursor.rowcount == 0:
+        return 0
+    conn.execute("DELETE FROM chunks WHERE note_id = ?", (record["id"],))
+    conn.executemany(
+        "INSERT INTO chunks (note_id, chunk_index, text, embedding) VALUES (?, ?, ?, ?)",
+        [
+            (record["id"], chunk["index"], chunk["text"], _pack_embedding(chunk["embedding"]))
+            for chunk in record["chunks"]
+        ],
+    )
+    return cursor.rowcount
+
+
+_index_sync = _create_index_sync(_chunk_index)
+
+
+def _get_chunk_index() -> ChunkIndex:
+    if not _chunk_index.loaded:
+        _index_sync.load()
+    else:
+        _index_sync.sync()
+    return _chunk_index
+
+
+@app.get("/api/notes", response_model=list[NoteProjection], response_model_exclude_unset=True)
+def list_notes(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: int | None = Query(None, ge=0, description="X-Next-Cursor of the previous page"),
+    fields: str | None = Query(None, description="Comma-separated subset of " + ",".join(NOTE_FIELDS)),
+) -> Response:
+    # Newest first, keyset-paginated on rowid. Without `limit` every note is
+    # returned. Embeddings are only read and sent when `fields` asks for them.
+    selected = _parse_fields(fields)
+    columns = ", ".join(("rowid",) + selected)
+    sql = f"SELECT {columns} FROM notes"
+    params: list = []
+    if cursor is not None:
+        sql += " WHERE rowid < ?"
+        params.append(cursor)
+    sql += " ORDER BY rowid DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    with metrics.stage("db_read"), _get_conn() as conn:
+        # One read transaction, so the version matches the rows returned.
+        conn.execute("BEGIN")
+        version = _notes_version(conn)
+        etag = _etag(version, selected, limit, cursor)
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        rows = conn.execute(sql, params).fetchall()
+
+    headers = {"ETag": etag}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1]["rowid"])
+        query = urlencode({"limit": limit, "cursor": next_cursor, **({"fields": fields} if fields else {})})
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.path}?{query}>; rel="next"'
+    with metrics.stage("serialize"):
+        return JSONResponse([_row_to_note_dict(row, selected) for row in rows], headers=headers)
+
+
+@app.get("/api/notes/{note_id}", response_model=NoteProjection, response_model_exclude_unset=True)
+def get_note(
+    note_id: str,
+    request: Request,
+    fields: str | None = Query(None, description="Comma-separated subset of " + ",".join(NOTE_FIELDS)),
+) -> Response:
+    selected = _parse_fields(fields)
+    with _get_conn() as conn:
+        conn.execute("BEGIN")
+        version = _notes_version(conn)
+        etag = _etag(version, note_id, selected)
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        row = conn.execute(
+            f"SELECT {', '.join(selected)} FROM notes WHERE id = ?", (note_id,)
+        ).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return JSONResponse(_row_to_note_dict(row, selected), headers={"ETag": etag})
+
+
+# Shared pool for the outbound tagging/embedding calls of note saves, so the
+# three calls of one save run concurrently.
+_enrichment_calls = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ENRICHMENT_CONCURRENCY", "8")),
+    thread_name_prefix="enrichment-call",
+)
+
+
+def _stored_chunk_embeddings(note_id: str) -> dict[str, list[float]]:
     with _get_conn() as conn:
         rows = conn.execute(
-            "SELECT id, title, content, tags, embedding FROM notes ORDER BY rowid DESC"
+            "SELECT text, embedding FROM chunks WHERE note_id = ?", (note_id,)
         ).fetchall()
-    return [_row_to_note_response(row) for row in rows]
+    stored = {}
+    for row in rows:
+        embedding = _unpack_embedding(row["embedding"])
+        if embedding.size:
+            stored[row["text"]] = embedding.tolist()
+    return stored
 
 
-def _build_note_record(note_id: str, title: str, content: str) -> dict:
-    tags: list[str] = []
-    try:
-        tagging = tag_note_with_llm(title=title, body=content)
-        tags = [t.name for t in tagging.tags]
-    except Exception:
-        tags = []
+def _enrichment_error(kind: str, exc: BaseException) -> str:
+    metrics.ENRICHMENT_ERRORS.inc(kind, type(exc).__name__)
+    return f"{kind}: {type(exc).__name__}: {exc}"
 
-    note_embedding: list[float] = []
-    try:
-        note_embedding = embed_note(title=title, content=content)
-    except Exception:
-        note_embedding = []
 
-    chunk_texts = chunk_text(f"{title}\n\n{content}")
-    chunk_embeddings: list[list[float]] = [[] for _ in chunk_texts]
-    try:
-        generated = embed_chunks(chunk_texts)
-        for i in range(min(len(chunk_embeddings), len(generated))):
-            chunk_embeddings[i] = generated[i]
-    except Exception:
-        pass
+def _needs_enrichment(record: dict) -> bool:
+    # A failed provider call, or an empty note or chunk embedding.
+    return bool(
+        record.get("enrichment_errors")
+        or not len(record["embedding"])
+        or any(not len(chunk["embedding"]) for chunk in record["chunks"])
+    )
+
 
+def _stale_texts(chunk_texts: list[str], stored: dict, dim: int) -> list[str]:
+    return [t for t in dict.fromkeys(chunk_texts) if t in stored and len(stored[t]) != dim]
+
+
+def _assemble_note_record(
+    note_id: str,
+    title: str,
+    content: str,
+    chunk_texts: list[str],
+    stored: dict[str, list[float]],
+    fresh: dict[str, list[float]],
+    note_embedding: list[float],
+    tags: list[str],
+    errors: list[str],
+) -> dict:
+    chunk_embeddings = [fresh.get(t, stored.get(t, [])) for t in chunk_texts]
     return {
         "id": note_id,
         "title": title,
@@ -135,30 +677,190 @@ def _build_note_record(note_id: str, title: str, content: str) -> dict:
             {"index": i, "text": chunk_texts[i], "embedding": chunk_embeddings[i]}
             for i in range(len(chunk_texts))
         ],
+        "chunk_stats": {
+            "chunks_reused": sum(1 for t in chunk_texts if t in stored and t not in fresh),
+            "chunks_embedded": sum(1 for t in chunk_texts if t in fresh),
+        },
+        "enrichment_errors": errors,
     }
 
+
+def _embed_new_chunks(
+    chunk_texts: list[str], stored: dict[str, list[float]], new_texts: list[str], dim: int
+) -> dict[str, list[float]]:
+    fresh = dict(zip(new_texts, embed_chunks(new_texts)))
+    dim = dim or next((len(e) for e in fresh.values()), 0)
+    stale = _stale_texts(chunk_texts, stored, dim) if dim else []
+    if stale:
+        fresh.update(zip(stale, embed_chunks(stale)))
+    return fresh
+
+
+def _build_note_record(note_id: str, title: str, content: str, tags: list[str] | None = None) -> dict:
+    # Chunks whose text is unchanged since the last save keep their stored
+    # embedding; only the new chunks are embedded. The whole-note embedding
+    # is a separate call with its own error ("note_embedding"), so a note
+    # the provider rejects still gets its chunk vectors. Stored vectors
+    # whose dimension no longer matches (the model changed) are embedded
+    # again. Given `tags`, the note is not tagged again.
+    with metrics.stage("chunking"):
+        chunk_texts = chunk_text(f"{title}\n\n{content}")
+    tagging = None
+    if tags is None:
+        tagging = _enrichment_calls.submit(tag_note_with_llm, title=title, body=content)
+    note_embedding_call = _enrichment_calls.submit(embed_note, title, content)
+    with metrics.stage("db_read"):
+        stored = _stored_chunk_embeddings(note_id)
+    new_texts = list(dict.fromkeys(t for t in chunk_texts if t not in stored))
+
+    errors: list[str] = []
+    note_embedding: list[float] = []
+    fresh: dict[str, list[float]] = {}
+    try:
+        note_embedding = note_embedding_call.result()
+    except Exception as exc:
+        errors.append(_enrichment_error("note_embedding", exc))
+    try:
+        with metrics.stage("chunk_embedding"):
+            fresh = _embed_new_chunks(chunk_texts, stored, new_texts, len(note_embedding))
+    except Exception as exc:
+        errors.append(_enrichment_error("embedding", exc))
+
+    if tagging is not None:
+        tags = []
+        try:
+            tags = [t.name for t in tagging.result().tags]
+        except Exception as exc:
+            errors.append(_enrichment_error("tagging", exc))
+
+    return _assemble_note_record(
+        note_id, title, content, chunk_texts, stored, fresh, note_embedding, tags, errors
+    )
+
+
+async def _abuild_note_record(note_id: str, title: str, content: str) -> dict:
+    # _build_note_record on the async path: tagging, the note embedding and
+    # the new chunk embeddings are requested concurrently.
+    with metrics.stage("chunking"):
+        chunk_texts = chunk_text(f"{title}\n\n{content}")
+    with metrics.stage("db_read"):
+        stored = await run_blocking(_stored_chunk_embeddings, note_id)
+    new_texts = list(dict.fromkeys(t for t in chunk_texts if t not in stored))
+
+    with metrics.stage("enrichment_calls"):
+        tagging, note_embedding, generated = await asyncio.gather(
+            atag_note_with_llm(title=title, body=content),
+            aembed_note(title, content),
+            aembed_chunks(new_texts),
+            return_exceptions=True,
+        )
+    errors: list[str] = []
+    tags: list[str] = []
+    if isinstance(tagging, BaseException):
+        errors.append(_enrichment_error("tagging", tagging))
+    else:
+        tags = [t.name for t in tagging.tags]
+    if isinstance(note_embedding, BaseException):
+        errors.append(_enrichment_error("note_embedding", note_embedding))
+        note_embedding = []
+    fresh: dict[str, list[float]] = {}
+    if isinstance(generated, BaseException):
+        errors.append(_enrichment_error("embedding", generated))
+    else:
+        fresh = dict(zip(new_texts, generated))
+        dim = len(note_embedding) or next((len(e) for e in fresh.values()), 0)
+        stale = _stale_texts(chunk_texts, stored, dim) if dim else []
+        if stale:
+            try:
+                fresh.update(zip(stale, await aembed_chunks(stale)))
+            except Exception as exc:
+                errors.append(_enrichment_error("embedding", exc))
+
+    return _assemble_note_record(
+        note_id, title, content, chunk_texts, stored, fresh, note_embedding, tags, errors
+    )
+
+
+def _enrich_note(note_id: str, revision: int) -> dict | None:
+    with _get_conn() as conn:
+        row = conn.execute(
+            "SELECT title, content, revision, tags, embedding FROM notes WHERE id = ?", (note_id,)
+        ).fetchone()
+        tagged = row is not None and EnrichmentQueue.is_tagged(conn, note_id, revision)
+    if row is None or row["revision"] != revision:
+        # Deleted, or saved again: the newer revision has its own job.
+        return None
+    previous_tags = _parse_json_array(row["tags"])
+    note_record = _build_note_record(
+        note_id, row["title"], row["content"], tags=previous_tags if tagged else None
+    )
+    errors = note_record["enrichment_errors"]
+    failed = {error.partition(":")[0] for error in errors}
+    if "tagging" in failed:
+        note_record["tags"] = previous_tags
+    if "note_embedding" in failed:
+        note_record["embedding"] = _unpack_embedding(row["embedding"]).tolist()
+    # What succeeded is written; the previous tags, note embedding, or
+    # stored chunks stay in place of what failed.
+    with metrics.stage("db_write"), _write_lock, _get_conn() as conn:
+        if "embedding" not in failed:
+            updated = _write_note_record(conn, note_record, revision=revision)
+        elif "tagging" not in failed and not tagged:
+            updated = conn.execute(
+                "UPDATE notes SET tags = ? WHERE id = ? AND revision = ?",
+                (json.dumps(note_record["tags"]), note_id, revision),
+            ).rowcount
+            EnrichmentQueue.mark_tagged(conn, note_id, revision)
+        else:
+            updated = 1
+        generation = _index_sync.written(conn, [note_id])
+        conn.commit()
+        if updated and "embedding" not in failed and _chunk_index.loaded:
+            _chunk_index.upsert_note(note_record)
+            _index_sync.advance(generation)
+    if errors and updated:
+        # The queue retries the job with backoff and records the error.
+        raise RuntimeError("; ".join(errors))
+    return note_record["chunk_stats"] if updated else None
+
+
+# Background tagging/embedding of saved notes. ENRICHMENT_MODE=sync restores
+# the old behaviour of enriching inside the PUT request.
+_enrichment_queue = EnrichmentQueue(
+    _get_conn,
+    _enrich_note,
+    workers=int(os.getenv("ENRICHMENT_WORKERS", "2")),
+    repair_interval=float(os.getenv("ENRICHMENT_REPAIR_INTERVAL", "600")),
+    lease=float(os.getenv("ENRICHMENT_LEASE", "300")),
+    max_repairs=int(os.getenv("ENRICHMENT_MAX_REPAIRS", "3")),
+)
+
+
 @app.post("/api/notes", response_model=NoteResponse)
 def create_note(payload: NoteCreate) -> NoteResponse:
     note_id = str(uuid4())
     tags: list[str] = []
     embedding: list[float] = []
     chunks: list[dict] = []
-    with _get_conn() as conn:
+    with _write_lock, _get_conn() as conn:
         conn.execute(
             """
-            INSERT INTO notes (id, title, content, tags, embedding, chunks)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO notes (id, title, content, tags, embedding)
+            VALUES (?, ?, ?, ?, ?)
             """,
             (
                 note_id,
                 payload.title,
                 payload.content,
                 json.dumps(tags),
-                json.dumps(embedding),
-                json.dumps(chunks),
+                _pack_embedding(embedding),
             ),
         )
+        generation = _index_sync.written(conn, [note_id])
         conn.commit()
+        if _chunk_index.loaded:
+            _chunk_index.upsert_note({"id": note_id, "title": payload.title, "chunks": chunks})
+            _index_sync.advance(generation)
     return NoteResponse(
         id=note_id,
         title=payload.title,
@@ -167,41 +869,152 @@ def create_note(payload: NoteCreate) -> NoteResponse:
         embedding=embedding,
     )
 
+def insert_note_records(records: list[dict]) -> None:
+    # One transaction per batch; used by the bulk import endpoint and CLI.
+    # Records whose tagging or embeddings failed are queued for enrichment.
+    with _write_lock, _get_conn() as conn:
+        conn.executemany(
+            """
+            INSERT INTO notes (id, title, content, tags, embedding, revision)
+            VALUES (?, ?, ?, ?, ?, 1)
+            """,
+            [
+                (
+                    r["id"],
+                    r["title"],
+                    r["content"],
+                    json.dumps(r["tags"]),
+                    _pack_embedding(r["embedding"]),
+                )
+                for r in records
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO chunks (note_id, chunk_index, text, embedding) VALUES (?, ?, ?, ?)",
+            [
+                (r["id"], chunk["index"], chunk["text"], _pack_embedding(chunk["embedding"]))
+                for r in records
+                for chunk in r["chunks"]
+            ],
+        )
+        incomplete = [r["id"] for r in records if _needs_enrichment(r)]
+        for note_id in incomplete:
+            EnrichmentQueue.enqueue(conn, note_id, 1)
+        generation = _index_sync.written(conn, [r["id"] for r in records])
+        conn.commit()
+        if _chunk_index.loaded:
+            _chunk_index.upsert_notes(records)
+            _index_sync.advance(generation)
+    if incomplete:
+        _enrichment_queue.notify()
+
+
+@app.post("/api/notes/bulk", response_model=BulkImportResult)
+async def bulk_import_notes(request: Request) -> BulkImportResult:
+    # Streams an NDJSON body ({"title": ..., "content": ...} per line);
+    # notes are enriched and committed batch by batch as lines arrive.
+    importer = BulkImporter(
+        insert_note_records,
+        batch_size=int(os.getenv("BULK_IMPORT_BATCH_SIZE", "256")),
+        tag_concurrency=int(os.getenv("BULK_IMPORT_TAG_CONCURRENCY", "8")),
+    )
+    pending = b""
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        if lines:
+            await run_in_threadpool(
+                importer.feed, [line.decode("utf-8", errors="replace") for line in lines]
+            )
+    if pending:
+        await run_in_threadpool(importer.feed, [pending.decode("utf-8", errors="replace")])
+    return BulkImportResult(**await run_in_threadpool(importer.finish))
+
+
 @app.delete("/api/notes/{note_id}")
 def delete_note(note_id: str):
-    with _get_conn() as conn:
+    with _write_lock, _get_conn() as conn:
         cur = conn.execute(
             "DELETE FROM notes WHERE id = ?",
             (note_id,),
         )
+        generation = _index_sync.written(conn, [note_id])
         conn.commit()
 
         if cur.rowcount == 0:
             raise HTTPException(status_code=404, detail="Note not found")
+        if _chunk_index.loaded:
+            _chunk_index.remove_note(note_id)
+            _index_sync.advance(generation)
 
     return {"success": True, "id": note_id}
 
-@app.put("/api/notes/{note_id}", response_model=NoteResponse)
-def update_note(note_id: str, payload: NoteUpdate) -> NoteResponse:
-    note_record = _build_note_record(note_id, payload.title, payload.content)
-    with _get_conn() as conn:
+def _queue_note_update(note_id: str, payload: NoteUpdate) -> sqlite3.Row | None:
+    with metrics.stage("db_write"), _write_lock, _get_conn() as conn:
         cursor = conn.execute(
-            """
-            UPDATE notes
-            SET title = ?, content = ?, tags = ?, embedding = ?, chunks = ?
-            WHERE id = ?
-            """,
-            (
-                note_record["title"],
-                note_record["content"],
-                json.dumps(note_record["tags"]),
-                json.dumps(note_record["embedding"]),
-                json.dumps(note_record["chunks"]),
-                note_id,
-            ),
+            "UPDATE notes SET title = ?, content = ?, revision = revision + 1 WHERE id = ?",
+            (payload.title, payload.content, note_id),
         )
+        if cursor.rowcount == 0:
+            return None
+        row = conn.execute(
+            "SELECT revision, tags, embedding FROM notes WHERE id = ?", (note_id,)
+        ).fetchone()
+        EnrichmentQueue.enqueue(conn, note_id, row["revision"])
         conn.commit()
-    if cursor.rowcount == 0:
+    _enrichment_queue.notify()
+    return row
+
+
+@app.put("/api/notes/{note_id}", response_model=NoteResponse)
+async def update_note(note_id: str, payload: NoteUpdate) -> NoteResponse:
+    if os.getenv("ENRICHMENT_MODE", "background") == "sync":
+        return await _update_note_sync(note_id, payload)
+
+    row = await run_blocking(_queue_note_update, note_id, payload)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    # Tags and embedding are those of the previous revision until the job
+    # finishes; GET /api/notes/{id}/enrichment reports its progress.
+    return NoteResponse(
+        id=note_id,
+        title=payload.title,
+        content=payload.content,
+        tags=_parse_json_array(row["tags"]),
+        embedding=_unpack_embedding(row["embedding"]).tolist(),
+    )
+
+
+def _save_note_record(note_record: dict) -> int:
+    # What failed in the request is retried by the enrichment queue;
+    # otherwise the save's chunk stats are recorded as a finished job.
+    retry = _needs_enrichment(note_record)
+    with metrics.stage("db_write"), _write_lock, _get_conn() as conn:
+        updated = _write_note_record(conn, note_record)
+        if updated:
+            row = conn.execute(
+                "SELECT revision FROM notes WHERE id = ?", (note_record["id"],)
+            ).fetchone()
+            if retry:
+                EnrichmentQueue.enqueue(conn, note_record["id"], row["revision"])
+            else:
+                EnrichmentQueue.record_done(
+                    conn, note_record["id"], row["revision"], note_record["chunk_stats"]
+                )
+        generation = _index_sync.written(conn, [note_record["id"]])
+        conn.commit()
+        if updated and _chunk_index.loaded:
+            _chunk_index.upsert_note(note_record)
+            _index_sync.advance(generation)
+    if updated and retry:
+        _enrichment_queue.notify()
+    return updated
+
+
+async def _update_note_sync(note_id: str, payload: NoteUpdate) -> NoteResponse:
+    note_record = await _abuild_note_record(note_id, payload.title, payload.content)
+    updated = await run_blocking(_save_note_record, note_record)
+    if updated == 0:
         raise HTTPException(status_code=404, detail="Note not found")
     return NoteResponse(
         id=note_id,
@@ -212,11 +1025,111 @@ def update_note(note_id: str, payload: NoteUpdate) -> NoteResponse:
     )
 
 
+@app.get("/api/notes/{note_id}/enrichment", response_model=EnrichmentStatus)
+def get_enrichment_status(note_id: str) -> EnrichmentStatus:
+    job = _enrichment_queue.status(note_id)
+    if job is not None:
+        return EnrichmentStatus(**job)
+    with _get_conn() as conn:
+        row = conn.execute("SELECT revision FROM notes WHERE id = ?", (note_id,)).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return EnrichmentStatus(note_id=note_id, status="idle", revision=row["revision"])
+
+
+@app.post("/api/enrichment/repair")
+def repair_enrichment() -> dict:
+    # Runs the periodic backfill scan now.
+    return {"enqueued": _enrichment_queue.repair(), "jobs": _enrichment_queue.counts()}
+
+
+# Answers reused for near-duplicate questions over identical retrieved
+# chunks; ASK_ANSWER_CACHE_SIZE=0 disables it.
+_answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv("ASK_ANSWER_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("ASK_ANSWER_CACHE_TTL", "3600")),
+    threshold=float(os.getenv("ASK_ANSWER_CACHE_THRESHOLD", "0.95")),
+)
+
+
+@app.get("/api/stats/embedding-cache")
+def get_embedding_cache_stats() -> dict:
+    return embedding_cache_stats()
+
+
+@app.get("/api/stats/ask-cache")
+def get_ask_cache_stats() -> dict:
+    return {"query_embeddings": query_embedding_cache_stats(), "answers": _answer_cache.stats()}
+
+
+def _retrieve_chunks(payload: AskRequest, query_emb: list[float]) -> list[dict]:
+    index = _get_chunk_index()
+    if payload.retrieval_mode == "dense":
+        with metrics.stage("retrieve"):
+            return rank_chunks(query_emb, index, top_k=payload.top_k)
+    with metrics.stage("bm25"), _get_conn() as conn:
+        lexical_keys = lexical.search_bm25(
+            conn, payload.question, limit=int(os.getenv("LEXICAL_CANDIDATES", "100"))
+        )
+    with metrics.stage("retrieve"):
+        if payload.retrieval_mode == "prefilter":
+            return rank_chunks_prefiltered(query_emb, index, lexical_keys, top_k=payload.top_k)
+        return rank_chunks_hybrid(query_emb, index, lexical_keys, top_k=payload.top_k)
+
+
+@app.get("/api/stats/context")
+def get_context_stats() -> dict:
+    return context_stats()
+
+
 @app.post("/api/ask", response_model=AskResponse)
-def ask_question(payload: AskRequest) -> AskResponse:
-    notes = _load_all_note_records()
-    chunks = retrieve_top_chunks(payload.question, notes, top_k=payload.top_k)
-    return answer_question(payload.question, chunks)
+async def ask_question(payload: AskRequest, response: Response) -> AskResponse:
+    query_emb = await aembed_query(payload.question)
+    chunks = await run_blocking(_retrieve_chunks, payload, query_emb)
+    cached = _answer_cache.get(query_emb, chunks)
+    if cached is not None:
+        return cached
+    context, usage = build_context(chunks)
+    response.headers["X-Context-Tokens"] = str(usage["tokens_after"])
+    response.headers["X-Context-Tokens-Saved"] = str(usage["tokens_saved"])
+    answer = await aanswer_question(payload.question, chunks, context=context)
+    _answer_cache.put(query_emb, chunks, answer)
+    return answer
+
+
+@app.post("/api/ask/stream")
+async def ask_question_stream(payload: AskRequest) -> StreamingResponse:
+    # NDJSON events: the retrieved chunks first, then answer text deltas as
+    # the model streams them, then the validated AskResponse ("answer").
+    query_emb = await aembed_query(payload.question)
+    chunks = await run_blocking(_retrieve_chunks, payload, query_emb)
+    cached = _answer_cache.get(query_emb, chunks)
+
+    async def events():
+        yield json.dumps({"type": "citations", "chunks": chunks}) + "\n"
+        if cached is not None:
+            yield json.dumps({"type": "delta", "text": cached.answer}) + "\n"
+            yield json.dumps({"type": "answer", **cached.model_dump()}) + "\n"
+            return
+        context, usage = build_context(chunks)
+        yield json.dumps({"type": "context", **usage}) + "\n"
+        try:
+            async for event in astream_answer(payload.question, chunks, context=context):
+                if event["type"] == "answer":
+                    _answer_cache.put(
+                        query_emb,
+                        chunks,
+                        AskResponse(answer=event["answer"], citations=event["citations"]),
+                    )
+                yield json.dumps(event) + "\n"
+        except Exception as exc:
+            yield json.dumps({"type": "error", "detail": str(exc)}) + "\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 _init_db()
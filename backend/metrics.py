@@ -0,0 +1,287 @@
+import contextvars
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# In-process metrics in the Prometheus text exposition format, without a
+# client library: counters and histograms keyed by label values, a stage()
+# timer that feeds both the histograms and the per-request Server-Timing
+# header, and a sampling profiler that can be switched on per request.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            counts, total, count = self._series.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._series[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(c), s, n)) for k, (c, s, n) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{plain} {_number(total)}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+_registry: List = []
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+    metric = Counter(name, help_text, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(
+    name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    metric = Histogram(name, help_text, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = counter(
+    "notes_http_requests_total", "HTTP requests by route, method and status.", ("method", "route", "status")
+)
+HTTP_LATENCY = histogram(
+    "notes_http_request_duration_seconds",
+    "HTTP request latency until the response headers are sent.",
+    ("method", "route"),
+)
+STAGE_LATENCY = histogram(
+    "notes_stage_duration_seconds", "Time spent in each instrumented stage.", ("stage",)
+)
+STAGE_ERRORS = counter("notes_stage_errors_total", "Exceptions raised inside a stage.", ("stage", "error"))
+ENRICHMENT_ERRORS = counter(
+    "notes_enrichment_errors_total",
+    "Tagging and embedding failures while enriching notes, by kind and error.",
+    ("kind", "error"),
+)
+TOKENS = counter(
+    "notes_openai_tokens_total", "Tokens reported by the OpenAI API.", ("operation", "model", "kind")
+)
+EMBEDDING_INPUTS = counter(
+    "notes_embedding_inputs_total", "Texts to embed, by where the vector came from.", ("source",)
+)
+OPENAI_RETRIES = counter(
+    "notes_openai_retries_total", "OpenAI calls retried, by channel and status or error.", ("channel", "reason")
+)
+OPENAI_THROTTLE_SECONDS = counter(
+    "notes_openai_throttle_seconds_total",
+    "Time callers were held back by the client-side rate limits.",
+    ("channel",),
+)
+COALESCED_CALLERS = histogram(
+    "notes_embedding_coalesced_callers",
+    "Embedding lookups merged into one provider batch.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+INDEX_REFRESHES = counter(
+    "notes_index_refreshes_total",
+    "Chunk index updates: notes reloaded and full reloads for changes made by other processes, "
+    "switches to a newer shared vector snapshot, in-memory base rebuilds and ANN retrains.",
+    ("kind",),
+)
+
+
+# Per-request state, shared with the threadpool threads that run sync
+# endpoints (Starlette copies the context into them).
+class RequestTrace:
+    def __init__(self, profiler: Optional["SamplingProfiler"] = None) -> None:
+        self.timings: List[Tuple[str, float]] = []
+        self.profiler = profiler
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.timings.append((stage, seconds))
+
+    def server_timing(self) -> str:
+        # Repeated stages (e.g. several embeddings requests) are summed.
+        with self._lock:
+            totals: Dict[str, float] = {}
+            for stage, seconds in self.timings:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "notes_request_trace", default=None
+)
+
+
+def start_trace(trace: RequestTrace) -> contextvars.Token:
+    return _current_trace.set(trace)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current_trace.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    trace = _current_trace.get()
+    if trace is not None and trace.profiler is not None:
+        trace.profiler.watch(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        STAGE_ERRORS.inc(name, type(exc).__name__)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_LATENCY.observe(seconds, name)
+        if trace is not None:
+            trace.add(name, seconds)
+
+
+def record_usage(operation: str, model: str, usage) -> None:
+    # Accepts the usage object of both the Responses API (input/output
+    # tokens) and the Embeddings API (prompt/total tokens).
+    if usage is None:
+        return
+    for kind in ("input_tokens", "output_tokens", "prompt_tokens"):
+        count = getattr(usage, kind, None)
+        if isinstance(count, int) and count:
+            TOKENS.inc(operation, model, kind.replace("_tokens", ""), amount=count)
+
+
+# Samples the Python stacks of the threads serving one request every
+# `interval` seconds and counts them in collapsed-stack form ("a;b;c N"),
+# the input format of flamegraph.pl and speedscope. Threads are registered
+# by stage(), so only the request's own work is sampled.
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples: _Tally = _Tally()
+        self._threads: set = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, thread_id: int) -> None:
+        self._threads.add(thread_id)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self._threads):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def write(self, directory: Path, name: str) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{name}.folded"
+        path.write_text(self.collapsed())
+        return path
+
+
+def server_timing_enabled() -> bool:
+    return os.getenv("SERVER_TIMING", "0") == "1"
+
+
+def profiling_enabled() -> bool:
+    # Requests opt in with an `X-Profile: 1` header once PROFILE_REQUESTS=1.
+    return os.getenv("PROFILE_REQUESTS", "0") == "1"
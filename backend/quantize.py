@@ -0,0 +1,236 @@
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .retrieval import top_k_indices
+
+# Rows scored per matrix product. Keeps the float32 copy an int8 scan makes
+# small enough to stay in cache.
+_SCAN_ROWS = 4096
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(codes: np.ndarray) -> np.ndarray:
+        return _POPCOUNT[codes]
+
+
+def fit_pca(vectors: np.ndarray, dim: int) -> np.ndarray:
+    # Top `dim` right singular vectors of the (uncentered) sample, so dot
+    # products between projected unit vectors approximate cosine similarity.
+    _, _, vt = np.linalg.svd(vectors.astype(np.float32), full_matrices=False)
+    return np.ascontiguousarray(vt[:dim], dtype=np.float32)
+
+
+def int8_scale(vectors: np.ndarray) -> np.ndarray:
+    # Per-dimension scale mapping the largest magnitude seen to 127.
+    scale = np.abs(vectors).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    return scale.astype(np.float32)
+
+
+def encode_int8(vectors: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+
+
+def encode_binary(vectors: np.ndarray) -> np.ndarray:
+    # One sign bit per dimension, packed 8 per byte.
+    return np.packbits(vectors > 0, axis=1)
+
+
+def int8_scores(codes: np.ndarray, query: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    weighted = (query * scale).astype(np.float32)
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _SCAN_ROWS):
+        block = codes[start:start + _SCAN_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ weighted
+    return scores
+
+
+def hamming_scores(codes: np.ndarray, query_code: np.ndarray) -> np.ndarray:
+    # Negated Hamming distance, so larger is closer as for the other scans.
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _SCAN_ROWS):
+        block = codes[start:start + _SCAN_ROWS]
+        distance = _popcount(np.bitwise_xor(block, query_code)).sum(axis=1, dtype=np.int32)
+        scores[start:start + len(block)] = -distance
+    return scores
+
+
+# Compressed first-pass index over L2-normalized vectors: int8 scalar codes
+# (1 byte per dimension) or 1-bit sign codes (1 bit per dimension), after an
+# optional PCA projection to `pca_dim` dimensions. Only the codes are kept;
+# search returns a shortlist of `top_k * rescore_factor` candidates ranked
+# by code similarity, which the caller rescores with the full-precision
+# vectors. It is a drop-in `ann_factory` product for ChunkIndex.
+#
+# Codes live in immutable (ids, codes) segments, one per add() call, that
+# are swapped wholesale like IVFFlatIndex's lists; removed ids are masked
+# until the segments are compacted, so searches need no lock.
+class QuantizedIndex:
+    def __init__(
+        self,
+        kind: str = "int8",
+        rescore_factor: int = 4,
+        pca_dim: int = 0,
+        max_segments: int = 32,
+        sample_size: int = 20000,
+        seed: int = 0,
+    ) -> None:
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"unknown quantization {kind!r}")
+        self.kind = kind
+        self.rescore_factor = max(1, rescore_factor)
+        self.pca_dim = pca_dim
+        self.max_segments = max_segments
+        self.sample_size = sample_size
+        self.seed = seed
+        self.components: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self.trained_on = 0
+        self._dim = 0
+        self._segments: Tuple[Tuple[np.ndarray, np.ndarray], ...] = ()
+        self._removed: frozenset = frozenset()
+        self._count = 0
+
+    @property
+    def trained(self) -> bool:
+        return self._dim > 0
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    @property
+    def code_bytes(self) -> int:
+        # Bytes stored per vector, excluding its 8-byte id.
+        width = len(self.components) if self.components is not None else self._dim
+        return width if self.kind == "int8" else (width + 7) // 8
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        if self.components is None:
+            return vectors
+        projected = vectors @ self.components.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        np.divide(projected, norms, out=projected, where=norms > 0)
+        return projected
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        projected = self._project(vectors)
+        if self.kind == "int8":
+            return encode_int8(projected, self.scale)
+        return encode_binary(projected)
+
+    def train(self, vectors: np.ndarray) -> None:
+        if not len(vectors):
+            raise ValueError("cannot train a quantized index without vectors")
+        sample = vectors
+        if len(vectors) > self.sample_size:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), size=self.sample_size, replace=False)]
+        self._dim = int(vectors.shape[1])
+        self.components = None
+        if 0 < self.pca_dim < self._dim:
+            self.components = fit_pca(sample, min(self.pca_dim, len(sample)))
+        self.scale = int8_scale(self._project(sample))
+        self.trained_on = len(vectors)
+        self._segments, self._removed, self._count = (), frozenset(), 0
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        if not len(ids):
+            return
+        segment = (np.asarray(ids, dtype=np.int64), self._encode(vectors))
+        self._segments = self._segments + (segment,)
+        self._count += len(segment[0])
+        if len(self._segments) > self.max_segments:
+            self._compact()
+
+    def remove(self, ids: Sequence[int]) -> None:
+        if not len(ids):
+            return
+        # Only ids that are stored and not yet removed count, so repeated or
+        # unknown ids cannot push _count below the real number of vectors.
+        new = np.fromiter(frozenset(int(i) for i in ids) - self._removed, dtype=np.int64)
+        stored = np.zeros(len(new), dtype=bool)
+        for segment_ids, _ in self._segments:
+            stored |= np.isin(new, segment_ids)
+        if not stored.any():
+            return
+        self._removed = self._removed | frozenset(new[stored].tolist())
+        self._count -= int(stored.sum())
+        if len(self._removed) > max(1024, self._count // 10):
+            self._compact()
+
+    def _compact(self) -> None:
+        ids = np.concatenate([s[0] for s in self._segments])
+        codes = np.concatenate([s[1] for s in self._segments])
+        if self._removed:
+            keep = ~np.isin(ids, np.fromiter(self._removed, dtype=np.int64))
+            ids, codes = ids[keep], codes[keep]
+        self._segments = ((ids, codes),)
+        self._removed = frozenset()
+        self._count = len(ids)
+
+    def search(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        segments, removed = self._segments, self._removed
+        if not self.trained or top_k <= 0 or not segments:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        projected = self._project(np.asarray(query, dtype=np.float32).reshape(-1))
+        parts: List[np.ndarray] = []
+        if self.kind == "int8":
+            for _, codes in segments:
+                parts.append(int8_scores(codes, projected, self.scale))
+        else:
+            query_code = encode_binary(projected[None, :])[0]
+            for _, codes in segments:
+                parts.append(hamming_scores(codes, query_code))
+        ids = np.concatenate([s[0] for s in segments])
+        scores = np.concatenate(parts)
+        if removed:
+            scores[np.isin(ids, np.fromiter(removed, dtype=np.int64))] = -np.inf
+        best = top_k_indices(scores, top_k * self.rescore_factor)
+        best = best[np.isfinite(scores[best])]
+        return ids[best], scores[best]
+
+    def save(self, path: Path) -> None:
+        if not self.trained:
+            return
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        components = self.components if self.components is not None else np.empty((0, self._dim))
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                components=components.astype(np.float32),
+                scale=self.scale,
+                dim=np.int64(self._dim),
+                trained_on=np.int64(self.trained_on),
+            )
+        tmp.replace(path)
+
+    def load_centroids(self, path: Path, dim: int) -> bool:
+        # Restores the trained projection and int8 scale; codes are
+        # re-encoded from the stored chunk vectors.
+        try:
+            with np.load(path) as data:
+                components = data["components"]
+                scale = data["scale"]
+                saved_dim = int(data["dim"])
+                trained_on = int(data["trained_on"])
+        except (OSError, KeyError, ValueError):
+            return False
+        if saved_dim != dim or (len(components) and components.shape[1] != dim):
+            return False
+        if len(components) != (self.pca_dim if 0 < self.pca_dim < dim else 0):
+            return False
+        self._dim = dim
+        self.components = components if len(components) else None
+        self.scale = scale
+        self.trained_on = trained_on
+        return True
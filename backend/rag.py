@@ -1,77 +1,140 @@
 import os
-import math
-from pathlib import Path
-from typing import List, Dict, Any
+import re
+from typing import AsyncIterator, Iterator, List, Dict, Any, Optional, Tuple, Union
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from . import metrics
+from .ask_cache import QueryEmbeddingCache
+from .context import ContextStats, pack_context
+from .lexical import reciprocal_rank_fusion
+from .resources import get_async_openai_client, get_openai_client, openai_slots
+from .retrieval import ChunkIndex, ChunkMatrix
+from .scheduler import OUTPUT_TOKEN_ALLOWANCE, scheduler
 from .schemas import AskResponse, Citation
 
-_env_loaded = False
-
 
 def _get_client() -> OpenAI:
-    global _env_loaded
-    if not _env_loaded:
-        env_path = Path(__file__).resolve().parent / ".env"
-        load_dotenv(env_path)
-        _env_loaded = True
-    return OpenAI()
+    return get_openai_client()
+
+
+def _get_async_client() -> AsyncOpenAI:
+    return get_async_openai_client()
 
 
 def _get_model() -> str:
     return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 
-def _cosine_similarity(a: List[float], b: List[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return -1.0
-    dot = 0.0
-    norm_a = 0.0
-    norm_b = 0.0
-    for i in range(len(a)):
-        dot += a[i] * b[i]
-        norm_a += a[i] * a[i]
-        norm_b += b[i] * b[i]
-    if norm_a == 0.0 or norm_b == 0.0:
-        return -1.0
-    return dot / (math.sqrt(norm_a) * math.sqrt(norm_b))
-
-
-def retrieve_top_chunks(question: str, notes: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
-    from .embed import embed_text
-
-    query_emb = embed_text(question)
-    scored: List[Dict[str, Any]] = []
-    for note in notes:
-        for chunk in note.get("chunks", []):
-            score = _cosine_similarity(query_emb, chunk.get("embedding", []))
-            scored.append(
-                {
-                    "note_id": note["id"],
-                    "note_title": note.get("title", ""),
-                    "text": chunk["text"],
-                    "score": score,
-                }
-            )
-    scored.sort(key=lambda x: x["score"], reverse=True)
+def rank_chunks(
+    query_emb: List[float],
+    notes: Union[List[Dict[str, Any]], ChunkMatrix, ChunkIndex],
+    top_k: int = 5,
+) -> List[Dict[str, Any]]:
+    if isinstance(notes, list):
+        notes = ChunkMatrix.from_notes(notes)
+    return notes.search(query_emb, top_k=top_k)
+
+
+def rank_chunks_hybrid(
+    query_emb: List[float],
+    notes: Union[ChunkMatrix, ChunkIndex],
+    lexical_keys: List[Tuple[str, int]],
+    top_k: int = 5,
+    candidates: int = 50,
+    rrf_k: int = 60,
+) -> List[Dict[str, Any]]:
+    # Reciprocal rank fusion of the dense top `candidates` and the BM25
+    # ranking; "score" is the fused RRF score.
+    dense = notes.search(query_emb, top_k=candidates)
+    dense_keys = [(c["note_id"], c["chunk_index"]) for c in dense]
+    fused = reciprocal_rank_fusion([dense_keys, lexical_keys], k=rrf_k)
+    ordered = sorted(fused, key=lambda key: -fused[key])[:top_k]
+    by_key = dict(zip(dense_keys, dense))
+    lexical_only = [key for key in ordered if key not in by_key]
+    for c in notes.score_keys(query_emb, lexical_only):
+        by_key[(c["note_id"], c["chunk_index"])] = c
+    return [{**by_key[key], "score": fused[key]} for key in ordered if key in by_key]
+
+
+def rank_chunks_prefiltered(
+    query_emb: List[float],
+    notes: Union[ChunkMatrix, ChunkIndex],
+    lexical_keys: List[Tuple[str, int]],
+    top_k: int = 5,
+) -> List[Dict[str, Any]]:
+    # Dense scoring restricted to the lexical candidates, so the work per
+    # query is bounded by the candidate count instead of the corpus size.
+    if not lexical_keys:
+        return rank_chunks(query_emb, notes, top_k=top_k)
+    scored = notes.score_keys(query_emb, lexical_keys)
+    scored.sort(key=lambda c: c["score"], reverse=True)
     return scored[:top_k]
 
 
-def _build_context(chunks: List[Dict[str, Any]]) -> str:
-    parts = []
-    for c in chunks:
-        header = f"[note_id={c['note_id']} note_title={c.get('note_title', '')}]"
-        parts.append(f"{header}\n{c['text']}")
-    return "\n\n".join(parts)
+# Exact-match cache of question embeddings; ASK_QUERY_CACHE_SIZE=0 disables it.
+_query_embeddings = QueryEmbeddingCache(
+    max_entries=int(os.getenv("ASK_QUERY_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("ASK_QUERY_CACHE_TTL", "86400")),
+)
+
+
+def query_embedding_cache_stats() -> Dict[str, float]:
+    return _query_embeddings.stats()
+
+
+def embed_query(question: str) -> List[float]:
+    from .embed import embed_text, embedding_model
+
+    model = embedding_model()
+    embedding = _query_embeddings.get(model, question)
+    if embedding is None:
+        with metrics.stage("embed_query"):
+            embedding = embed_text(question)
+        _query_embeddings.put(model, question, embedding)
+    return embedding
+
 
+async def aembed_query(question: str) -> List[float]:
+    from .embed import aembed_text, embedding_model
 
-def answer_question(question: str, chunks: List[Dict[str, Any]]) -> AskResponse:
-    schema = AskResponse.model_json_schema()
-    context = _build_context(chunks)
+    model = embedding_model()
+    embedding = _query_embeddings.get(model, question)
+    if embedding is None:
+        with metrics.stage("embed_query"):
+            embedding = await aembed_text(question)
+        _query_embeddings.put(model, question, embedding)
+    return embedding
 
-    prompt = f"""
+
+def retrieve_top_chunks(
+    question: str,
+    notes: Union[List[Dict[str, Any]], ChunkMatrix, ChunkIndex],
+    top_k: int = 5,
+) -> List[Dict[str, Any]]:
+    return rank_chunks(embed_query(question), notes, top_k=top_k)
+
+
+_context_stats = ContextStats()
+
+
+def context_stats() -> Dict[str, float]:
+    return _context_stats.stats()
+
+
+def build_context(chunks: List[Dict[str, Any]]) -> Tuple[str, Dict[str, int]]:
+    # Merged, deduplicated chunks packed into ASK_CONTEXT_TOKEN_BUDGET
+    # estimated tokens (0 = no limit), plus the token accounting.
+    with metrics.stage("context"):
+        context, usage = pack_context(
+            chunks, token_budget=int(os.getenv("ASK_CONTEXT_TOKEN_BUDGET", "3000"))
+        )
+    _context_stats.record(usage)
+    return context, usage
+
+
+def _build_prompt(question: str, context: str) -> str:
+    return f"""
 Answer the question using only the provided note chunks.
 If the answer is not in the chunks, say: "Answer could not be found in notes."
 Return JSON with an answer and citations pointing to the chunks used.
@@ -83,20 +146,20 @@ Chunks:
 {context}
 """.strip()
 
-    resp = _get_client().responses.create(
-        model=_get_model(),
-        input=prompt,
-        text={
-            "format": {
-                "type": "json_schema",
-                "name": "note_answer",
-                "schema": schema,
-                "strict": True,
-            }
-        },
-    )
-
-    data = AskResponse.model_validate_json(resp.output_text)
+
+def _answer_format() -> Dict[str, Any]:
+    return {
+        "format": {
+            "type": "json_schema",
+            "name": "note_answer",
+            "schema": AskResponse.model_json_schema(),
+            "strict": True,
+        }
+    }
+
+
+def _clean_answer(output_text: str) -> AskResponse:
+    data = AskResponse.model_validate_json(output_text)
     cleaned_citations = []
     for c in data.citations:
         cleaned_citations.append(
@@ -107,3 +170,166 @@ Chunks:
             )
         )
     return AskResponse(answer=data.answer.strip(), citations=cleaned_citations)
+
+
+def _answer_request(question: str, chunks: List[Dict[str, Any]], context: Optional[str]) -> Dict[str, Any]:
+    if context is None:
+        context, _ = build_context(chunks)
+    return {
+        "model": _get_model(),
+        "input": _build_prompt(question, context),
+        "text": _answer_format(),
+    }
+
+
+def _request_tokens(request: Dict[str, Any]) -> int:
+    from .embed import estimate_tokens
+
+    return estimate_tokens(request["input"]) + OUTPUT_TOKEN_ALLOWANCE
+
+
+def answer_question(
+    question: str, chunks: List[Dict[str, Any]], context: Optional[str] = None
+) -> AskResponse:
+    request = _answer_request(question, chunks, context)
+    with metrics.stage("llm_answer"):
+        resp = scheduler("responses").call(
+            lambda: _get_client().responses.create(**request), tokens=_request_tokens(request)
+        )
+    metrics.record_usage("answer", request["model"], getattr(resp, "usage", None))
+    return _clean_answer(resp.output_text)
+
+
+async def aanswer_question(
+    question: str, chunks: List[Dict[str, Any]], context: Optional[str] = None
+) -> AskResponse:
+    request = _answer_request(question, chunks, context)
+    async with openai_slots():
+        with metrics.stage("llm_answer"):
+            resp = await scheduler("responses").acall(
+                lambda: _get_async_client().responses.create(**request), tokens=_request_tokens(request)
+            )
+    metrics.record_usage("answer", request["model"], getattr(resp, "usage", None))
+    return _clean_answer(resp.output_text)
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class _AnswerFieldDecoder:
+    # The structured output arrives as raw JSON text ({"answer": "...",
+    # "citations": [...]}). This decodes the "answer" string incrementally
+    # so its text can be shown while the rest of the JSON is still coming.
+    _START = re.compile(r'"answer"\s*:\s*"')
+
+    def __init__(self) -> None:
+        self._raw = ""
+        self._pos = -1
+        self.done = False
+
+    def feed(self, delta: str) -> str:
+        self._raw += delta
+        if self.done:
+            return ""
+        if self._pos < 0:
+            match = self._START.search(self._raw)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        out = []
+        raw, pos = self._raw, self._pos
+        while pos < len(raw):
+            ch = raw[pos]
+            if ch == '"':
+                self.done = True
+                break
+            if ch != "\\":
+                out.append(ch)
+                pos += 1
+                continue
+            if pos + 1 >= len(raw):
+                break
+            esc = raw[pos + 1]
+            if esc == "u":
+                if pos + 6 > len(raw):
+                    break
+                code = int(raw[pos + 2:pos + 6], 16)
+                if 0xD800 <= code < 0xDC00:
+                    # Surrogate pair: wait for the low half, emit one char.
+                    if pos + 12 > len(raw):
+                        break
+                    low = int(raw[pos + 8:pos + 12], 16)
+                    code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                    pos += 6
+                out.append(chr(code))
+                pos += 6
+            else:
+                out.append(_JSON_ESCAPES.get(esc, esc))
+                pos += 2
+        self._pos = pos
+        return "".join(out)
+
+
+class _AnswerStream:
+    # Turns Responses API stream events into answer events, shared by the
+    # sync and async streams.
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.decoder = _AnswerFieldDecoder()
+        self.parts: List[str] = []
+
+    def handle(self, event: Any) -> Optional[Dict[str, Any]]:
+        if event.type == "response.output_text.delta":
+            self.parts.append(event.delta)
+            text = self.decoder.feed(event.delta)
+            if text:
+                return {"type": "delta", "text": text}
+        elif event.type == "response.completed":
+            metrics.record_usage("answer", self.model, getattr(event.response, "usage", None))
+        elif event.type in ("response.failed", "error"):
+            metrics.STAGE_ERRORS.inc("llm_answer_stream", event.type)
+            raise RuntimeError(f"answer stream failed: {event.type}")
+        return None
+
+    def answer(self) -> Dict[str, Any]:
+        answer = _clean_answer("".join(self.parts))
+        return {"type": "answer", **answer.model_dump()}
+
+
+def stream_answer(
+    question: str, chunks: List[Dict[str, Any]], context: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    # Yields {"type": "delta", "text": ...} events with the answer text as
+    # the model produces it, then one {"type": "answer", ...} event with the
+    # validated AskResponse.
+    request = _answer_request(question, chunks, context)
+    with metrics.stage("llm_answer_stream_open"):
+        stream = scheduler("responses").call(
+            lambda: _get_client().responses.create(**request, stream=True),
+            tokens=_request_tokens(request),
+        )
+    handler = _AnswerStream(request["model"])
+    for event in stream:
+        out = handler.handle(event)
+        if out is not None:
+            yield out
+    yield handler.answer()
+
+
+async def astream_answer(
+    question: str, chunks: List[Dict[str, Any]], context: Optional[str] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    # Async stream_answer. The OpenAI slot is held until the stream ends.
+    request = _answer_request(question, chunks, context)
+    handler = _AnswerStream(request["model"])
+    async with openai_slots():
+        with metrics.stage("llm_answer_stream_open"):
+            stream = await scheduler("responses").acall(
+                lambda: _get_async_client().responses.create(**request, stream=True),
+                tokens=_request_tokens(request),
+            )
+        async for event in stream:
+            out = handler.handle(event)
+            if out is not None:
+                yield out
+    yield handler.answer()
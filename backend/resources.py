@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import functools
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI, OpenAIError
+
+# Process-wide resources shared by every module: one pool of SQLite
+# connections per database file and one OpenAI client whose HTTP
+# connection pool keeps TLS connections alive between calls. The FastAPI
+# lifespan opens them up front and closes them on shutdown; scripts that
+# never run the lifespan get them lazily on first use.
+#
+# The async request path adds an AsyncOpenAI client, a semaphore bounding
+# concurrent OpenAI calls, and run_blocking(), which runs SQLite and other
+# blocking work on a dedicated executor instead of Starlette's threadpool.
+# Both clients leave retries to the outbound scheduler (scheduler.py).
+
+# Loaded on import so settings in backend/.env apply to module-level config
+# as well as to the OpenAI client.
+load_dotenv(Path(__file__).resolve().parent / ".env")
+
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+)
+
+
+class SQLitePool:
+    def __init__(self, path: Path, size: int = 8) -> None:
+        self.path = path
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        # Same transaction semantics as `with sqlite3.connect(...)`: commit
+        # on success, roll back on error. The connection then goes back to
+        # the pool instead of being left for the garbage collector.
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_lock = threading.Lock()
+_pools: Dict[Path, SQLitePool] = {}
+_openai_client: Optional[OpenAI] = None
+_async_openai_client: Optional[AsyncOpenAI] = None
+_openai_slots: Optional[asyncio.Semaphore] = None
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+
+T = TypeVar("T")
+
+
+def db_pool(path: Path) -> SQLitePool:
+    path = Path(path)
+    pool = _pools.get(path)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = SQLitePool(path, size=int(os.getenv("SQLITE_POOL_SIZE", "8")))
+                _pools[path] = pool
+    return pool
+
+
+def get_openai_client() -> OpenAI:
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_connections,
+                        keepalive_expiry=60.0,
+                    ),
+                    timeout=httpx.Timeout(60.0, connect=10.0),
+                )
+                try:
+                    _openai_client = OpenAI(http_client=http_client, max_retries=0)
+                except OpenAIError:
+                    http_client.close()
+                    raise
+    return _openai_client
+
+
+def _max_concurrency() -> int:
+    return int(os.getenv("OPENAI_MAX_CONCURRENCY", "256"))
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _lock:
+            if _async_openai_client is None:
+                limit = _max_concurrency()
+                http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=limit,
+                        max_keepalive_connections=limit,
+                        keepalive_expiry=60.0,
+                    ),
+                    timeout=httpx.Timeout(60.0, connect=10.0),
+                )
+                _async_openai_client = AsyncOpenAI(http_client=http_client, max_retries=0)
+    return _async_openai_client
+
+
+def openai_slots() -> asyncio.Semaphore:
+    # Bounds in-flight OpenAI calls on the async path (OPENAI_MAX_CONCURRENCY).
+    global _openai_slots
+    if _openai_slots is None:
+        _openai_slots = asyncio.Semaphore(_max_concurrency())
+    return _openai_slots
+
+
+def _get_blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    if _blocking_executor is None:
+        with _lock:
+            if _blocking_executor is None:
+                _blocking_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("BLOCKING_WORKERS", os.getenv("SQLITE_POOL_SIZE", "8"))),
+                    thread_name_prefix="blocking",
+                )
+    return _blocking_executor
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    # Context variables (e.g. the request's metrics trace) follow the call.
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_blocking_executor(), call)
+
+
+def open_resources(db_path: Path) -> None:
+    db_pool(db_path)
+    try:
+        get_openai_client()
+        get_async_openai_client()
+    except OpenAIError:
+        # No API key yet: the first provider call raises, as it always has.
+        pass
+
+
+def close_resources() -> None:
+    global _openai_client, _async_openai_client, _openai_slots, _blocking_executor
+    with _lock:
+        if _blocking_executor is not None:
+            _blocking_executor.shutdown(wait=True)
+            _blocking_executor = None
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        if _openai_client is not None:
+            _openai_client.close()
+            _openai_client = None
+        _async_openai_client = None
+        _openai_slots = None
+
+
+async def aclose_resources() -> None:
+    client = _async_openai_client
+    if client is not None:
+        await client.close()
+    close_resources()
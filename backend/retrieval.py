@@ -0,0 +1,740 @@
+import threading
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+def _as_vector(values: Any) -> np.ndarray:
+    if values is None:
+        return np.empty(0, dtype=np.float32)
+    return np.asarray(values, dtype=np.float32).reshape(-1)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    # Rows with zero norm stay zero; callers mark them invalid.
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    # Highest scores first; ties keep their original row order, which matches
+    # a stable descending sort over the same rows.
+    n = scores.shape[0]
+    if n == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        kth = np.partition(scores, n - top_k)[n - top_k]
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:top_k]]
+
+
+# All chunk embeddings of a corpus as one L2-normalized float32 matrix. Chunks
+# without a usable embedding keep a zero row and always score -1.0, the value
+# the old per-element cosine loop assigned them. Rows outside `live`, when
+# given, are no longer part of the corpus and never appear in results.
+class ChunkMatrix:
+    def __init__(
+        self,
+        note_ids: List[str],
+        note_titles: List[str],
+        chunk_indices: List[int],
+        texts: List[str],
+        matrix: np.ndarray,
+        valid: np.ndarray,
+        generation: int = 0,
+        live: Optional[np.ndarray] = None,
+    ) -> None:
+        self.note_ids = note_ids
+        self.note_titles = note_titles
+        self.chunk_indices = chunk_indices
+        self.texts = texts
+        self.matrix = matrix
+        self.valid = valid
+        self.generation = generation
+        self.live = live
+        self._rows: Optional[Dict[Tuple[str, int], int]] = None
+        # Owner of the (note_id, chunk_index) -> row lookup, shared by masked views.
+        self._keys = self
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def from_notes(cls, notes: Sequence[Dict[str, Any]], dim: Optional[int] = None) -> "ChunkMatrix":
+        note_ids: List[str] = []
+        note_titles: List[str] = []
+        chunk_indices: List[int] = []
+        texts: List[str] = []
+        vectors: List[np.ndarray] = []
+        for note in notes:
+            for position, chunk in enumerate(note.get("chunks", [])):
+                note_ids.append(note["id"])
+                note_titles.append(note.get("title", ""))
+                chunk_indices.append(int(chunk.get("index", position)))
+                texts.append(chunk["text"])
+                vector = _as_vector(chunk.get("embedding"))
+                vectors.append(vector)
+                if dim is None and vector.size:
+                    dim = int(vector.size)
+
+        dim = dim or 0
+        matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+        valid = np.zeros(len(vectors), dtype=bool)
+        for row, vector in enumerate(vectors):
+            if dim and vector.size == dim:
+                matrix[row] = vector
+                valid[row] = True
+        _normalize_rows(matrix)
+        if dim:
+            valid &= np.any(matrix != 0.0, axis=1)
+        return cls(note_ids, note_titles, chunk_indices, texts, matrix, valid)
+
+    @classmethod
+    def concat(cls, blocks: Sequence["ChunkMatrix"], generation: int = 0) -> "ChunkMatrix":
+        dims = [b.dim for b in blocks if len(b) and b.dim]
+        dim = dims[0] if dims else 0
+        parts = [b for b in blocks if len(b)]
+        note_ids: List[str] = []
+        note_titles: List[str] = []
+        chunk_indices: List[int] = []
+        texts: List[str] = []
+        for b in parts:
+            note_ids.extend(b.note_ids)
+            note_titles.extend(b.note_titles)
+            chunk_indices.extend(b.chunk_indices)
+            texts.extend(b.texts)
+        matrix = np.zeros((len(texts), dim), dtype=np.float32)
+        valid = np.zeros(len(texts), dtype=bool)
+        row = 0
+        for b in parts:
+            # Blocks embedded with another model/dimension cannot be compared
+            # with the rest of the corpus and keep zero, invalid rows.
+            if b.dim == dim:
+                matrix[row:row + len(b)] = b.matrix
+                valid[row:row + len(b)] = b.valid
+            row += len(b)
+        return cls(note_ids, note_titles, chunk_indices, texts, matrix, valid, generation)
+
+    def slice(self, start: int, end: int) -> "ChunkMatrix":
+        # Rows [start, end) as a view: the vectors are not copied.
+        return ChunkMatrix(
+            self.note_ids[start:end],
+            self.note_titles[start:end],
+            self.chunk_indices[start:end],
+            self.texts[start:end],
+            self.matrix[start:end],
+            self.valid[start:end],
+            self.generation,
+            self.live[start:end] if self.live is not None else None,
+        )
+
+    def masked(self, live: np.ndarray, generation: int = 0) -> "ChunkMatrix":
+        # The same rows, restricted to `live`; nothing is copied and the key
+        # lookup is built once for this matrix and all its masked views.
+        view = ChunkMatrix(
+            self.note_ids,
+            self.note_titles,
+            self.chunk_indices,
+            self.texts,
+            self.matrix,
+            self.valid,
+            generation,
+            live,
+        )
+        view._keys = self._keys
+        return view
+
+    def live_rows(self) -> int:
+        return len(self) if self.live is None else int(np.count_nonzero(self.live))
+
+    def scores(self, query_emb: Any, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        # Cosine scores for every chunk, or only for `rows` when given.
+        # Rows outside `live` score -inf.
+        query = _as_vector(query_emb)
+        matrix, valid, live = self.matrix, self.valid, self.live
+        if rows is not None:
+            matrix, valid = matrix[rows], valid[rows]
+            live = live[rows] if live is not None else None
+        scores = np.full(len(valid), -1.0, dtype=np.float32)
+        if len(valid) and query.size == self.dim:
+            norm = float(np.linalg.norm(query))
+            if norm != 0.0:
+                raw = matrix @ (query / norm)
+                scores[valid] = raw[valid]
+        if live is not None:
+            scores[~live] = -np.inf
+        return scores
+
+    def row_of(self, note_id: str, chunk_index: int) -> Optional[int]:
+        keys = self._keys
+        if keys._rows is None:
+            keys._rows = {
+                key: row for row, key in enumerate(zip(keys.note_ids, keys.chunk_indices))
+            }
+        row = keys._rows.get((note_id, chunk_index))
+        if row is not None and self.live is not None and not self.live[row]:
+            return None
+        return row
+
+    def score_keys(self, query_emb: Any, keys: Sequence[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        # Dense scores for the given (note_id, chunk_index) keys only, in
+        # key order; keys no longer in the corpus are skipped.
+        rows = [self.row_of(note_id, chunk_index) for note_id, chunk_index in keys]
+        rows = np.asarray([r for r in rows if r is not None], dtype=np.int64)
+        scores = self.scores(query_emb, rows)
+        return [self.chunk_at(int(row), score) for row, score in zip(rows, scores)]
+
+    def chunk_at(self, row: int, score: float) -> Dict[str, Any]:
+        return {
+            "note_id": self.note_ids[row],
+            "note_title": self.note_titles[row],
+            "chunk_index": self.chunk_indices[row],
+            "text": self.texts[row],
+            "score": float(score),
+        }
+
+    def top_rows(self, query_emb: Any, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # The best `top_k` live rows and their scores, best first.
+        scores = self.scores(query_emb)
+        rows = top_k_indices(scores, top_k)
+        if self.live is not None:
+            rows = rows[np.isfinite(scores[rows])]
+        return rows, scores[rows]
+
+    def search(self, query_emb: Any, top_k: int = 5) -> List[Dict[str, Any]]:
+        rows, scores = self.top_rows(query_emb, top_k)
+        return [self.chunk_at(int(row), score) for row, score in zip(rows, scores)]
+
+
+# Several ChunkMatrix segments searched as one corpus: the base matrix of a
+# ChunkIndex, masked to the notes it still serves, next to the blocks of
+# the notes written since, so a write does not copy the whole corpus.
+# Results match a single matrix over the same rows, except that ties
+# between segments are broken by segment order.
+class ChunkSegments:
+    def __init__(self, segments: Sequence[ChunkMatrix], generation: int = 0) -> None:
+        self.segments = [s for s in segments if len(s)]
+        self.generation = generation
+
+    def __len__(self) -> int:
+        return sum(s.live_rows() for s in self.segments)
+
+    def search(self, query_emb: Any, top_k: int = 5) -> List[Dict[str, Any]]:
+        located: List[Tuple[ChunkMatrix, int]] = []
+        parts: List[np.ndarray] = []
+        for segment in self.segments:
+            rows, scores = segment.top_rows(query_emb, top_k)
+            located.extend((segment, int(row)) for row in rows)
+            parts.append(scores)
+        if not located:
+            return []
+        scores = np.concatenate(parts)
+        return [
+            located[i][0].chunk_at(located[i][1], scores[i]) for i in top_k_indices(scores, top_k)
+        ]
+
+    def _locate(self, key: Tuple[str, int]) -> Optional[Tuple[ChunkMatrix, int]]:
+        for segment in self.segments:
+            row = segment.row_of(*key)
+            if row is not None:
+                return segment, row
+        return None
+
+    def score_keys(self, query_emb: Any, keys: Sequence[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        results = []
+        for segment, row in filter(None, map(self._locate, keys)):
+            score = segment.scores(query_emb, np.asarray([row], dtype=np.int64))[0]
+            results.append(segment.chunk_at(row, score))
+        return results
+
+
+def _note_ranges(counts: Iterable[Tuple[str, int]]) -> List[Tuple[str, int, int]]:
+    # (note_id, start, end) of consecutive runs of rows, one per note.
+    ranges = []
+    offset = 0
+    for note_id, count in counts:
+        ranges.append((note_id, offset, offset + count))
+        offset += count
+    return ranges
+
+
+# Process-wide chunk index, built once from the notes table and then patched
+# per note as notes are created, updated or deleted. Every write bumps
+# `generation`; readers get an immutable ChunkSegments snapshot, so searches
+# from the threadpool never observe a half-applied update.
+#
+# Loading puts every vector in one base matrix (or maps a shared one, see
+# load_shared) and each note's block is a view into it. A write gives the
+# note a private block and masks its base rows out, so the next snapshot is
+# the base under a new mask next to the (few) private blocks instead of a
+# copy of the corpus. compact() folds the private blocks back into a new
+# base once they grow.
+#
+# With an `ann_factory` (e.g. IVFFlatIndex from .ann) the index also keeps
+# an approximate-nearest-neighbour structure in sync and searches it once
+# the corpus holds at least `ann_min_vectors` embedded chunks. Once the
+# corpus outgrows `ann_retrain_growth` times the size the ANN was trained
+# on, a retrain is due: retrain_ann() runs it outside the lock (IndexSync
+# starts it in the background, and compact() runs it too); trained
+# centroids are persisted to `ann_path`. ANN hits
+# are rescored against the block vectors before the final top_k.
+class ChunkIndex:
+    def __init__(
+        self,
+        ann_factory: Optional[Callable[[], Any]] = None,
+        ann_path: Optional[Path] = None,
+        ann_min_vectors: int = 0,
+        ann_retrain_growth: float = 4.0,
+    ) -> None:
+        self._lock = threading.Lock()
+        # note_id -> per-note block, in notes.rowid order (oldest first).
+        self._blocks: Dict[str, ChunkMatrix] = {}
+        self._snapshot: Optional[Union[ChunkMatrix, ChunkSegments]] = None
+        self._loaded = False
+        self.generation = 0
+        self.source_generation = 0
+
+        self._base: Optional[ChunkMatrix] = None
+        # note_id -> rows [start, end) of the notes served from the base.
+        self._base_spans: Dict[str, Tuple[int, int]] = {}
+        self._base_views: Dict[str, ChunkMatrix] = {}
+        # Base rows still served; replaced, never modified, on writes.
+        self._live: Optional[np.ndarray] = None
+        self.base_generation: Optional[int] = None
+        self.private_rows = 0
+
+        self._ann_factory = ann_factory
+        self._ann_path = ann_path
+        self._ann_min_vectors = ann_min_vectors
+        self._ann_retrain_growth = ann_retrain_growth
+        # (ann, ANN id -> (block, row), dim), swapped as one reference so a
+        # search never pairs an ANN with another build's id mapping.
+        self._ann_state: Optional[Tuple[Any, Dict[int, Tuple[ChunkMatrix, int]], int]] = None
+        # note_id -> ANN ids of its chunks; ids are never reused.
+        self._ann_ids: Dict[str, List[int]] = {}
+        self._next_ann_id = 0
+        self._ann_retrain_due = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def base_rows(self) -> int:
+        base = self._base
+        return len(base) if base is not None else 0
+
+    @property
+    def ann(self) -> Optional[Any]:
+        # The ANN backend searches currently use, or None before it is built.
+        state = self._ann_state
+        return state[0] if state is not None else None
+
+    @property
+    def dead_rows(self) -> int:
+        # Base rows of notes rewritten or deleted since the base was built.
+        live = self._live
+        return len(live) - int(np.count_nonzero(live)) if live is not None else 0
+
+    def load(self, notes: Sequence[Dict[str, Any]]) -> None:
+        # `notes` is newest first, as _load_note_records returns them.
+        base = ChunkMatrix.from_notes(notes)
+        ranges = _note_ranges((note["id"], len(note.get("chunks", []))) for note in notes)
+        blocks = {note_id: base.slice(start, end) for note_id, start, end in reversed(ranges)}
+        with self._lock:
+            self._blocks = blocks
+            self._set_base(base, ranges, None)
+            self._loaded = True
+            self.generation += 1
+            if self._ann_factory is not None:
+                self._rebuild_ann(restore=True)
+
+    def load_shared(
+        self,
+        base: ChunkMatrix,
+        ranges: Sequence[Tuple[str, int, int]],
+        notes: Sequence[Dict[str, Any]],
+        base_generation: int,
+    ) -> None:
+        # Like load(), but the notes in `ranges` (rows [start, end) of
+        # `base`, newest first) are views into `base`; only `notes` (newest
+        # first) get private blocks.
+        blocks = {note_id: base.slice(start, end) for note_id, start, end in reversed(ranges)}
+        for note in reversed(notes):
+            blocks[note["id"]] = ChunkMatrix.from_notes([note])
+        with self._lock:
+            self._blocks = blocks
+            self._set_base(base, ranges, base_generation)
+            self._loaded = True
+            self.generation += 1
+            if self._ann_factory is not None:
+                self._rebuild_ann(restore=True)
+
+    def rebase(
+        self,
+        matrix: np.ndarray,
+        valid: np.ndarray,
+        ranges: Sequence[Tuple[str, int, int]],
+        base_generation: Optional[int],
+        keep: Collection[str] = (),
+    ) -> int:
+        # Swaps the blocks of the notes in `ranges` (rows [start, end) of
+        # `matrix`, newest first) for views into `matrix`, reusing their
+        # titles and texts. Notes in `keep` (changed since `matrix` was
+        # written) and notes whose row count or dimension differs keep their
+        # block. Returns the number of notes swapped.
+        with self._lock:
+            return self._rebase(matrix, valid, ranges, base_generation, lambda note_id: note_id not in keep)
+
+    def compact(self) -> int:
+        # Copies every block into a new base matrix outside the lock, then
+        # swaps in views of the notes not written meanwhile, and runs a due
+        # ANN retrain. Returns the number of notes swapped.
+        with self._lock:
+            blocks = list(reversed(self._blocks.items()))
+            base_generation = self.base_generation
+        base = ChunkMatrix.concat([block for _, block in blocks])
+        ranges = _note_ranges((note_id, len(block)) for note_id, block in blocks)
+        copied = dict(blocks)
+        with self._lock:
+            swapped = self._rebase(
+                base.matrix,
+                base.valid,
+                ranges,
+                base_generation,
+                lambda note_id: self._blocks.get(note_id) is copied[note_id],
+            )
+        self.retrain_ann()
+        return swapped
+
+    def _rebase(
+        self,
+        matrix: np.ndarray,
+        valid: np.ndarray,
+        ranges: Sequence[Tuple[str, int, int]],
+        base_generation: Optional[int],
+        adopt: Callable[[str], bool],
+    ) -> int:
+        note_ids: List[str] = []
+        note_titles: List[str] = []
+        chunk_indices: List[int] = []
+        texts: List[str] = []
+        adopted: List[Tuple[str, int, int]] = []
+        for note_id, start, end in ranges:
+            block = self._blocks.get(note_id)
+            count = end - start
+            if (
+                block is not None
+                and len(block) == count
+                # Rows of another dimension were stored invalid, as concat does.
+                and (not count or block.dim == matrix.shape[1] or not valid[start:end].any())
+                and adopt(note_id)
+            ):
+                note_ids.extend(block.note_ids)
+                note_titles.extend(block.note_titles)
+                chunk_indices.extend(block.chunk_indices)
+                texts.extend(block.texts)
+                adopted.append((note_id, start, end))
+            else:
+                # Never served: these rows stay outside the live mask.
+                note_ids.extend([note_id] * count)
+                note_titles.extend([""] * count)
+                chunk_indices.extend(range(count))
+                texts.extend([""] * count)
+        base = ChunkMatrix(note_ids, note_titles, chunk_indices, texts, matrix, valid)
+        views = {note_id: base.slice(start, end) for note_id, start, end in adopted}
+        if self._ann_state is not None:
+            # Same vectors at the same rows: the ANN only needs to point at
+            # the new views.
+            ann_rows = self._ann_state[1]
+            for note_id, view in views.items():
+                for ann_id in self._ann_ids.get(note_id, ()):
+                    located = ann_rows.get(ann_id)
+                    if located is not None:
+                        ann_rows[ann_id] = (view, located[1])
+        # Existing keys keep their position in the dict.
+        self._blocks.update(views)
+        self._set_base(base, adopted, base_generation)
+        self.generation += 1
+        return len(adopted)
+
+    def blocks(self) -> List[Tuple[str, ChunkMatrix]]:
+        # Every note's block, newest first; blocks are never mutated.
+        with self._lock:
+            return list(reversed(self._blocks.items()))
+
+    def _set_base(
+        self,
+        base: Optional[ChunkMatrix],
+        ranges: Sequence[Tuple[str, int, int]],
+        base_generation: Optional[int],
+    ) -> None:
+        # Views are the blocks already in self._blocks for `ranges`.
+        self._base = base
+        self._base_spans = {note_id: (start, end) for note_id, start, end in ranges}
+        self._base_views = {note_id: self._blocks[note_id] for note_id, _, _ in ranges}
+        self._live = None
+        if base is not None:
+            self._live = np.zeros(len(base), dtype=bool)
+            for start, end in self._base_spans.values():
+                self._live[start:end] = True
+        self.base_generation = base_generation
+        self.private_rows = sum(
+            len(b) for note_id, b in self._blocks.items() if not self._is_shared(note_id, b)
+        )
+        self._snapshot = None
+
+    def _is_shared(self, note_id: str, block: Optional[ChunkMatrix]) -> bool:
+        return block is not None and self._base_views.get(note_id) is block
+
+    def _unshare(self, note_ids: Collection[str]) -> None:
+        # Masks out the base rows of notes that stop using their view.
+        spans = [self._base_spans.pop(note_id) for note_id in note_ids if note_id in self._base_spans]
+        for note_id in note_ids:
+            self._base_views.pop(note_id, None)
+        if spans:
+            live = self._live.copy()
+            for start, end in spans:
+                live[start:end] = False
+            self._live = live
+
+    def upsert_note(self, note: Dict[str, Any]) -> None:
+        self.upsert_notes([note])
+
+    def upsert_notes(self, notes: Sequence[Dict[str, Any]]) -> None:
+        # Updated notes keep their position; new notes become the newest,
+        # in the order given.
+        blocks = [(note["id"], ChunkMatrix.from_notes([note])) for note in notes]
+        with self._lock:
+            shared = [note_id for note_id, _ in blocks if self._is_shared(note_id, self._blocks.get(note_id))]
+            for note_id, block in blocks:
+                old = self._blocks.get(note_id)
+                if old is not None and not self._is_shared(note_id, old):
+                    self.private_rows -= len(old)
+                self.private_rows += len(block)
+                self._blocks[note_id] = block
+                if self._ann_factory is not None:
+                    self._ann_remove(note_id)
+                    self._ann_add(note_id, block)
+            self._unshare(shared)
+            self._snapshot = None
+            self.generation += 1
+
+    def remove_note(self, note_id: str) -> None:
+        with self._lock:
+            block = self._blocks.pop(note_id, None)
+            if block is None:
+                return
+            if self._is_shared(note_id, block):
+                self._unshare([note_id])
+            else:
+                self.private_rows -= len(block)
+            self._snapshot = None
+            self.generation += 1
+            if self._ann_factory is not None:
+                self._ann_remove(note_id)
+
+    def snapshot(self) -> Union[ChunkMatrix, ChunkSegments]:
+        with self._lock:
+            if self._snapshot is None:
+                if self._base is None:
+                    self._snapshot = ChunkMatrix.concat(
+                        list(reversed(self._blocks.values())), generation=self.generation
+                    )
+                else:
+                    self._snapshot = ChunkSegments(self._segments(), generation=self.generation)
+            return self._snapshot
+
+    def _segments(self) -> List[ChunkMatrix]:
+        # The private blocks (newest first) as one matrix, then the base
+        # masked to the notes that still use their view.
+        private = [
+            block
+            for note_id, block in reversed(self._blocks.items())
+            if not self._is_shared(note_id, block)
+        ]
+        segments = [ChunkMatrix.concat(private)] if private else []
+        segments.append(self._base.masked(self._live, self.generation))
+        return segments
+
+    def search(self, query_emb: Any, top_k: int = 5) -> List[Dict[str, Any]]:
+        state = self._ann_state
+        query = _as_vector(query_emb)
+        norm = float(np.linalg.norm(query)) if query.size else 0.0
+        if (
+            state is None
+            or len(state[0]) < max(self._ann_min_vectors, 1)
+            or query.size != state[2]
+            or norm == 0.0
+        ):
+            return self.snapshot().search(query_emb, top_k=top_k)
+        ann, ann_rows, _ = state
+        query = query / norm
+        # Backends that return a shortlist of approximate matches (e.g.
+        # QuantizedIndex) ask for `rescore_factor` times more candidates;
+        # every candidate is rescored with its full-precision vector.
+        ids, _ = ann.search(query, top_k)
+        located = [ann_rows.get(int(ann_id)) for ann_id in ids]
+        located = [loc for loc in located if loc is not None]
+        if not located:
+            return []
+        scores = np.fromiter(
+            (float(block.matrix[row] @ query) for block, row in located),
+            dtype=np.float32,
+            count=len(located),
+        )
+        return [
+            located[i][0].chunk_at(located[i][1], scores[i]) for i in top_k_indices(scores, top_k)
+        ]
+
+    def score_keys(self, query_emb: Any, keys: Sequence[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        return self.snapshot().score_keys(query_emb, keys)
+
+    def save(self) -> None:
+        with self._lock:
+            if self._ann_state is not None and self._ann_path is not None:
+                self._ann_state[0].save(self._ann_path)
+
+    def _valid_rows(self, block: ChunkMatrix, dim: int) -> np.ndarray:
+        if not len(block) or block.dim != dim:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(block.valid)
+
+    def _assign_ann_ids(self, block: ChunkMatrix, rows: np.ndarray, ann_rows: Dict) -> List[int]:
+        ids = list(range(self._next_ann_id, self._next_ann_id + rows.size))
+        self._next_ann_id += rows.size
+        for ann_id, row in zip(ids, rows):
+            ann_rows[ann_id] = (block, int(row))
+        return ids
+
+    def _ann_add(self, note_id: str, block: ChunkMatrix) -> None:
+        if self._ann_state is None:
+            # Nothing to train on yet; the first embedded note trains it.
+            self._rebuild_ann(restore=False)
+            return
+        ann, ann_rows, dim = self._ann_state
+        rows = self._valid_rows(block, dim)
+        if not rows.size:
+            return
+        ids = self._assign_ann_ids(block, rows, ann_rows)
+        self._ann_ids[note_id] = ids
+        ann.add(ids, block.matrix[rows])
+        if len(ann) > self._ann_retrain_growth * max(ann.trained_on, 1):
+            # New vectors keep going to the current centroids until
+            # retrain_ann() runs, off the write path.
+            self._ann_retrain_due = True
+
+    def _ann_remove(self, note_id: str) -> None:
+        ids = self._ann_ids.pop(note_id, None)
+        if not ids or self._ann_state is None:
+            return
+        ann, ann_rows, _ = self._ann_state
+        ann.remove(ids)
+        for ann_id in ids:
+            ann_rows.pop(ann_id, None)
+
+    def _plan_ann(
+        self, blocks: Dict[str, ChunkMatrix]
+    ) -> Tuple[int, Dict[int, Tuple[ChunkMatrix, int]], Dict[str, List[int]], List[int], List[Tuple[ChunkMatrix, np.ndarray]]]:
+        # ANN ids for the embedded rows of `blocks` in the dimension of the
+        # newest note: (dim, ann_rows, ann_ids, all_ids, [(block, rows)]).
+        dims = [b.dim for b in blocks.values() if len(b) and b.dim and b.valid.any()]
+        dim = dims[-1] if dims else 0
+        ann_rows: Dict[int, Tuple[ChunkMatrix, int]] = {}
+        ann_ids: Dict[str, List[int]] = {}
+        all_ids: List[int] = []
+        selected: List[Tuple[ChunkMatrix, np.ndarray]] = []
+        for note_id, block in blocks.items():
+            rows = self._valid_rows(block, dim)
+            if not rows.size:
+                continue
+            ids = self._assign_ann_ids(block, rows, ann_rows)
+            ann_ids[note_id] = ids
+            all_ids.extend(ids)
+            selected.append((block, rows))
+        return dim, ann_rows, ann_ids, all_ids, selected
+
+    def _build_ann(
+        self, dim: int, all_ids: List[int], selected: List[Tuple[ChunkMatrix, np.ndarray]], restore: bool
+    ) -> Tuple[Any, bool]:
+        # Gathered straight into one training matrix, freed after the build:
+        # a per-block copy of each note's rows would stay in the heap.
+        matrix = np.empty((len(all_ids), dim), dtype=np.float32)
+        offset = 0
+        for block, rows in selected:
+            np.take(block.matrix, rows, axis=0, out=matrix[offset:offset + rows.size])
+            offset += rows.size
+        ann = self._ann_factory()
+        restored = (
+            restore
+            and self._ann_path is not None
+            and ann.load_centroids(self._ann_path, dim)
+            and len(matrix) <= self._ann_retrain_growth * max(ann.trained_on, 1)
+        )
+        if not restored:
+            ann.train(matrix)
+        ann.add(all_ids, matrix)
+        return ann, restored
+
+    def _rebuild_ann(self, restore: bool) -> None:
+        # Builds a fresh ANN next to the live one and swaps it in, so
+        # concurrent searches keep using the old structure until then.
+        dim, ann_rows, ann_ids, all_ids, selected = self._plan_ann(self._blocks)
+        self._ann_retrain_due = False
+        if not selected:
+            self._ann_state, self._ann_ids = None, {}
+            return
+        ann, restored = self._build_ann(dim, all_ids, selected, restore)
+        self._ann_ids = ann_ids
+        self._ann_state = (ann, ann_rows, dim)
+        if not restored and self._ann_path is not None:
+            ann.save(self._ann_path)
+
+    @property
+    def ann_retrain_due(self) -> bool:
+        return self._ann_retrain_due
+
+    def retrain_ann(self) -> bool:
+        # Retrains the ANN once the corpus outgrew it: trains on a copy of
+        # the block list outside the lock, then swaps the new ANN in after
+        # replaying the notes written meanwhile (blocks replaced since the
+        # copy, as in compact()). Returns False when no retrain was due.
+        with self._lock:
+            if not self._ann_retrain_due or self._ann_factory is None:
+                return False
+            self._ann_retrain_due = False
+            blocks = dict(self._blocks)
+            dim, ann_rows, ann_ids, all_ids, selected = self._plan_ann(blocks)
+        if not selected:
+            return False
+        ann, _ = self._build_ann(dim, all_ids, selected, restore=False)
+        with self._lock:
+            for note_id in set(blocks) | set(self._blocks):
+                block = self._blocks.get(note_id)
+                if block is blocks.get(note_id):
+                    continue
+                stale = ann_ids.pop(note_id, None)
+                if stale:
+                    ann.remove(stale)
+                    for ann_id in stale:
+                        ann_rows.pop(ann_id, None)
+                rows = self._valid_rows(block, dim) if block is not None else np.empty(0)
+                if rows.size:
+                    ann_ids[note_id] = self._assign_ann_ids(block, rows, ann_rows)
+                    ann.add(ann_ids[note_id], block.matrix[rows])
+            self._ann_ids = ann_ids
+            self._ann_state = (ann, ann_rows, dim)
+            # Writes meanwhile flagged the old ANN; only the new one counts.
+            self._ann_retrain_due = len(ann) > self._ann_retrain_growth * max(ann.trained_on, 1)
+            if self._ann_path is not None:
+                ann.save(self._ann_path)
+        return True
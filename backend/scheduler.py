@@ -0,0 +1,316 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar
+
+import openai
+
+from . import metrics
+
+# Shared outbound scheduler for OpenAI calls: per-channel token buckets on
+# requests/min and tokens/min, jittered exponential retries that honour
+# Retry-After, and a coalescer that merges concurrent embedding lookups
+# into one batched request. Channels are "embeddings" and "responses"
+# (tagging and answers), matching how the provider meters the two models.
+# Limits are per process; divide the account limits by the worker count.
+
+T = TypeVar("T")
+
+# Tokens reserved for the model's output on top of the prompt estimate.
+OUTPUT_TOKEN_ALLOWANCE = 512
+# Seconds of traffic a full bucket lets through at once.
+BURST_SECONDS = 10.0
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # Reservation-style bucket: reserve() always succeeds and returns how
+    # long the caller must wait, so sync and async callers share it and are
+    # served in arrival order. per_minute <= 0 means unlimited.
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= amount
+            return max(0.0, -self._level / self.rate)
+
+
+class OutboundScheduler:
+    def __init__(
+        self,
+        channel: str,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+    ) -> None:
+        self.channel = channel
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        delay = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        with self._lock:
+            delay = max(delay, self._paused_until - time.monotonic())
+        if delay > 0:
+            metrics.OPENAI_THROTTLE_SECONDS.inc(self.channel, amount=delay)
+        return delay
+
+    def _retry_delay(self, exc: Exception, attempt: int) -> Optional[float]:
+        # None when the error is not worth retrying or retries are used up.
+        status = getattr(exc, "status_code", None)
+        retryable = isinstance(exc, openai.APIConnectionError) or (
+            isinstance(exc, openai.APIStatusError) and status in _RETRYABLE_STATUS
+        )
+        if not retryable or attempt >= self.max_retries:
+            return None
+        # Full jitter keeps callers that failed together from retrying together.
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        if status == 429:
+            # The provider is already over the limit: hold every caller on
+            # this channel, not only the one that was refused.
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        metrics.OPENAI_RETRIES.inc(self.channel, str(status or type(exc).__name__))
+        return delay
+
+    def call(self, fn: Callable[[], T], tokens: int = 0) -> T:
+        attempt = 0
+        while True:
+            delay = self._reserve(tokens)
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                return fn()
+            except Exception as exc:
+                delay = self._retry_delay(exc, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        attempt = 0
+        while True:
+            delay = self._reserve(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await fn()
+            except Exception as exc:
+                delay = self._retry_delay(exc, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value) * scale
+        except ValueError:
+            continue
+    return None
+
+
+_schedulers: Dict[str, OutboundScheduler] = {}
+_lock = threading.Lock()
+
+# Environment variables holding the (requests/min, tokens/min) limits of
+# each channel; unset or 0 means no client-side limit.
+_LIMIT_ENV = {
+    "embeddings": ("OPENAI_EMBEDDING_RPM", "OPENAI_EMBEDDING_TPM"),
+    "responses": ("OPENAI_RPM", "OPENAI_TPM"),
+}
+
+
+def scheduler(channel: str) -> OutboundScheduler:
+    sched = _schedulers.get(channel)
+    if sched is None:
+        with _lock:
+            sched = _schedulers.get(channel)
+            if sched is None:
+                rpm_env, tpm_env = _LIMIT_ENV[channel]
+                sched = OutboundScheduler(
+                    channel,
+                    requests_per_minute=float(os.getenv(rpm_env, "0")),
+                    tokens_per_minute=float(os.getenv(tpm_env, "0")),
+                    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "5")),
+                    base_delay=float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5")),
+                    max_delay=float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20")),
+                )
+                _schedulers[channel] = sched
+    return sched
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.items: List[Any] = []
+        self.callers = 0
+        self.result: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.future: Optional[asyncio.Future] = None
+        self.afull: Optional[asyncio.Event] = None
+
+
+# Merges the items of calls that arrive within `window` seconds into one
+# call of `send` (threads) or `asend` (event loop), then hands each caller
+# its slice of the result. The first caller of a window sends the batch;
+# on the event loop a task does, so a cancelled caller does not strand the
+# others. The window is only waited out while another batch is in flight,
+# so a lone caller is sent at once, and a batch closes early once it holds
+# `max_items`. If a merged batch fails, each of its callers sends its own
+# items again, so a bad input only fails the caller that passed it.
+class Coalescer:
+    def __init__(
+        self,
+        send: Callable[[List[Any]], List[Any]],
+        asend: Callable[[List[Any]], Awaitable[List[Any]]],
+        window: float,
+        max_items: int = 2048,
+    ) -> None:
+        self._send = send
+        self._asend = asend
+        self.window = window
+        self.max_items = max_items
+        self._open: Optional[_Batch] = None
+        self._aopen: Optional[_Batch] = None
+        self._aloop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: set = set()
+        self._sending = 0
+        self._lock = threading.Lock()
+
+    def _join(self, batch: _Batch, items: Sequence[Any]) -> int:
+        start = len(batch.items)
+        batch.items.extend(items)
+        batch.callers += 1
+        return start
+
+    def _close(self, batch: _Batch) -> None:
+        with self._lock:
+            if self._open is batch:
+                self._open = None
+            if self._aopen is batch:
+                self._aopen = None
+            self._sending += 1
+        metrics.COALESCED_CALLERS.observe(batch.callers)
+
+    def _sent(self) -> None:
+        with self._lock:
+            self._sending -= 1
+
+    def _busy(self) -> bool:
+        with self._lock:
+            return self._sending > 0
+
+    def submit(self, items: Sequence[Any]) -> List[Any]:
+        if self.window <= 0:
+            return self._send(list(items))
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            start = self._join(batch, items)
+            if len(batch.items) >= self.max_items:
+                self._open = None
+                batch.full.set()
+        if leader:
+            if self._busy():
+                batch.full.wait(self.window)
+            self._close(batch)
+            try:
+                batch.result = self._send(batch.items)
+            except BaseException as exc:
+                batch.error = exc
+            finally:
+                self._sent()
+            batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            if batch.callers == 1 or not isinstance(batch.error, Exception):
+                raise batch.error
+            return self._send(list(items))
+        return batch.result[start:start + len(items)]
+
+    async def asubmit(self, items: Sequence[Any]) -> List[Any]:
+        if self.window <= 0:
+            return await self._asend(list(items))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            batch = self._aopen if self._aloop is loop else None
+            if batch is None:
+                batch = self._aopen = _Batch()
+                self._aloop = loop
+                batch.future = loop.create_future()
+                batch.afull = asyncio.Event()
+                task = loop.create_task(self._aflush(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            start = self._join(batch, items)
+            if len(batch.items) >= self.max_items:
+                self._aopen = None
+                batch.afull.set()
+        try:
+            result = await asyncio.shield(batch.future)
+        except Exception:
+            if batch.callers == 1:
+                raise
+            return await self._asend(list(items))
+        return result[start:start + len(items)]
+
+    async def _aflush(self, batch: _Batch) -> None:
+        # Callers of the same event loop step join before the first check.
+        await asyncio.sleep(0)
+        if self._busy() and not batch.afull.is_set():
+            try:
+                await asyncio.wait_for(batch.afull.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+        self._close(batch)
+        try:
+            result = await self._asend(batch.items)
+        except asyncio.CancelledError:
+            batch.future.cancel()
+            raise
+        except Exception as exc:
+            batch.future.set_exception(exc)
+            # Retrieved here so an unawaited failure is not logged as lost.
+            batch.future.exception()
+        else:
+            batch.future.set_result(result)
+        finally:
+            self._sent()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List
+from typing import List, Literal, Optional
 
 class Tag(BaseModel):
     model_config = ConfigDict(extra="forbid")
@@ -28,10 +28,25 @@ class NoteResponse(BaseModel):
     tags: List[str]
     embedding: List[float] = Field(default_factory=list)
 
+class NoteProjection(BaseModel):
+    # GET /api/notes and /api/notes/{id}: only the fields asked for with
+    # `fields` are present (default: id, title, content, tags).
+    model_config = ConfigDict(extra="forbid")
+    id: Optional[str] = None
+    title: Optional[str] = None
+    content: Optional[str] = None
+    tags: Optional[List[str]] = None
+    embedding: Optional[List[float]] = None
+
 class AskRequest(BaseModel):
     model_config = ConfigDict(extra="forbid")
     question: str = Field(..., min_length=1)
     top_k: int = Field(5, ge=1, le=10)
+    retrieval_mode: Literal["dense", "hybrid", "prefilter"] = Field(
+        "dense",
+        description="dense: vector scan; hybrid: BM25 + vector fused with RRF; "
+        "prefilter: vector scoring of BM25 candidates only",
+    )
 
 class Citation(BaseModel):
     model_config = ConfigDict(extra="forbid")
@@ -43,3 +58,30 @@ class AskResponse(BaseModel):
     model_config = ConfigDict(extra="forbid")
     answer: str
     citations: List[Citation]
+
+class EnrichmentStatus(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    note_id: str
+    status: str
+    revision: int
+    attempts: int = 0
+    error: Optional[str] = None
+    updated_at: Optional[float] = None
+    chunks_reused: Optional[int] = None
+    chunks_embedded: Optional[int] = None
+
+class BulkImportError(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    line: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    imported: int
+    chunks: int
+    failed: int
+    pending_enrichment: int
+    errors: List[BulkImportError]
+    seconds: float
+    notes_per_s: float
+    chunks_per_s: float
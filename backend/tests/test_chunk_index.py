@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from backend.ann import IVFFlatIndex
+from backend.quantize import QuantizedIndex
+from backend.retrieval import ChunkIndex
+
+DIM = 16
+
+
+def _note(rng, note_id: str, chunks: int = 4) -> dict:
+    return {
+        "id": note_id,
+        "title": note_id,
+        "chunks": [
+            {"index": i, "text": f"{note_id}-{i}", "embedding": rng.standard_normal(DIM).tolist()}
+            for i in range(chunks)
+        ],
+    }
+
+
+def _exact(notes: dict, query: np.ndarray, top_k: int) -> list:
+    scored = []
+    for note in notes.values():
+        for chunk in note["chunks"]:
+            vector = np.asarray(chunk["embedding"], dtype=np.float32)
+            score = float(vector @ query / (np.linalg.norm(vector) * np.linalg.norm(query)))
+            scored.append((score, (note["id"], chunk["index"])))
+    return [key for _, key in sorted(scored, reverse=True)[:top_k]]
+
+
+def _keys(results: list) -> list:
+    return [(r["note_id"], r["chunk_index"]) for r in results]
+
+
+def _check(index: ChunkIndex, notes: dict, rng) -> None:
+    for _ in range(10):
+        query = rng.standard_normal(DIM)
+        assert _keys(index.search(query, 8)) == _exact(notes, query, 8)
+
+
+@pytest.mark.parametrize(
+    "factory",
+    [
+        None,
+        lambda: IVFFlatIndex(nlist=4, nprobe=4),
+        lambda: QuantizedIndex(kind="int8", rescore_factor=100),
+    ],
+    ids=["exact", "ivf", "int8"],
+)
+def test_upsert_remove_compact_match_exact_search(factory):
+    rng = np.random.default_rng(0)
+    notes = {f"n{i}": _note(rng, f"n{i}") for i in range(30)}
+    index = ChunkIndex(ann_factory=factory)
+    index.load(list(reversed(notes.values())))
+    _check(index, notes, rng)
+
+    for i in range(0, 30, 3):
+        notes[f"n{i}"] = _note(rng, f"n{i}", chunks=2)
+        index.upsert_note(notes[f"n{i}"])
+    for i in range(1, 30, 5):
+        del notes[f"n{i}"]
+        index.remove_note(f"n{i}")
+    for i in range(30, 40):
+        notes[f"n{i}"] = _note(rng, f"n{i}")
+        index.upsert_note(notes[f"n{i}"])
+    assert index.dead_rows > 0
+    _check(index, notes, rng)
+
+    index.compact()
+    assert index.dead_rows == 0
+    assert index.private_rows == 0
+    _check(index, notes, rng)
+
+
+def test_ann_retrain_runs_off_the_write_path():
+    rng = np.random.default_rng(1)
+    notes = {f"n{i}": _note(rng, f"n{i}") for i in range(10)}
+    index = ChunkIndex(ann_factory=lambda: IVFFlatIndex(nlist=4, nprobe=4), ann_retrain_growth=2.0)
+    index.load(list(reversed(notes.values())))
+    trained_on = index.ann.trained_on
+    for i in range(10, 40):
+        notes[f"n{i}"] = _note(rng, f"n{i}")
+        index.upsert_note(notes[f"n{i}"])
+    assert index.ann_retrain_due
+    assert index.ann.trained_on == trained_on
+    _check(index, notes, rng)
+
+    assert index.retrain_ann()
+    assert not index.ann_retrain_due
+    assert index.ann.trained_on == sum(len(n["chunks"]) for n in notes.values())
+    _check(index, notes, rng)
@@ -0,0 +1,50 @@
+import random
+
+from backend.embed import chunk_text, note_input
+
+
+def _prose(sentences: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(500)]
+    return " ".join(
+        " ".join(rng.choice(words) for _ in range(rng.randint(6, 24))) + "." for _ in range(sentences)
+    )
+
+
+def _reused(before: list, after: list) -> int:
+    return len(set(before) & set(after))
+
+
+def test_chunks_respect_max_words():
+    for chunk in chunk_text(_prose(300), max_words=200):
+        assert len(chunk.split()) <= 200
+
+
+def test_insert_at_top_keeps_later_chunks():
+    text = _prose(300)
+    before = chunk_text(text)
+    after = chunk_text("A brand new opening sentence about something else. " + text)
+    assert len(before) > 10
+    assert _reused(before, after) >= len(before) - 2
+
+
+def test_edit_in_the_middle_keeps_chunks_away_from_it():
+    sentences = _prose(300).split(". ")
+    before = chunk_text(". ".join(sentences))
+    sentences[150] = "this sentence was rewritten entirely"
+    after = chunk_text(". ".join(sentences))
+    assert _reused(before, after) >= len(before) - 3
+
+
+def test_unpunctuated_text_keeps_chunks_after_an_insert():
+    rng = random.Random(1)
+    text = " ".join(f"w{rng.randrange(1000)}" for _ in range(2000))
+    before = chunk_text(text)
+    after = chunk_text("inserted " + text)
+    assert _reused(before, after) >= len(before) * 0.8
+
+
+def test_note_input_is_cut_to_the_token_limit(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_MAX_INPUT_TOKENS", "100")
+    assert note_input("Title", "short") == "Title\n\nshort"
+    assert len(note_input("Title", "x" * 10_000)) == 300
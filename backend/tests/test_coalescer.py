@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.scheduler import Coalescer
+
+
+class _Provider:
+    # Upper-cases its items; any batch containing "bad" fails.
+    def __init__(self, delay: float = 0.05) -> None:
+        self.delay = delay
+        self.batches = []
+
+    def send(self, items):
+        self.batches.append(list(items))
+        time.sleep(self.delay)
+        if "bad" in items:
+            raise ValueError("bad input")
+        return [item.upper() for item in items]
+
+    async def asend(self, items):
+        self.batches.append(list(items))
+        await asyncio.sleep(self.delay)
+        if "bad" in items:
+            raise ValueError("bad input")
+        return [item.upper() for item in items]
+
+
+def test_a_failed_batch_only_fails_the_caller_with_the_bad_input():
+    provider = _Provider()
+    coalescer = Coalescer(provider.send, provider.asend, window=0.5)
+    results = {}
+
+    def call(key, items):
+        try:
+            results[key] = coalescer.submit(items)
+        except ValueError as exc:
+            results[key] = exc
+
+    threads = [threading.Thread(target=call, args=(i, items)) for i, items in enumerate([["x"], ["a"], ["bad"], ["b", "c"]])]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    assert results[0] == ["X"]
+    assert results[1] == ["A"]
+    assert isinstance(results[2], ValueError)
+    assert results[3] == ["B", "C"]
+    # The first caller went alone; the next three were merged, then resent.
+    assert provider.batches[1] == ["a", "bad", "b", "c"]
+
+
+def test_async_failed_batch_is_isolated_per_caller():
+    provider = _Provider()
+    coalescer = Coalescer(provider.send, provider.asend, window=0.5)
+
+    async def run():
+        return await asyncio.gather(
+            coalescer.asubmit(["p"]),
+            coalescer.asubmit(["bad"]),
+            coalescer.asubmit(["q", "r"]),
+            return_exceptions=True,
+        )
+
+    first, second, third = asyncio.run(run())
+    assert first == ["P"]
+    assert isinstance(second, ValueError)
+    assert third == ["Q", "R"]
+    assert provider.batches[0] == ["p", "bad", "q", "r"]
+
+
+def test_a_lone_caller_does_not_wait_out_the_window():
+    provider = _Provider(delay=0)
+    coalescer = Coalescer(provider.send, provider.asend, window=1.0)
+    start = time.perf_counter()
+    assert coalescer.submit(["a"]) == ["A"]
+    assert asyncio.run(coalescer.asubmit(["b"])) == ["B"]
+    assert time.perf_counter() - start < 0.5
+
+
+def test_async_full_batch_is_sent_without_waiting_out_the_window():
+    provider = _Provider()
+    coalescer = Coalescer(provider.send, provider.asend, window=1.0, max_items=4)
+
+    async def run():
+        first = asyncio.ensure_future(coalescer.asubmit(["z"]))
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        merged = await asyncio.gather(coalescer.asubmit(["1", "2"]), coalescer.asubmit(["3", "4"]))
+        return merged, time.perf_counter() - start, await first
+
+    merged, elapsed, first = asyncio.run(run())
+    assert merged == [["1", "2"], ["3", "4"]]
+    assert first == ["Z"]
+    assert elapsed < 0.5
+
+
+@pytest.mark.parametrize("window", [0.0, 0.01])
+def test_single_caller_errors_are_raised(window):
+    provider = _Provider(delay=0)
+    coalescer = Coalescer(provider.send, provider.asend, window=window)
+    with pytest.raises(ValueError):
+        coalescer.submit(["bad"])
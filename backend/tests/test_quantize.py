@@ -0,0 +1,31 @@
+import numpy as np
+
+from backend.quantize import QuantizedIndex
+
+
+def _index(count: int = 50) -> QuantizedIndex:
+    vectors = np.random.default_rng(0).standard_normal((count, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = QuantizedIndex(kind="int8")
+    index.train(vectors)
+    index.add(list(range(count)), vectors)
+    return index
+
+
+def test_remove_counts_each_stored_id_once():
+    index = _index()
+    index.remove([1, 2, 3])
+    index.remove([1, 2])
+    index.remove([999])
+    index.remove([3, 4])
+    assert len(index) == 46
+    index._compact()
+    assert len(index) == 46
+
+
+def test_removed_ids_are_not_returned():
+    index = _index()
+    index.remove([7])
+    ids, _ = index.search(np.eye(16, dtype=np.float32)[0], 50)
+    assert 7 not in ids.tolist()
+    assert len(ids) == 49
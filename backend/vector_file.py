@@ -0,0 +1,148 @@
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .retrieval import ChunkMatrix
+
+# Snapshot of every chunk vector in one float32 .npy file that worker
+# processes memory-map read-only, so its pages are shared through the OS
+# page cache instead of each process holding a private copy. A snapshot
+# belongs to one `notes` generation and is written as <generation>.npy plus
+# <generation>.meta.npz (note ids, row offsets, chunk indices, valid mask);
+# the meta file is renamed into place last and marks a complete snapshot.
+# Publishing unlinks older snapshots; processes still mapping one keep
+# reading it until they move on.
+
+_META = re.compile(r"^(\d{12})\.meta\.npz$")
+
+
+class VectorFile:
+    def __init__(
+        self,
+        generation: int,
+        note_ids: List[str],
+        offsets: np.ndarray,
+        chunk_indices: np.ndarray,
+        valid: np.ndarray,
+        matrix: np.ndarray,
+    ) -> None:
+        self.generation = generation
+        self.note_ids = note_ids
+        self.offsets = offsets
+        self.chunk_indices = chunk_indices
+        self.valid = valid
+        self.matrix = matrix
+
+    def ranges(self) -> List[Tuple[str, int, int]]:
+        # (note_id, start, end) per note, newest first.
+        bounds = self.offsets.tolist()
+        return [(note_id, bounds[i], bounds[i + 1]) for i, note_id in enumerate(self.note_ids)]
+
+
+def _generations(directory: Path) -> List[int]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((int(m.group(1)) for m in map(_META.match, names) if m), reverse=True)
+
+
+def stamp(directory: Path) -> Optional[int]:
+    # Changes whenever a snapshot is published or removed.
+    try:
+        return os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def latest_generation(directory: Path) -> Optional[int]:
+    generations = _generations(directory)
+    return generations[0] if generations else None
+
+
+def open_latest(directory: Path) -> Optional[VectorFile]:
+    for generation in _generations(directory):
+        name = f"{generation:012d}"
+        try:
+            with np.load(directory / f"{name}.meta.npz") as meta:
+                note_ids = meta["note_ids"].tolist()
+                offsets = meta["offsets"]
+                chunk_indices = meta["chunk_indices"]
+                valid = meta["valid"]
+            matrix = np.load(directory / f"{name}.npy", mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            # Unlinked by a newer publish, or unreadable: try the next one.
+            continue
+        if matrix.ndim != 2 or matrix.shape[0] != int(offsets[-1]) or len(valid) != matrix.shape[0]:
+            continue
+        return VectorFile(generation, note_ids, offsets, chunk_indices, valid, matrix)
+    return None
+
+
+def publish(directory: Path, generation: int, blocks: Sequence[Tuple[str, ChunkMatrix]]) -> bool:
+    # Writes the blocks (newest first) as the snapshot of `generation`.
+    # Blocks of another dimension than the first keep zero, invalid rows,
+    # as in ChunkMatrix.concat. Returns False when there is nothing to map.
+    dims = [b.dim for _, b in blocks if len(b) and b.dim]
+    dim = dims[0] if dims else 0
+    offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+    np.cumsum([len(b) for _, b in blocks], out=offsets[1:])
+    rows = int(offsets[-1])
+    if not rows or not dim:
+        return False
+
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{generation:012d}"
+    tmp = directory / f".{name}.{os.getpid()}"
+    matrix = np.lib.format.open_memmap(f"{tmp}.npy", mode="w+", dtype=np.float32, shape=(rows, dim))
+    valid = np.zeros(rows, dtype=bool)
+    chunk_indices = np.zeros(rows, dtype=np.int64)
+    for (_, block), start in zip(blocks, offsets[:-1].tolist()):
+        end = start + len(block)
+        chunk_indices[start:end] = block.chunk_indices
+        if len(block) and block.dim == dim:
+            matrix[start:end] = block.matrix
+            valid[start:end] = block.valid
+    matrix.flush()
+    del matrix
+    os.replace(f"{tmp}.npy", directory / f"{name}.npy")
+    with open(f"{tmp}.meta.npz", "wb") as f:
+        np.savez(
+            f,
+            note_ids=np.array([note_id for note_id, _ in blocks], dtype=str),
+            offsets=offsets,
+            chunk_indices=chunk_indices,
+            valid=valid,
+        )
+    os.replace(f"{tmp}.meta.npz", directory / f"{name}.meta.npz")
+
+    for older in _generations(directory):
+        if older < generation:
+            for suffix in (".meta.npz", ".npy"):
+                try:
+                    (directory / f"{older:012d}{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
+    return True
+
+
+@contextmanager
+def publish_lock(directory: Path, blocking: bool = False) -> Iterator[bool]:
+    # Yields True while this process holds the publisher lock; without
+    # `blocking`, False when another process is already publishing.
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / ".lock", "a+b") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,4 +1,4 @@
-import { useEffect, useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import { v4 as uuidv4 } from "uuid"
 
 export interface Note {
@@ -81,7 +81,10 @@ export const useNotes = ({ mock = false }: UseNotesOptions = {}) => {
         if (mock) {
           data = await mockFetchNotes()
         } else {
-          const response = await fetch("/api/notes", { method: "GET" })
+          // The graph view needs embeddings, which the list omits by default.
+          const response = await fetch("/api/notes?fields=id,title,content,tags,embedding", {
+            method: "GET",
+          })
           if (!response.ok) {
             throw new Error(`GET /api/notes failed with status ${response.status}`)
           }
@@ -101,6 +104,39 @@ export const useNotes = ({ mock = false }: UseNotesOptions = {}) => {
     return [updated, ...without]
   }
 
+  // =======================
+  // Enrichment refresh
+  // =======================
+  // Saves return the previous tags/embedding while the backend enriches the
+  // note in the background. Poll the job until it settles, then fetch the
+  // new tags and embedding. A newer save of the same note cancels the poll.
+  const enrichmentPolls = useRef(new Map<string, number>())
+
+  const refreshWhenEnriched = async (id: string) => {
+    const token = (enrichmentPolls.current.get(id) ?? 0) + 1
+    enrichmentPolls.current.set(id, token)
+    const current = () => enrichmentPolls.current.get(id) === token
+
+    let delay = 500
+    for (let attempt = 0; attempt < 30; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, delay))
+      if (!current()) return
+      delay = Math.min(delay * 2, 5000)
+
+      const response = await fetch(`/api/notes/${id}/enrichment`, { method: "GET" })
+      if (response.status === 404) return
+      if (!response.ok) continue
+      const job = (await response.json()) as { status: string }
+      if (job.status === "pending" || job.status === "running") continue
+
+      const noteResponse = await fetch(`/api/notes/${id}?fields=tags,embedding`, { method: "GET" })
+      if (!noteResponse.ok || !current()) return
+      const enriched = (await noteResponse.json()) as Pick<Note, "tags" | "embedding">
+      setNotes((prev) => prev.map((n) => (n.id === id ? { ...n, ...enriched } : n)))
+      return
+    }
+  }
+
   
   // Save / Update Note
   // Performs optimistic local update first, then merges backend result
@@ -146,6 +182,7 @@ export const useNotes = ({ mock = false }: UseNotesOptions = {}) => {
         }
   
         updatedNote = (await response.json()) as Note
+        refreshWhenEnriched(id).catch((err) => console.error("Failed to refresh enrichment:", err))
       }
   
       // 3) Merge backend result + keep title/content authoritative + bump to top again